@@ -0,0 +1,390 @@
+"""Offline throughput benchmarks for the bot's hot paths.
+
+Runs the real cogs and commands against benchmarks.fake_discord, in a
+throwaway working directory, and reports events/sec, p50/p99 handler
+latency, event-loop lag and bytes written per scenario.
+
+    python -m benchmarks.bench                        # every scenario
+    python -m benchmarks.bench join button --members 5000 --latency 0.05
+    python -m benchmarks.bench cleanup --rate-limit-chance 0.05 --json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+GUILD_ID = 1
+MEMBER_ROLE_ID = 2
+UNVERIFIED_ROLE_ID = 3
+WELCOME_CHANNEL_ID = 10
+LOGS_CHANNEL_ID = 11
+FIRST_SCHEDULE_CHANNEL_ID = 100
+FIRST_MEMBER_ID = 10_000
+
+SCENARIOS = ('join', 'button', 'assign', 'cleanup', 'daily')
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def bytes_written():
+    """Bytes this process has passed to write() so far (Linux), else None"""
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('wchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+
+
+def directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class LoopLagMonitor:
+    """Samples how late a short sleep wakes up, i.e. how long the loop was blocked"""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = []
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - start - self.interval))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
+class Measurement:
+    def __init__(self, name, workdir):
+        self.name = name
+        self.workdir = workdir
+        self.latencies = []
+        self.events = 0
+        self.lag = LoopLagMonitor()
+
+    async def __aenter__(self):
+        self._bytes = bytes_written()
+        self._size = directory_size(self.workdir)
+        self.lag.start()
+        self._started = time.perf_counter()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.wall = time.perf_counter() - self._started
+        await self.lag.stop()
+        end = bytes_written()
+        self.written = end - self._bytes if end is not None and self._bytes is not None else None
+        self.size_delta = directory_size(self.workdir) - self._size
+
+    async def timed(self, coro):
+        start = time.perf_counter()
+        try:
+            return await coro
+        finally:
+            self.latencies.append(time.perf_counter() - start)
+            self.events += 1
+
+    def result(self, rest, **extra):
+        result = {
+            'scenario': self.name,
+            'events': self.events,
+            'wall_s': round(self.wall, 3),
+            'events_per_s': round(self.events / self.wall, 1) if self.wall else 0.0,
+            'p50_ms': round(percentile(self.latencies, 0.50) * 1000, 2),
+            'p99_ms': round(percentile(self.latencies, 0.99) * 1000, 2),
+            'loop_lag_p99_ms': round(percentile(self.lag.samples, 0.99) * 1000, 2),
+            'loop_lag_max_ms': round(max(self.lag.samples, default=0.0) * 1000, 2),
+            'bytes_written': self.written,
+            'disk_delta_bytes': self.size_delta,
+            'api_requests': rest.requests,
+            'rate_limited': rest.rate_limited,
+        }
+        result.update(extra)
+        return result
+
+
+def configure_environment(args, workdir):
+    """Point every setting at the fake guild before any bot module is imported"""
+    os.environ.update({
+        'GUILD_ID': str(GUILD_ID),
+        'MEMBER_ROLE_ID': str(MEMBER_ROLE_ID),
+        'UNVERIFIED_ROLE_ID': str(UNVERIFIED_ROLE_ID),
+        'WELCOME_CHANNEL_ID': str(WELCOME_CHANNEL_ID),
+        'LOGS_CHANNEL_ID': str(LOGS_CHANNEL_ID),
+        'ROLE_ASSIGNMENT_DELAY': '0',
+        'DATABASE_FILE': os.path.join(workdir, 'bench.db'),
+        'GLOBAL_CLICK_RATE': str(args.click_rate),
+        'LOG_SINK_FLUSH_INTERVAL': '0.05',
+    })
+    if args.sync_rate is not None:
+        os.environ['ROLE_SYNC_RATE'] = str(args.sync_rate)
+
+    # The fake guild has no message history to search and every invoker is an admin;
+    # patch before the cogs and commands bind these names
+    import utils
+
+    async def get_or_create_welcome_message(channel, embed, view):
+        return await channel.send(embed=embed)
+
+    utils.get_or_create_welcome_message = get_or_create_welcome_message
+    utils.is_authorized_guild_or_owner = lambda interaction: True
+
+
+def build_guild(args, rest):
+    from benchmarks.fake_discord import FakeBot, FakeGuild
+
+    guild = FakeGuild(rest, GUILD_ID)
+    guild.add_role(MEMBER_ROLE_ID, 'Member', position=2)
+    guild.add_role(UNVERIFIED_ROLE_ID, 'Unverified', position=1)
+    for index in range(args.roles):
+        guild.add_role(1000 + index, f'extra-{index}', position=3 + index)
+    guild.add_channel(WELCOME_CHANNEL_ID, 'welcome')
+    guild.add_channel(LOGS_CHANNEL_ID, 'logs')
+    for index in range(args.channels):
+        guild.add_channel(FIRST_SCHEDULE_CHANNEL_ID + index, f'scheduled-{index}')
+
+    bot = FakeBot(guild)
+    return guild, bot
+
+
+async def attach_runtime(bot):
+    from config import handles, reload_settings
+    from log_sink import LogSink
+
+    reload_settings(read_dotenv=False)
+    handles.bind(bot)
+    bot.log_sink = LogSink(bot, LOGS_CHANNEL_ID)
+    bot.log_sink.start()
+
+
+async def finish(bot):
+    from storage import aclose_user_store
+
+    await bot.log_sink.close()
+    await aclose_user_store()
+
+
+async def run_batches(measurement, coros, concurrency):
+    """Await coroutines with at most `concurrency` in flight"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(coro):
+        async with semaphore:
+            await measurement.timed(coro)
+
+    await asyncio.gather(*(one(coro) for coro in coros))
+
+
+async def bench_join(args, rest, workdir):
+    from cogs.welcome import Welcome
+
+    guild, bot = build_guild(args, rest)
+    await attach_runtime(bot)
+    cog = Welcome(bot)
+    await bot.add_cog(cog)
+    await cog.cog_load()
+
+    members = [guild.add_member(FIRST_MEMBER_ID + index) for index in range(args.members)]
+    async with Measurement('join', workdir) as m:
+        for member in members:
+            await m.timed(cog.on_member_join(member))
+        await cog.state(GUILD_ID).join_pipeline._queue.join()
+        await finish(bot)
+    stats = cog.state(GUILD_ID).join_pipeline.stats()
+    await cog.cog_unload()
+    return m.result(rest, raid_mode_entered=stats['raids'] > 0, max_queue_lag_s=stats['max_lag'],
+                    log_messages=bot.log_sink.sent_messages)
+
+
+async def bench_button(args, rest, workdir):
+    from benchmarks.fake_discord import FakeInteraction
+    from cogs.verification import OnboardingButton
+    from cogs.welcome import Welcome
+
+    guild, bot = build_guild(args, rest)
+    await attach_runtime(bot)
+    cog = Welcome(bot)
+    await bot.add_cog(cog)
+    await cog.cog_load()
+    button = OnboardingButton()
+    channel = guild.get_channel(WELCOME_CHANNEL_ID)
+    members = [guild.add_member(FIRST_MEMBER_ID + index, [UNVERIFIED_ROLE_ID]) for index in range(args.members)]
+
+    async with Measurement('button', workdir) as m:
+        await run_batches(m, (button.callback(FakeInteraction(bot, member, channel)) for member in members), args.concurrency)
+        await finish(bot)
+    await cog.cog_unload()
+    return m.result(rest, limited_user=button.limiter.limited_user, limited_global=button.limiter.limited_global)
+
+
+async def bench_assign(args, rest, workdir):
+    from cogs.welcome import Welcome
+    from storage import get_user_store
+
+    guild, bot = build_guild(args, rest)
+    await attach_runtime(bot)
+    cog = Welcome(bot)
+    await bot.add_cog(cog)
+    await cog.cog_load()
+
+    store = get_user_store()
+    clicked_at = time.time() - 3600
+    records = {}
+    for index in range(args.members):
+        member = guild.add_member(FIRST_MEMBER_ID + index, [UNVERIFIED_ROLE_ID])
+        records[member.id] = {'joined_at': clicked_at, 'button_clicked_at': clicked_at,
+                              'unverified_role_assigned': True}
+    await store.aflush()
+    store.store.upsert_many(records)
+
+    async with Measurement('assign', workdir) as m:
+        await run_batches(m, (cog.check_and_assign_roles(user_id) for user_id in records), args.concurrency)
+        await finish(bot)
+    await cog.cog_unload()
+    return m.result(rest)
+
+
+async def bench_cleanup(args, rest, workdir):
+    from benchmarks.fake_discord import FakeInteraction
+    from commands import remove_member_role, deferred
+
+    guild, bot = build_guild(args, rest)
+    await attach_runtime(bot)
+    await remove_member_role.setup(bot)
+    cleanup_roles = bot.tree.commands['cleanup_roles']
+    for index in range(args.members):
+        # Every other member holds both roles and needs the Unverified role removed
+        roles = [MEMBER_ROLE_ID, UNVERIFIED_ROLE_ID] if index % 2 == 0 else [MEMBER_ROLE_ID]
+        guild.add_member(FIRST_MEMBER_ID + index, roles)
+    admin = guild.add_member(1, [MEMBER_ROLE_ID], administrator=True)
+
+    async with Measurement('cleanup', workdir) as m:
+        await m.timed(cleanup_roles(FakeInteraction(bot, admin, guild.get_channel(LOGS_CHANNEL_ID))))
+        await deferred.wait_all()  # The command returns once deferred; the sweep runs as a job
+        await finish(bot)
+    changes = rest.routes['DELETE /members/roles'] + rest.routes['PATCH /members']
+    m.events = changes  # Throughput is role changes per second, not command invocations
+    return m.result(rest, role_changes=changes)
+
+
+async def bench_daily(args, rest, workdir):
+    from cogs.daily_access import DailyChannelAccess
+
+    guild, bot = build_guild(args, rest)
+    await attach_runtime(bot)
+    cog = DailyChannelAccess(bot)
+    schedule = {'role_id': MEMBER_ROLE_ID, 'days': ['monday', 'tuesday', 'wednesday', 'thursday',
+                                                     'friday', 'saturday', 'sunday'],
+                'start_hour': 0, 'end_hour': 23, 'timezone': 'America/New_York', 'notifications': True}
+    channel_ids = [FIRST_SCHEDULE_CHANNEL_ID + index for index in range(args.channels)]
+    await cog.load_guild(GUILD_ID)
+    for channel_id in channel_ids:
+        cog.channel_schedules[channel_id] = schedule
+        cog.channel_guilds[channel_id] = GUILD_ID
+
+    async with Measurement('daily', workdir) as m:
+        # The first pass flips every channel, the second should be free
+        for _ in range(2):
+            await run_batches(m, (cog.update_channel_permissions(channel_id) for channel_id in channel_ids), args.concurrency)
+        await finish(bot)
+    cog.cog_unload()
+    return m.result(rest, permission_writes=rest.routes['PUT /channels/permissions'])
+
+
+BENCHMARKS = {
+    'join': bench_join,
+    'button': bench_button,
+    'assign': bench_assign,
+    'cleanup': bench_cleanup,
+    'daily': bench_daily,
+}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks against a fake Discord guild")
+    parser.add_argument('scenarios', nargs='*', metavar='scenario', help=f"any of {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument('--members', type=int, default=1000, help="members (or events) per scenario")
+    parser.add_argument('--roles', type=int, default=50, help="extra roles in the fake guild")
+    parser.add_argument('--channels', type=int, default=50, help="scheduled channels for the daily scenario")
+    parser.add_argument('--latency', type=float, default=0.02, help="seconds per fake API call")
+    parser.add_argument('--jitter', type=float, default=0.01, help="extra random seconds per fake API call")
+    parser.add_argument('--rate-limit-chance', type=float, default=0.0, help="probability a call returns 429")
+    parser.add_argument('--concurrency', type=int, default=50, help="events in flight for button/assign/daily")
+    parser.add_argument('--click-rate', type=float, default=0, help="GLOBAL_CLICK_RATE (0 disables the global limit)")
+    parser.add_argument('--sync-rate', type=float, default=None, help="ROLE_SYNC_RATE override for cleanup")
+    parser.add_argument('--json', action='store_true', help="print one JSON object per scenario")
+    args = parser.parse_args(argv)
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+    args.scenarios = args.scenarios or list(SCENARIOS)
+    return args
+
+
+def print_table(results):
+    columns = ['scenario', 'events', 'events_per_s', 'p50_ms', 'p99_ms', 'loop_lag_p99_ms',
+               'loop_lag_max_ms', 'bytes_written', 'api_requests', 'rate_limited']
+    widths = [max(len(col), *(len(str(r.get(col))) for r in results)) for col in columns]
+    print("  ".join(col.rjust(width) for col, width in zip(columns, widths)))
+    for result in results:
+        print("  ".join(str(result.get(col)).rjust(width) for col, width in zip(columns, widths)))
+
+
+async def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.CRITICAL)
+    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, repo_root)
+
+    from benchmarks.fake_discord import FakeREST
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='gatekeeper-bench-') as workdir:
+        configure_environment(args, workdir)
+        previous = os.getcwd()
+        os.chdir(workdir)
+        try:
+            for name in args.scenarios:
+                rest = FakeREST(args.latency, args.jitter, args.rate_limit_chance)
+                result = await BENCHMARKS[name](args, rest, workdir)
+                results.append(result)
+                if args.json:
+                    print(json.dumps(result))
+        finally:
+            os.chdir(previous)
+    if not args.json:
+        print_table(results)
+    return results
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,306 @@
+"""In-process stand-ins for the parts of discord.py the bot touches.
+
+Every API call goes through a FakeREST that sleeps for a configurable latency
+and can answer with 429s. Like discord.py's HTTP client, it sleeps for the
+retry-after and retries before giving up with an HTTPException.
+"""
+import asyncio
+import random
+from collections import Counter
+from datetime import datetime, timezone
+
+import discord
+
+
+class _Response:
+    def __init__(self, status, reason):
+        self.status = status
+        self.reason = reason
+
+
+class FakeREST:
+    def __init__(self, latency=0.0, jitter=0.0, rate_limit_chance=0.0, retry_after=0.05,
+                 max_retries=5, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_chance = rate_limit_chance
+        self.retry_after = retry_after
+        self.max_retries = max_retries
+        self._random = random.Random(seed)
+        self.requests = 0
+        self.rate_limited = 0
+        self.routes = Counter()
+
+    async def request(self, route):
+        for attempt in range(self.max_retries + 1):
+            self.requests += 1
+            delay = self.latency + (self._random.random() * self.jitter if self.jitter else 0.0)
+            await asyncio.sleep(delay)
+            if self.rate_limit_chance and self._random.random() < self.rate_limit_chance:
+                self.rate_limited += 1
+                if attempt < self.max_retries:
+                    await asyncio.sleep(self.retry_after)
+                    continue
+                raise discord.HTTPException(_Response(429, 'Too Many Requests'), 'You are being rate limited.')
+            self.routes[route] += 1
+            return
+
+
+class FakeRole:
+    def __init__(self, role_id, name, position=0):
+        self.id = role_id
+        self.name = name
+        self.position = position
+
+    @property
+    def mention(self):
+        return f'<@&{self.id}>'
+
+    def __repr__(self):
+        return f'<FakeRole id={self.id} name={self.name!r}>'
+
+
+class _Asset:
+    url = 'https://cdn.discordapp.com/embed/avatars/0.png'
+
+
+class _Permissions:
+    def __init__(self, administrator=False):
+        self.administrator = administrator
+
+
+class FakeMember(discord.Member):
+    """discord.Member subclass so isinstance checks pass; state lives in __dict__"""
+
+    id = None
+    name = None
+
+    def __init__(self, guild, member_id, role_ids=(), administrator=False):
+        self.guild = guild
+        self.id = member_id
+        self.name = f'user{member_id}'
+        self._role_ids = set(role_ids)
+        self._administrator = administrator
+        self._created_at = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __str__(self):
+        return self.name
+
+    def __repr__(self):
+        return f'<FakeMember id={self.id}>'
+
+    @property
+    def display_name(self):
+        return self.name
+
+    @property
+    def mention(self):
+        return f'<@{self.id}>'
+
+    @property
+    def display_avatar(self):
+        return _Asset()
+
+    @property
+    def created_at(self):
+        return self._created_at
+
+    @property
+    def guild_permissions(self):
+        return _Permissions(self._administrator)
+
+    @property
+    def roles(self):
+        # Built on every access, like the real property
+        roles = [self.guild.default_role]
+        roles.extend(role for role in map(self.guild.get_role, self._role_ids) if role)
+        roles.sort(key=lambda role: role.position)
+        return roles
+
+    def get_role(self, role_id, /):
+        return self.guild.get_role(role_id) if role_id in self._role_ids else None
+
+    async def add_roles(self, *roles, reason=None, atomic=True):
+        for role in roles:
+            await self.guild.rest.request('PUT /members/roles')
+            self._role_ids.add(role.id)
+
+    async def remove_roles(self, *roles, reason=None, atomic=True):
+        for role in roles:
+            await self.guild.rest.request('DELETE /members/roles')
+            self._role_ids.discard(role.id)
+
+    async def edit(self, *, roles=None, reason=None, **fields):
+        await self.guild.rest.request('PATCH /members')
+        if roles is not None:
+            self._role_ids = {role.id for role in roles if role.id != self.guild.default_role.id}
+
+
+class FakeMessage:
+    def __init__(self, channel, content=None, embeds=()):
+        self.channel = channel
+        self.content = content
+        self.embeds = list(embeds)
+        self.id = random.getrandbits(48)
+        self.jump_url = f'https://discord.com/channels/0/{channel.id}/{self.id}'
+
+    async def edit(self, **fields):
+        await self.channel.guild.rest.request('PATCH /messages')
+        self.content = fields.get('content', self.content)
+
+
+class FakeChannel:
+    def __init__(self, guild, channel_id, name):
+        self.guild = guild
+        self.id = channel_id
+        self.name = name
+        self._overwrites = {}
+        self.sent = 0
+
+    @property
+    def mention(self):
+        return f'<#{self.id}>'
+
+    def overwrites_for(self, target):
+        return self._overwrites.get(target.id, discord.PermissionOverwrite())
+
+    async def set_permissions(self, target, *, overwrite=None, reason=None):
+        await self.guild.rest.request('PUT /channels/permissions')
+        self._overwrites[target.id] = overwrite
+
+    async def send(self, content=None, *, embed=None, embeds=None, **fields):
+        await self.guild.rest.request('POST /messages')
+        self.sent += 1
+        return FakeMessage(self, content, embeds or ([embed] if embed else []))
+
+
+class FakeGuild:
+    def __init__(self, rest, guild_id=1, name='Benchmark Guild'):
+        self.rest = rest
+        self.id = guild_id
+        self.name = name
+        self._roles = {}
+        self._members = {}
+        self._channels = {}
+        self.default_role = self.add_role(guild_id, '@everyone', position=0)
+
+    @property
+    def member_count(self):
+        return len(self._members)
+
+    @property
+    def members(self):
+        return list(self._members.values())
+
+    def add_role(self, role_id, name, position=1):
+        role = FakeRole(role_id, name, position)
+        self._roles[role_id] = role
+        return role
+
+    def add_member(self, member_id, role_ids=(), administrator=False):
+        member = FakeMember(self, member_id, role_ids, administrator)
+        self._members[member_id] = member
+        return member
+
+    def add_channel(self, channel_id, name):
+        channel = FakeChannel(self, channel_id, name)
+        self._channels[channel_id] = channel
+        return channel
+
+    def get_role(self, role_id):
+        return self._roles.get(role_id)
+
+    def get_member(self, member_id):
+        return self._members.get(member_id)
+
+    def get_channel(self, channel_id):
+        return self._channels.get(channel_id)
+
+
+class FakeTree:
+    """Collects app command callbacks so they can be invoked directly"""
+
+    def __init__(self):
+        self.commands = {}
+
+    def command(self, name=None, description=None, **kwargs):
+        def decorator(func):
+            self.commands[name or func.__name__] = func
+            return func
+        return decorator
+
+    def get_commands(self):
+        return list(self.commands)
+
+
+class FakeBot:
+    def __init__(self, guild):
+        self.guild = guild
+        self.guilds = [guild]
+        self.tree = FakeTree()
+        self.cogs = {}
+        self.log_sink = None
+        self.user = guild.add_member(999, administrator=True)
+
+    def add_listener(self, func, name=None):
+        pass
+
+    def get_guild(self, guild_id):
+        return self.guild if guild_id == self.guild.id else None
+
+    def get_channel(self, channel_id):
+        return self.guild.get_channel(channel_id)
+
+    def get_cog(self, name):
+        return self.cogs.get(name)
+
+    async def add_cog(self, cog):
+        self.cogs[type(cog).__name__] = cog
+
+    async def wait_until_ready(self):
+        return
+
+    async def fetch_user(self, user_id):
+        raise discord.NotFound(_Response(404, 'Not Found'), 'Unknown User')
+
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self._interaction = interaction
+        self._done = False
+
+    def is_done(self):
+        return self._done
+
+    async def send_message(self, content=None, **fields):
+        await self._interaction.guild.rest.request('POST /interactions/callback')
+        self._done = True
+
+    async def defer(self, **fields):
+        await self._interaction.guild.rest.request('POST /interactions/callback')
+        self._done = True
+
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self._interaction = interaction
+
+    async def send(self, content=None, *, wait=False, **fields):
+        channel = self._interaction.channel
+        return await channel.send(content, **{k: v for k, v in fields.items() if k in ('embed', 'embeds')})
+
+
+class FakeInteraction:
+    def __init__(self, bot, user, channel=None):
+        self.client = bot
+        self.user = user
+        self.guild = user.guild
+        self.channel = channel or next(iter(user.guild._channels.values()), None)
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+
+    async def edit_original_response(self, **fields):
+        await self.guild.rest.request('PATCH /interactions/original')
@@ -1,18 +1,16 @@
+import importlib
 import logging
+import time
 from discord.ext import commands
 
-# Import all cog modules
-from . import verification
-from . import welcome
-from . import daily_access
+# Cog modules, imported when the extension loads rather than with the package
+COG_MODULES = ('verification', 'welcome', 'daily_access')
 
 async def setup(bot: commands.Bot) -> None:
     """Add all cogs to the bot."""
     logger = logging.getLogger(__name__)
-    msg = "Loaded cogs.{}"
-    await verification.setup(bot)
-    logger.debug(msg.format("verification"))
-    await welcome.setup(bot)
-    logger.debug(msg.format("welcome"))
-    await daily_access.setup(bot)
-    logger.debug(msg.format("daily_access")) 
\ No newline at end of file
+    for name in COG_MODULES:
+        started = time.perf_counter()
+        module = importlib.import_module(f"{__name__}.{name}")
+        await module.setup(bot)
+        logger.debug(f"Loaded cogs.{name} in {time.perf_counter() - started:.3f}s")
@@ -1,168 +1,271 @@
 import discord
-from discord.ext import commands, tasks
-from discord import app_commands
-import json
+from discord.ext import commands
 import os
 import logging
-from datetime import datetime, timezone, timedelta
-from typing import Dict, List, Optional, Set
+from datetime import datetime, timezone, timedelta, time as dt_time
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
 import asyncio
 import pytz
+from utils import async_json_read, async_json_write
+from scheduler import DeadlineScheduler
+from log_sink import submit_log
+from config import guild_state_path
+from workers import owned_guild_ids
+from metrics import DAILY_TRANSITIONS
+from perf import track
 
 # File to store channel schedules
+log = logging.getLogger('gatekeeper.daily_access')
+
 SCHEDULE_FILE = 'daily_channel_schedules.json'
 
-def load_schedules() -> Dict:
-    """Load channel schedules from file"""
+DAY_NAMES = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+TRANSITION_RETRY_SECONDS = 60  # Retry delay when a transition fails to apply
+
+async def load_schedules(guild_id: Optional[int] = None) -> Dict:
+    """Load a guild's channel schedules from its file"""
+    return await async_json_read(guild_state_path(SCHEDULE_FILE, guild_id), {})
+
+async def save_schedules(schedules: Dict, guild_id: Optional[int] = None) -> None:
+    """Save a guild's channel schedules to its file"""
+    await async_json_write(guild_state_path(SCHEDULE_FILE, guild_id), schedules)
+
+@lru_cache(maxsize=None)
+def get_schedule_timezone(tz_name: str):
+    """Resolve (and cache) a schedule's timezone, falling back to UTC"""
     try:
-        with open(SCHEDULE_FILE, 'r') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return {}
+        return pytz.timezone(tz_name)
+    except Exception as e:
+        log.warning("Failed to load timezone %s: %s", tz_name, e)
+        return pytz.utc
+
+def _localize(tz, naive: datetime) -> datetime:
+    """Turn a local wall-clock time into an aware datetime, resolving DST edges.
 
-def save_schedules(schedules: Dict) -> None:
-    """Save channel schedules to file"""
-    with open(SCHEDULE_FILE, 'w') as f:
-        json.dump(schedules, f, indent=2)
+    A time skipped by spring-forward maps to the first instant after the gap,
+    and an ambiguous fall-back time maps to its first occurrence, which is when
+    the local hour on the clock first reaches that value.
+    """
+    try:
+        return tz.localize(naive, is_dst=None)
+    except pytz.AmbiguousTimeError:
+        return tz.localize(naive, is_dst=True)
+    except pytz.NonExistentTimeError:
+        return tz.normalize(tz.localize(naive, is_dst=False))
+
+def _open_intervals(schedule: Dict, now: datetime) -> List[Tuple[datetime, datetime]]:
+    """UTC [open, close) intervals from yesterday through the next nine days, merged"""
+    tz = get_schedule_timezone(schedule.get('timezone', 'UTC'))
+    allowed = {DAY_NAMES.index(day.lower()) for day in schedule.get('days', []) if day.lower() in DAY_NAMES}
+    start_hour = schedule.get('start_hour', 0)
+    end_hour = schedule.get('end_hour', 23)
+
+    intervals = []
+    first_day = now.astimezone(tz).date() - timedelta(days=1)
+    for offset in range(11):
+        day = first_day + timedelta(days=offset)
+        if day.weekday() not in allowed:
+            continue
+        midnight = datetime.combine(day, dt_time())
+        opens = _localize(tz, midnight + timedelta(hours=start_hour)).astimezone(timezone.utc)
+        # Open through the whole end hour, i.e. until (end_hour + 1):00 local
+        closes = _localize(tz, midnight + timedelta(hours=end_hour + 1)).astimezone(timezone.utc)
+        if opens >= closes:
+            continue
+        if intervals and opens <= intervals[-1][1]:
+            intervals[-1] = (intervals[-1][0], max(intervals[-1][1], closes))
+        else:
+            intervals.append((opens, closes))
+    return intervals
+
+def is_schedule_open(schedule: Dict, now: Optional[datetime] = None) -> bool:
+    """Whether the schedule allows chatting at the given instant"""
+    now = now or datetime.now(timezone.utc)
+    return any(opens <= now < closes for opens, closes in _open_intervals(schedule, now))
+
+def next_transition(schedule: Dict, now: Optional[datetime] = None) -> Optional[Tuple[datetime, bool]]:
+    """Return (instant, opens) for the next open/close change after now, or None if there is none"""
+    now = now or datetime.now(timezone.utc)
+    for opens, closes in _open_intervals(schedule, now):
+        if now < opens:
+            return opens, True
+        if now < closes:
+            return closes, False
+    return None
 
 class DailyChannelAccess(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        self.schedules = load_schedules()
-        self.channel_schedules: Dict[str, Dict] = {}
-        
+        self.schedules: Dict[int, Dict[str, Dict]] = {}  # guild id -> its schedules as saved
+        self.channel_schedules: Dict[int, Dict] = {}  # every guild's schedules by channel id
+        self.channel_guilds: Dict[int, int] = {}
+        # Per guild, one deadline per channel: the instant of its next open/close transition
+        self.transitions: Dict[int, DeadlineScheduler] = {}
+        self.startup_task = None
+
+    async def cog_load(self):
+        """Load every guild's schedules off the event loop, then start the transition schedulers"""
+        for guild_id in owned_guild_ids():
+            await self.load_guild(guild_id)
+
+        self.startup_task = asyncio.create_task(self.start_transitions())
+        log.info("DailyChannelAccess cog initialized")
+
+    async def load_guild(self, guild_id: int):
+        """Read a guild's schedule file and give it a transition scheduler (once)"""
+        if guild_id in self.schedules:
+            return
+        schedules = await load_schedules(guild_id)
+        self.schedules[guild_id] = schedules
+
         # Convert string keys to int for channel IDs
-        for channel_id_str, schedule in self.schedules.items():
+        for channel_id_str, schedule in schedules.items():
             self.channel_schedules[int(channel_id_str)] = schedule
-        
-        # Start the background task
-        self.update_channel_permissions.start()
-        logging.info("DailyChannelAccess cog initialized")
+            self.channel_guilds[int(channel_id_str)] = guild_id
+
+        transitions = self.transitions[guild_id] = DeadlineScheduler(
+            self.update_channel_permissions, name=f"daily access scheduler ({guild_id})"
+        )
+        if self.startup_task and self.startup_task.done():
+            transitions.start()
 
     def cog_unload(self):
         """Clean up when cog is unloaded"""
-        self.update_channel_permissions.cancel()
-
-    @tasks.loop(minutes=1)  # Check every minute
-    async def update_channel_permissions(self):
-        """Background task to update channel permissions based on schedule"""
-        current_time = datetime.now(timezone.utc)
-        
-        for channel_id, schedule in self.channel_schedules.items():
+        for transitions in self.transitions.values():
+            transitions.stop()
+        if self.startup_task:
+            self.startup_task.cancel()
+
+    async def start_transitions(self):
+        """Bring every channel to its current state once, then sleep until transitions"""
+        await self.bot.wait_until_ready()
+        for channel_id in list(self.channel_schedules):
+            await self.update_channel_permissions(channel_id)
+        for transitions in self.transitions.values():
+            transitions.start()
+
+    def guild_schedules(self, guild_id: int) -> Dict[int, Dict]:
+        """One guild's schedules by channel id"""
+        return {int(channel_id): schedule for channel_id, schedule in self.schedules.get(guild_id, {}).items()}
+
+    def schedule_next_transition(self, channel_id: int):
+        """Queue the channel's next open/close instant"""
+        transitions = self.transitions.get(self.channel_guilds.get(channel_id))
+        if transitions is None:
+            return
+        schedule = self.channel_schedules.get(channel_id)
+        transition = next_transition(schedule) if schedule and schedule.get('days') else None
+        if transition:
+            transitions.schedule(channel_id, transition[0].timestamp())
+        else:
+            transitions.cancel(channel_id)
+
+    async def set_schedule(self, channel_id: int, schedule: Dict, guild_id: int):
+        """Add or replace a channel schedule and apply it immediately"""
+        await self.load_guild(guild_id)
+        self.channel_schedules[channel_id] = schedule
+        self.channel_guilds[channel_id] = guild_id
+        self.schedules[guild_id][str(channel_id)] = schedule
+        await save_schedules(self.schedules[guild_id], guild_id)
+        await self.update_channel_permissions(channel_id)
+
+    async def remove_schedule(self, channel_id: int):
+        """Remove a channel schedule and its pending transition"""
+        guild_id = self.channel_guilds.pop(channel_id, None)
+        self.channel_schedules.pop(channel_id, None)
+        if guild_id is None:
+            return
+        self.schedules[guild_id].pop(str(channel_id), None)
+        self.transitions[guild_id].cancel(channel_id)
+        await save_schedules(self.schedules[guild_id], guild_id)
+
+    @track('DailyChannelAccess.update_channel_permissions')
+    async def update_channel_permissions(self, channel_id: int):
+        """Apply a channel's scheduled state and queue its next transition"""
+        schedule = self.channel_schedules.get(channel_id)
+        if not schedule:
+            return
+
+        try:
+            self.schedule_next_transition(channel_id)
+
+            # Find the channel
+            channel = self.bot.get_channel(channel_id)
+            if not channel:
+                return
+
+            guild = channel.guild
+            if not guild:
+                return
+
+            # Get the role ID from schedule
+            role_id = schedule.get('role_id')
+            if not role_id:
+                return
+
+            role = guild.get_role(role_id)
+            if not role:
+                return
+
+            # Check if today is in the allowed days
+            allowed_days = schedule.get('days', [])
+            if not allowed_days:
+                return
+
+            current_time = datetime.now(timezone.utc)
+            is_open = is_schedule_open(schedule, current_time)
+
+            # Always allow viewing and reading, but control sending messages
+            overwrite = channel.overwrites_for(role)
+            send_changed = overwrite.send_messages is not is_open
+            if overwrite.view_channel is not True or overwrite.read_messages is not True or send_changed:
+                overwrite.update(view_channel=True, read_messages=True, send_messages=is_open)
+                await channel.set_permissions(role, overwrite=overwrite)
+                DAILY_TRANSITIONS.inc(state='open' if is_open else 'closed')
+                state = "Enabled" if is_open else "Disabled"
+                log.info("%s sending messages in %s for role %s", state, channel.name, role.name)
+
+            # Send notification if enabled
+            if send_changed and schedule.get('notifications', False):
+                await self.send_transition_notification(guild, channel, role, schedule, is_open, current_time)
+
+        except Exception as e:
+            log.error("Error updating permissions for channel %s: %s", channel_id, e)
+            # Try again shortly instead of waiting for the next transition
+            transitions = self.transitions.get(self.channel_guilds.get(channel_id))
+            if transitions:
+                transitions.schedule(channel_id, datetime.now(timezone.utc).timestamp() + TRANSITION_RETRY_SECONDS)
+
+            # Report critical error to owners
             try:
-                # Find the channel
-                channel = self.bot.get_channel(channel_id)
-                if not channel:
-                    continue
-                
-                guild = channel.guild
-                if not guild:
-                    continue
-                
-                # Get the role ID from schedule
-                role_id = schedule.get('role_id')
-                if not role_id:
-                    continue
-                
-                role = guild.get_role(role_id)
-                if not role:
-                    continue
-                
-                # Get timezone and convert current time
-                tz_name = schedule.get('timezone', 'UTC')
-                try:
-                    tz = pytz.timezone(tz_name)
-                    local_time = current_time.astimezone(tz)
-                except Exception as e:
-                    logging.warning(f"Failed to convert timezone {tz_name}: {e}")
-                    local_time = current_time
-                
-                current_day = local_time.strftime('%A').lower()  # monday, tuesday, etc.
-                current_hour = local_time.hour
-                
-                # Check if today is in the allowed days
-                allowed_days = schedule.get('days', [])
-                if not allowed_days:
-                    continue
-                
-                # Check if current time is within the allowed hours
-                start_hour = schedule.get('start_hour', 0)
-                end_hour = schedule.get('end_hour', 23)
-                
-                is_allowed_day = current_day in [day.lower() for day in allowed_days]
-                is_allowed_time = start_hour <= current_hour <= end_hour
-                
-                # Get current permissions for the role
-                current_overwrites = channel.overwrites_for(role)
-                
-                # Always allow viewing and reading, but control sending messages
-                if not current_overwrites.view_channel or current_overwrites.view_channel is False:
-                    # Enable viewing and reading (always)
-                    await channel.set_permissions(role, view_channel=True, read_messages=True)
-                    logging.info(f"Enabled viewing access to {channel.name} for role {role.name}")
-                
-                if is_allowed_day and is_allowed_time:
-                    # Channel should be writable
-                    if current_overwrites.send_messages is False:
-                        # Enable sending messages
-                        await channel.set_permissions(role, send_messages=True)
-                        logging.info(f"Enabled sending messages in {channel.name} for role {role.name}")
-                        
-                        # Send notification if enabled
-                        if schedule.get('notifications', False):
-                            try:
-                                embed = discord.Embed(
-                                    title="📢 Channel Now Open for Chat",
-                                    description=f"The channel {channel.mention} is now open for chatting for {role.mention}",
-                                    color=discord.Color.green(),
-                                    timestamp=current_time
-                                )
-                                embed.add_field(name="Schedule", value=f"Days: {', '.join(allowed_days)}\nTime: {start_hour}:00 - {end_hour}:00 ({tz_name})", inline=False)
-                                
-                                # Try to send to a logs channel or the channel itself
-                                logs_channel_id = os.getenv('LOGS_CHANNEL_ID')
-                                if logs_channel_id:
-                                    logs_channel = guild.get_channel(int(logs_channel_id))
-                                    if logs_channel:
-                                        await logs_channel.send(embed=embed)
-                            except Exception as e:
-                                logging.error(f"Failed to send channel open notification: {e}")
-                
-                else:
-                    # Channel should be read-only
-                    if current_overwrites.send_messages is True:
-                        # Disable sending messages
-                        await channel.set_permissions(role, send_messages=False)
-                        logging.info(f"Disabled sending messages in {channel.name} for role {role.name}")
-                        
-                        # Send notification if enabled
-                        if schedule.get('notifications', False):
-                            try:
-                                embed = discord.Embed(
-                                    title="🔒 Channel Now Read-Only",
-                                    description=f"The channel {channel.mention} is now read-only for {role.mention}",
-                                    color=discord.Color.orange(),
-                                    timestamp=current_time
-                                )
-                                embed.add_field(name="Schedule", value=f"Days: {', '.join(allowed_days)}\nTime: {start_hour}:00 - {end_hour}:00 ({tz_name})", inline=False)
-                                
-                                # Try to send to a logs channel
-                                logs_channel_id = os.getenv('LOGS_CHANNEL_ID')
-                                if logs_channel_id:
-                                    logs_channel = guild.get_channel(int(logs_channel_id))
-                                    if logs_channel:
-                                        await logs_channel.send(embed=embed)
-                            except Exception as e:
-                                logging.error(f"Failed to send channel read-only notification: {e}")
-            
-            except Exception as e:
-                logging.error(f"Error updating permissions for channel {channel_id}: {e}")
-                
-                # Report critical error to owners
-                try:
-                    await self.report_critical_error("Daily Access Error", f"Error updating permissions for channel {channel_id}: {e}")
-                except Exception as report_error:
-                    logging.error(f"Failed to report critical error: {report_error}")
+                await self.report_critical_error("Daily Access Error", f"Error updating permissions for channel {channel_id}: {e}")
+            except Exception as report_error:
+                log.error("Failed to report critical error: %s", report_error)
+
+    async def send_transition_notification(self, guild, channel, role, schedule, is_open, current_time):
+        """Post the open/read-only notice to the logs channel"""
+        try:
+            tz_name = schedule.get('timezone', 'UTC')
+            if is_open:
+                embed = discord.Embed(
+                    title="📢 Channel Now Open for Chat",
+                    description=f"The channel {channel.mention} is now open for chatting for {role.mention}",
+                    color=discord.Color.green(),
+                    timestamp=current_time
+                )
+            else:
+                embed = discord.Embed(
+                    title="🔒 Channel Now Read-Only",
+                    description=f"The channel {channel.mention} is now read-only for {role.mention}",
+                    color=discord.Color.orange(),
+                    timestamp=current_time
+                )
+            embed.add_field(name="Schedule", value=f"Days: {', '.join(schedule.get('days', []))}\nTime: {schedule.get('start_hour', 0)}:00 - {schedule.get('end_hour', 23)}:00 ({tz_name})", inline=False)
+
+            submit_log(self.bot, embed, guild.id)
+        except Exception as e:
+            log.error("Failed to send channel %s notification: %s", 'open' if is_open else 'read-only', e)
 
     async def report_critical_error(self, error_type, error_message):
         """Report critical errors to owners via logs and DM"""
@@ -171,12 +274,7 @@ class DailyChannelAccess(commands.Cog):
             from .verification import report_critical_error
             await report_critical_error(error_type, error_message, self.bot)
         except Exception as e:
-            logging.error(f"Error in daily access cog error reporting: {e}")
-
-    @update_channel_permissions.before_loop
-    async def before_update_permissions(self):
-        """Wait until bot is ready before starting the task"""
-        await self.bot.wait_until_ready()
+            log.error("Error in daily access cog error reporting: %s", e)
 
 async def setup(bot):
-    await bot.add_cog(DailyChannelAccess(bot)) 
\ No newline at end of file
+    await bot.add_cog(DailyChannelAccess(bot))
@@ -1,15 +1,34 @@
 import discord
 from discord import ui
-import json
 import logging
+import math
 from datetime import datetime, timezone
 import os
 import time
-from utils import safe_json_write, safe_json_read, report_critical_error
+from utils import report_critical_error
+from storage import get_user_store
+from log_sink import submit_log
+from rate_limit import CooldownLimiter
+from config import get_settings, handles
+from metrics import BUTTON_CLICKS
+from perf import track
+from workers import WORKER_COUNT
+
+log = logging.getLogger('gatekeeper.verification')
+
+RATE_LIMIT_SECONDS = int(os.getenv('BUTTON_COOLDOWN_SECONDS', 10))  # Per-user cooldown between clicks
+GLOBAL_CLICK_RATE = float(os.getenv('GLOBAL_CLICK_RATE', 20))  # Clicks processed per second across all users
+GLOBAL_CLICK_BURST = int(os.getenv('GLOBAL_CLICK_BURST', 50))
+
+# Shared by every OnboardingButton instance (the view is recreated on refresh). Discord's
+# global rate limit is per bot, so worker processes split the click budget between them
+button_limiter = CooldownLimiter(RATE_LIMIT_SECONDS, GLOBAL_CLICK_RATE / WORKER_COUNT, max(1, GLOBAL_CLICK_BURST // WORKER_COUNT))
+
+
+def cooldown_key(guild_id, user_id):
+    """button_limiter key: a user's cooldown in one guild leaves their other guilds alone"""
+    return (guild_id, int(user_id))
 
-USER_DATA_FILE = 'user_data.json'
-COOLDOWN_FILE = 'button_cooldowns.json'
-RATE_LIMIT_SECONDS = 10  # 10 second rate limit
 
 class OnboardingButton(ui.Button):
     def __init__(self):
@@ -18,57 +37,20 @@ class OnboardingButton(ui.Button):
             label="🔒 Book Your Onboarding Call",
             custom_id="book_onboarding"
         )
-        # Load cooldowns from file
-        self.button_cooldowns = self.load_cooldowns()
-
-    def load_cooldowns(self):
-        """Load cooldowns from file"""
-        try:
-            data = safe_json_read(COOLDOWN_FILE, {})
-            # Filter out expired cooldowns
-            current_time = time.time()
-            cooldowns = {}
-            for user_id_str, last_click in data.items():
-                if current_time - last_click < RATE_LIMIT_SECONDS:
-                    cooldowns[user_id_str] = last_click
-            return cooldowns
-        except Exception as e:
-            logging.error(f"Error loading cooldowns: {e}")
-            return {}
-
-    def save_cooldowns(self):
-        """Save cooldowns to file"""
-        safe_json_write(COOLDOWN_FILE, self.button_cooldowns)
-
-    def cleanup_expired_cooldowns(self):
-        """Remove expired cooldowns from memory and file"""
-        current_time = time.time()
-        expired_users = []
-        
-        for user_id, last_click in self.button_cooldowns.items():
-            if current_time - last_click >= RATE_LIMIT_SECONDS:
-                expired_users.append(user_id)
-        
-        for user_id in expired_users:
-            del self.button_cooldowns[user_id]
-        
-        if expired_users:
-            self.save_cooldowns()
-            logging.debug(f"Cleaned up {len(expired_users)} expired cooldowns")
+        self.limiter = button_limiter
 
+    @track('Verification.onboarding_button')
     async def callback(self, interaction: discord.Interaction):
         """Handle button click with rate limiting"""
         user_id = str(interaction.user.id)
+        guild_id = interaction.guild.id if interaction.guild else None
         current_time = time.time()
         
-        # Clean up expired cooldowns periodically
-        if len(self.button_cooldowns) > 100:  # Clean up when we have many cooldowns
-            self.cleanup_expired_cooldowns()
-        
-        # Check rate limit
-        last_click = self.button_cooldowns.get(user_id, 0)
-        if current_time - last_click < RATE_LIMIT_SECONDS:
-            remaining_time = int(RATE_LIMIT_SECONDS - (current_time - last_click))
+        # Check rate limit (the click is counted immediately so concurrent spam can't slip through)
+        retry_after = self.limiter.acquire(cooldown_key(guild_id, user_id))
+        if retry_after:
+            BUTTON_CLICKS.inc(result='rate_limited')
+            remaining_time = max(1, math.ceil(retry_after))
             try:
                 if not interaction.response.is_done():
                     await interaction.response.send_message(
@@ -76,33 +58,27 @@ class OnboardingButton(ui.Button):
                         ephemeral=True
                     )
             except Exception as e:
-                logging.error(f"Error sending rate limit response: {e}")
-            logging.info(f"Rate limited user {user_id} - {remaining_time}s remaining")
+                log.error("Error sending rate limit response: %s", e)
+            log.info("Rate limited user %s - %ss remaining", user_id, remaining_time)
             return
         
-        logging.info(f"Button callback triggered for user {interaction.user.id}")
+        log.info("Button callback triggered for user %s", interaction.user.id)
+        BUTTON_CLICKS.inc(result='accepted')
         
         try:
-            # Load user data
-            user_data = safe_json_read(USER_DATA_FILE, {})
-            
             # Check roles
-            member_role_id = int(os.getenv('MEMBER_ROLE_ID', 0))
-            unverified_role_id = int(os.getenv('UNVERIFIED_ROLE_ID', 0))
+            settings = get_settings(guild_id)
+            unverified_role = handles.for_guild(guild_id).unverified_role
             
             has_member_role = False
             has_unverified_role = False
             
-            if interaction.guild:
-                if member_role_id:
-                    member_role = interaction.guild.get_role(member_role_id)
-                    if member_role and member_role in interaction.user.roles:
-                        has_member_role = True
+            if interaction.guild and isinstance(interaction.user, discord.Member):
+                if settings.member_role_id and interaction.user.get_role(settings.member_role_id):
+                    has_member_role = True
                 
-                if unverified_role_id:
-                    unverified_role = interaction.guild.get_role(unverified_role_id)
-                    if unverified_role and unverified_role in interaction.user.roles:
-                        has_unverified_role = True
+                if settings.unverified_role_id and interaction.user.get_role(settings.unverified_role_id):
+                    has_unverified_role = True
             
             # Check if user already has member role
             if has_member_role:
@@ -115,47 +91,43 @@ class OnboardingButton(ui.Button):
                     if not interaction.response.is_done():
                         await interaction.response.send_message(embed=embed, ephemeral=True)
                 except Exception as e:
-                    logging.error(f"Error sending already verified response: {e}")
-                logging.info(f"User {user_id} already has member role")
+                    log.error("Error sending already verified response: %s", e)
+                log.info("User %s already has member role", user_id)
                 return
             
             # If user doesn't have unverified role, add it
-            if not has_unverified_role and unverified_role_id and interaction.guild:
-                unverified_role = interaction.guild.get_role(unverified_role_id)
+            if not has_unverified_role and interaction.guild:
                 if unverified_role:
                     try:
                         await interaction.user.add_roles(unverified_role)
                         has_unverified_role = True
-                        logging.info(f"Added unverified role to user {user_id}")
+                        log.info("Added unverified role to user %s", user_id)
                     except Exception as e:
-                        logging.error(f"Error adding unverified role to user {user_id}: {e}")
+                        log.error("Error adding unverified role to user %s: %s", user_id, e)
                         # Continue processing even if role assignment fails
             
-            # Update cooldown AFTER successful processing
-            self.button_cooldowns[user_id] = current_time
-            self.save_cooldowns()
-            
-            # Record the button click (preserve existing data)
-            existing_data = user_data.get(user_id, {})
-            user_data[user_id] = {
-                'joined_at': existing_data.get('joined_at', 0),
-                'button_clicked_at': current_time,
-                'has_access': False,
-                'role_assigned': False,
-                'unverified_role_assigned': has_unverified_role
-            }
+            # Record the button click (joined_at is preserved by the upsert)
+            get_user_store(guild_id).upsert(
+                user_id,
+                button_clicked_at=current_time,
+                has_access=False,
+                role_assigned=False,
+                unverified_role_assigned=has_unverified_role
+            )
             
-            # Save user data
-            safe_json_write(USER_DATA_FILE, user_data)
+            log.info("Recorded button click for user %s with unverified_role_assigned: %s", user_id, has_unverified_role)
             
-            logging.info(f"Recorded button click for user {user_id} with unverified_role_assigned: {has_unverified_role}")
+            # Hand the pending role grant to the scheduler
+            welcome_cog = interaction.client.get_cog('Welcome')
+            if welcome_cog:
+                welcome_cog.schedule_role_assignment(user_id, current_time, guild_id)
             
             # Send ephemeral message
             embed = discord.Embed(
                 title="📅 Book Your Onboarding Call Below",
                 description=(
                     "**Free Onboarding Call - For strategic planning**\n\n"
-                    f"👉 **[FREE ONBOARDING CALL]({os.getenv('CALENDLY_LINK', 'https://ajtradingprofits.com/book-your-onboarding-call-today')})** 👈\n\n"
+                    f"👉 **[FREE ONBOARDING CALL]({settings.calendly_link})** 👈\n\n"
                     "You will discover how you can take advantage of the free community and education to get on track to consistent market profits in just 60 minutes per day without hit-or-miss time-consuming strategies, risky trades, or losing thousands on failed challenges.\n\n"
                     "*(If you already booked a call, you'll receive access to the community in 5 minutes.)*"
                 ),
@@ -163,7 +135,7 @@ class OnboardingButton(ui.Button):
             )
             
             # Add Calendly link
-            calendly_link = os.getenv('CALENDLY_LINK', 'https://ajtradingprofits.com/book-your-onboarding-call-today')
+            calendly_link = settings.calendly_link
             embed.add_field(
                 name="🔗 Book Your Call",
                 value=f"[Click here to book your free onboarding call]({calendly_link})",
@@ -173,37 +145,26 @@ class OnboardingButton(ui.Button):
             try:
                 if not interaction.response.is_done():
                     await interaction.response.send_message(embed=embed, ephemeral=True)
-                    logging.info(f"Sent ephemeral message to user {user_id}")
+                    log.info("Sent ephemeral message to user %s", user_id)
             except Exception as e:
-                logging.error(f"Error sending main response: {e}")
+                log.error("Error sending main response: %s", e)
             
             # Log to logs channel
-            logs_channel_id = int(os.getenv('LOGS_CHANNEL_ID', 0))
-            if logs_channel_id:
-                guild = interaction.guild
-                if guild:
-                    logs_channel = guild.get_channel(logs_channel_id)
-                    if logs_channel:
-                        try:
-                            log_embed = discord.Embed(
-                                title="🔒 Onboarding Button Clicked",
-                                description=f"**{interaction.user.mention}** clicked the onboarding button",
-                                color=0x0099ff,
-                                timestamp=datetime.now(timezone.utc)
-                            )
-                            log_embed.add_field(name="User ID", value=f"`{user_id}`", inline=True)
-                            log_embed.add_field(name="Action", value="🔒 Button Clicked", inline=True)
-                            log_embed.add_field(name="Has Unverified Role", value=f"{'✅ Yes' if has_unverified_role else '❌ No'}", inline=True)
-                            log_embed.set_thumbnail(url=interaction.user.display_avatar.url)
-                            
-                            await logs_channel.send(embed=log_embed)
-                        except discord.Forbidden:
-                            logging.warning(f"Bot doesn't have permission to send messages to logs channel {logs_channel_id}")
-                        except Exception as e:
-                            logging.error(f"Error sending log message: {e}")
+            if interaction.guild:
+                log_embed = discord.Embed(
+                    title="🔒 Onboarding Button Clicked",
+                    description=f"**{interaction.user.mention}** clicked the onboarding button",
+                    color=0x0099ff,
+                    timestamp=datetime.now(timezone.utc)
+                )
+                log_embed.add_field(name="User ID", value=f"`{user_id}`", inline=True)
+                log_embed.add_field(name="Action", value="🔒 Button Clicked", inline=True)
+                log_embed.add_field(name="Has Unverified Role", value=f"{'✅ Yes' if has_unverified_role else '❌ No'}", inline=True)
+                log_embed.set_thumbnail(url=interaction.user.display_avatar.url)
+                submit_log(interaction.client, log_embed, guild_id)
             
         except Exception as e:
-            logging.error(f"Error in button callback: {e}")
+            log.error("Error in button callback: %s", e)
             
             # Report critical error to owners
             try:
@@ -211,7 +172,7 @@ class OnboardingButton(ui.Button):
                 bot = interaction.client if hasattr(interaction, 'client') else None
                 await report_critical_error("Button Callback Error", f"Error in onboarding button callback: {e}", bot, interaction)
             except Exception as report_error:
-                logging.error(f"Failed to report critical error: {report_error}")
+                log.error("Failed to report critical error: %s", report_error)
             
             # Try to send user-friendly error message
             try:
@@ -221,7 +182,7 @@ class OnboardingButton(ui.Button):
                         ephemeral=True
                     )
             except Exception as response_error:
-                logging.error(f"Error sending error response: {response_error}")
+                log.error("Error sending error response: %s", response_error)
 
 class VerificationView(ui.View):
     def __init__(self):
@@ -229,5 +190,5 @@ class VerificationView(ui.View):
         self.add_item(OnboardingButton())
 
 async def setup(bot):
-    # This cog doesn't need any setup, just the VerificationView class
-    pass 
\ No newline at end of file
+    # No cog here, just the VerificationView class and its shared rate limiter
+    pass
@@ -1,46 +1,114 @@
 import asyncio
-import io
+import functools
 import discord
 from discord.ext import commands
-from discord import app_commands
 import logging
-import os
-import json
 from datetime import datetime, timezone
-from .verification import VerificationView
+from .verification import VerificationView, button_limiter, cooldown_key
 import time
+from storage import get_user_store, aget_user_store
+from scheduler import DeadlineScheduler
+from log_sink import submit_log
+from join_pipeline import JoinPipeline
+from join_dedup import JoinDedup, JOIN_DEDUP_FILE
+from reconcile import RoleChange
+from config import get_settings, guild_state_path, handles
+from workers import owned_guild_ids
+from role_index import role_index
+from member_cache import member_cache
+from metrics import ROLE_CHANGES, ROLE_ASSIGNMENT_QUEUE, JOIN_QUEUE, JOIN_LAG
+from perf import track
+from utils import get_or_create_welcome_message
 
-# Import the function from main.py to avoid duplication
-from main import get_or_create_welcome_message
+log = logging.getLogger('gatekeeper.welcome')
 
 WELCOME_MESSAGE_FILE = 'welcome_message.json'
-USER_DATA_FILE = 'user_data.json'
+ROLE_ASSIGNMENT_RETRY_SECONDS = 60  # Retry delay when a due role grant fails
+SYNC_CHUNK_SIZE = 1000  # Users checked between event loop yields during startup sync
+
+class GuildOnboarding:
+    """One guild's onboarding state: pending role grants, recently handled joins and the join queue"""
+
+    def __init__(self, cog, guild_id):
+        self.guild_id = guild_id
+        self.role_scheduler = DeadlineScheduler(
+            functools.partial(cog.check_and_assign_roles, guild_id=guild_id),
+            name=f"role assignment scheduler ({guild_id})"
+        )
+        self.join_dedup = JoinDedup(guild_state_path(JOIN_DEDUP_FILE, guild_id))  # Members whose join was handled recently
+        self.join_pipeline = JoinPipeline(cog.process_member_join, on_summary=functools.partial(cog.send_raid_summary, guild_id=guild_id))
+
+    async def start(self):
+        # Open the guild's database (and migrate legacy data) off the loop before anything reads it
+        await aget_user_store(self.guild_id)
+        await self.join_dedup.load()
+        self.join_pipeline.start()
+
+    async def close(self):
+        self.role_scheduler.stop()
+        await self.join_pipeline.close()
+        await self.join_dedup.aclose()
+
 
 class Welcome(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.role_assignment_task = None
-        self.cooldown_cleanup_task = None
-        self.logged_members = set()  # Track members that have been logged
-        self.member_join_timestamps = {}  # Track when each member was last processed
-        self.load_logged_members()
+        self.guilds = {}  # guild id -> GuildOnboarding, one per configured guild
+        ROLE_ASSIGNMENT_QUEUE.set_function(lambda: sum(len(state.role_scheduler) for state in self.guilds.values()))
+        JOIN_QUEUE.set_function(lambda: sum(state.join_pipeline.depth for state in self.guilds.values()))
+        JOIN_LAG.set_function(lambda: round(max((state.join_pipeline.last_lag for state in self.guilds.values()), default=0.0), 3))
+
+    async def cog_load(self):
+        # With several worker processes, each onboards only the guilds on its shards
+        for guild_id in owned_guild_ids():
+            await self.add_guild(guild_id)
+
+    def state(self, guild_id=None):
+        """Onboarding state of guild_id (GUILD_ID by default), or None if that guild is not configured"""
+        return self.guilds.get(get_settings().guild_id if guild_id is None else guild_id)
+
+    async def add_guild(self, guild_id):
+        """Start tracking a configured guild; its welcome message and role grants start in setup_guild()"""
+        state = self.guilds.get(guild_id)
+        if state is None:
+            state = self.guilds[guild_id] = GuildOnboarding(self, guild_id)
+            await state.start()
+        return state
+
+    async def sync_guilds(self):
+        """Match the tracked guilds to the configuration after a reload"""
+        configured = owned_guild_ids()
+        for guild_id in [guild_id for guild_id in self.guilds if guild_id not in configured]:
+            await self.guilds.pop(guild_id).close()
+            log.warning("Stopped onboarding for guild %s (no longer configured)", guild_id)
+        for guild_id in configured:
+            if guild_id not in self.guilds:
+                await self.add_guild(guild_id)
+                if self.bot.is_ready():
+                    await self.setup_guild(guild_id)
 
     @commands.Cog.listener()
+    @track('Welcome.on_ready')
     async def on_ready(self):
-        """Setup welcome channel when bot is ready (persistent message)"""
+        """Set up every configured guild once the gateway is ready"""
+        await asyncio.gather(*(self.setup_guild(guild_id) for guild_id in list(self.guilds)))
+
+    async def setup_guild(self, guild_id):
+        """Setup welcome channel (persistent message), then reconcile stored state and start role grants"""
         try:
-            guild_id = os.getenv('GUILD_ID')
-            guild = self.bot.get_guild(int(guild_id)) if guild_id and hasattr(self.bot, 'get_guild') else None
+            settings = get_settings(guild_id)
+            guild_handles = handles.for_guild(guild_id)
+            state = self.guilds[guild_id]
+            guild = guild_handles.guild
             if not guild:
-                logging.error(f"Guild with ID {guild_id} not found")
+                log.error("Guild with ID %s not found", settings.guild_id)
                 return
-            welcome_channel_id = os.getenv('WELCOME_CHANNEL_ID')
-            if not welcome_channel_id:
-                logging.error("WELCOME_CHANNEL_ID is not set in environment variables")
+            if not settings.welcome_channel_id:
+                log.error("WELCOME_CHANNEL_ID is not set for guild %s", guild_id)
                 return
-            welcome_channel = self.bot.get_channel(int(welcome_channel_id))
+            welcome_channel = guild_handles.welcome_channel
             if not welcome_channel:
-                logging.error(f"Welcome channel with ID {welcome_channel_id} not found")
+                log.error("Welcome channel with ID %s not found", settings.welcome_channel_id)
                 return
             # Create new welcome embed
             embed = discord.Embed(
@@ -60,547 +128,421 @@ class Welcome(commands.Cog):
             embed.set_thumbnail(url="https://cdn.discordapp.com/attachments/1370122090631532655/1401222798336200834/20.38.48_73b12891.jpg")
             # Use persistent message logic
             msg = await get_or_create_welcome_message(welcome_channel, embed, VerificationView())
-            logging.info(f"Welcome message is now persistent: {msg.jump_url}")
+            log.info("Welcome message is now persistent: %s", msg.jump_url)
             
-            # Start role assignment loop
-            self.role_assignment_task = self.bot.loop.create_task(self.role_assignment_loop())
-            
-            # Start cooldown cleanup loop
-            self.cooldown_cleanup_task = self.bot.loop.create_task(self.cleanup_cooldowns_loop())
-            
-            # Start logged members cleanup loop
-            self.logged_members_cleanup_task = self.bot.loop.create_task(self.cleanup_logged_members_loop())
+            # on_ready fires again after every reconnect; only start the background work once
+            if state.role_scheduler.running:
+                return
             
             # Sync user data with actual Discord roles to prevent incorrect assignments
-            await self.sync_user_data_with_roles()
+            await self.sync_user_data_with_roles(guild_id)
+            
+            # Rebuild pending role assignments from the store and start the scheduler
+            await self.load_role_assignment_schedule(guild_id)
+            state.role_scheduler.start()
         except Exception as e:
-            logging.error(f"Error in on_ready welcome setup: {e}")
+            log.error("Error in welcome setup for guild %s: %s", guild_id, e)
 
     @commands.Cog.listener()
+    @track('Welcome.on_member_join')
     async def on_member_join(self, member):
         """Handle new member joins with duplicate prevention"""
+        state = self.guilds.get(member.guild.id)
+        if state is None:
+            return
         try:
-            guild_id = int(os.getenv('GUILD_ID', 0))
-            unverified_role_id = int(os.getenv('UNVERIFIED_ROLE_ID', 0))
-            logs_channel_id = int(os.getenv('LOGS_CHANNEL_ID', 0))
-            
-            if not guild_id or not unverified_role_id:
-                logging.error("GUILD_ID or UNVERIFIED_ROLE_ID not set")
-                return
-            
-            guild = member.guild
-            if guild.id != guild_id:
+            if not get_settings(member.guild.id).unverified_role_id:
+                log.error("UNVERIFIED_ROLE_ID not set for guild %s", member.guild.id)
                 return
             
-            # Enhanced duplicate prevention with timestamp tracking
-            current_time = time.time()
-            user_id = str(member.id)
-            
-            # Check if this member was processed recently (within 30 seconds)
-            last_processed = self.member_join_timestamps.get(user_id, 0)
-            if current_time - last_processed < 30:
-                logging.info(f"Duplicate member join event for {member.display_name} ({member.id}) - skipping log (processed {current_time - last_processed:.1f}s ago)")
+            # Gateway resumes and restarts can replay a join; handle each member once per JOIN_DEDUP_TTL
+            seen_at = state.join_dedup.seen_at(member.id)
+            if seen_at is not None:
+                log.info("Duplicate member join event for %s (%s) - skipping log (processed %.1fs ago)", member.display_name, member.id, time.time() - seen_at)
                 return
             
-            # Update timestamp immediately to prevent duplicates
-            self.member_join_timestamps[user_id] = current_time
+            # Mark as handled immediately to prevent duplicates
+            state.join_dedup.add(member.id)
             
-            # Check if this member has already been logged (additional safety)
-            if user_id in self.logged_members:
-                logging.info(f"Member {member.display_name} ({member.id}) already in logged_members - skipping log")
+            # Role changes and logging happen on the join pipeline's workers
+            state.join_pipeline.submit(member)
+                
+        except Exception as e:
+            log.error("Error handling member join for %s: %s", member.id, e)
+            # Let a later join event retry this member
+            state.join_dedup.discard(member.id)
+
+    @commands.Cog.listener()
+    @track('Welcome.on_raw_member_remove')
+    async def on_raw_member_remove(self, payload):
+        """Forget a departed member everywhere at once so no scan has to find them later"""
+        try:
+            if payload.guild_id not in self.guilds:
                 return
+            self.forget_member(payload.user.id, payload.guild_id)
+        except Exception as e:
+            log.error("Error handling member removal for %s: %s", payload.user.id, e)
+
+    def forget_member(self, user_id, guild_id=None):
+        """Evict user_id from the guild's store, join dedup and pending role grants, and from cooldowns"""
+        user_id = int(user_id)
+        guild_id = get_settings().guild_id if guild_id is None else guild_id
+        state = self.state(guild_id)
+        if state:
+            state.role_scheduler.cancel(user_id)
+            state.join_pipeline.discard(user_id)
+            state.join_dedup.discard(user_id)
+        button_limiter.reset(cooldown_key(guild_id, user_id))
+        get_user_store(guild_id).delete(user_id)
+        log.info("Forgot member %s (left server %s)", user_id, guild_id)
+
+    @track('Welcome.process_member_join')
+    async def process_member_join(self, member, raid_mode=False):
+        """Swap a new member onto the unverified role, log the join and record it"""
+        user_id = str(member.id)
+        guild = member.guild
+        try:
+            settings = get_settings(guild.id)
+            guild_handles = handles.for_guild(guild.id)
             
-            # Mark as logged immediately to prevent duplicates
-            self.logged_members.add(user_id)
-            self.save_logged_members()
-            
-            logging.info(f"Processing member join for {member.display_name} ({member.id})")
+            log.info("Processing member join for %s (%s)", member.display_name, member.id)
             
             # Get the unverified role
-            unverified_role = guild.get_role(unverified_role_id)
+            unverified_role = guild_handles.unverified_role
             if not unverified_role:
-                logging.error(f"Unverified role {unverified_role_id} not found")
+                log.error("Unverified role %s not found", settings.unverified_role_id)
                 return
             
-            # Remove member role first if they have it (in case they rejoined)
-            member_role_id = int(os.getenv('MEMBER_ROLE_ID', 0))
-            if member_role_id:
-                member_role = guild.get_role(member_role_id)
-                if member_role and member_role in member.roles:
-                    await member.remove_roles(member_role)
-                    logging.info(f"Removed member role from {member.display_name} ({member.id}) - they rejoined")
-            
-            # Assign unverified role
-            if unverified_role not in member.roles:
-                await member.add_roles(unverified_role)
-                logging.info(f"Assigned unverified role to {member.display_name} ({member.id})")
+            # Remove member role if they have it (in case they rejoined) and assign unverified in one call
+            remove = []
+            member_role = guild_handles.member_role
+            if member_role and member.get_role(member_role.id):
+                remove.append(member_role)
+                log.info("Removing member role from %s (%s) - they rejoined", member.display_name, member.id)
+            add = [unverified_role] if not member.get_role(unverified_role.id) else []
+            if add or remove:
+                await RoleChange(member, add, remove).apply()
+                log.info("Assigned unverified role to %s (%s)", member.display_name, member.id)
             else:
-                logging.info(f"User {member.display_name} ({member.id}) already has unverified role")
-            
-            # Log to logs channel (only once per member)
-            if logs_channel_id:
-                logs_channel = guild.get_channel(logs_channel_id)
-                if logs_channel:
-                    embed = discord.Embed(
-                        title="👋 New Member Joined",
-                        description=f"**{member.mention}** has joined the server",
-                        color=0x00ff00,
-                        timestamp=datetime.now(timezone.utc)
-                    )
-                    embed.add_field(name="User ID", value=f"`{member.id}`", inline=True)
-                    embed.add_field(name="Account Created", value=f"<t:{int(member.created_at.timestamp())}:R>", inline=True)
-                    embed.add_field(name="Role Assigned", value=f"✅ Unverified Role", inline=True)
-                    embed.set_thumbnail(url=member.display_avatar.url)
-                    embed.set_footer(text=f"Member #{guild.member_count}")
-                    
-                    try:
-                        await logs_channel.send(embed=embed)
-                        logging.info(f"Successfully logged member join for {member.display_name} ({member.id})")
-                    except discord.Forbidden:
-                        logging.warning(f"Bot doesn't have permission to send messages to logs channel {logs_channel_id}")
-                    except Exception as e:
-                        logging.error(f"Error sending log message: {e}")
+                log.info("User %s (%s) already has unverified role", member.display_name, member.id)
+            
+            # Log to logs channel (only once per member; raids are logged as periodic summaries)
+            if settings.logs_channel_id and not raid_mode:
+                embed = discord.Embed(
+                    title="👋 New Member Joined",
+                    description=f"**{member.mention}** has joined the server",
+                    color=0x00ff00,
+                    timestamp=datetime.now(timezone.utc)
+                )
+                embed.add_field(name="User ID", value=f"`{member.id}`", inline=True)
+                embed.add_field(name="Account Created", value=f"<t:{int(member.created_at.timestamp())}:R>", inline=True)
+                embed.add_field(name="Role Assigned", value=f"✅ Unverified Role", inline=True)
+                embed.set_thumbnail(url=member.display_avatar.url)
+                embed.set_footer(text=f"Member #{guild.member_count}")
+                submit_log(self.bot, embed, guild.id)
             
             # Record user data for role assignment
-            try:
-                from utils import safe_json_read, safe_json_write
-                user_data = safe_json_read(USER_DATA_FILE, {})
-            except ImportError:
-                # Fallback to direct file operations
-                try:
-                    with open(USER_DATA_FILE, 'r') as f:
-                        user_data = json.load(f)
-                except FileNotFoundError:
-                    user_data = {}
-            
-            current_time = datetime.now(timezone.utc).timestamp()
-            
-            user_data[user_id] = {
-                'joined_at': current_time,
-                'has_access': False,
-                'role_assigned': False,
-                'unverified_role_assigned': True,
-                'button_clicked_at': 0  # Reset button click when they rejoin
-            }
-            
-            try:
-                from utils import safe_json_write
-                safe_json_write(USER_DATA_FILE, user_data)
-            except ImportError:
-                # Fallback to direct file operations
-                with open(USER_DATA_FILE, 'w') as f:
-                    json.dump(user_data, f, indent=2)
-                
-        except Exception as e:
-            logging.error(f"Error handling member join for {member.id}: {e}")
-            # Remove from logged_members if there was an error
-            self.logged_members.discard(str(member.id))
-            self.save_logged_members()
-
-    def load_logged_members(self):
-        """Load logged members from file"""
-        try:
-            with open('logged_members.json', 'r') as f:
-                data = json.load(f)
-                self.logged_members = set(data.get('logged_members', []))
-                logging.info(f"Loaded {len(self.logged_members)} logged members")
-                
-                # Clean up old entries (keep only recent ones, older than 1 hour)
-                current_time = time.time()
-                cleaned_members = set()
-                for member_id in self.logged_members:
-                    # For now, just keep all entries but we could add timestamp tracking later
-                    cleaned_members.add(member_id)
+            get_user_store(guild.id).upsert(
+                user_id,
+                joined_at=datetime.now(timezone.utc).timestamp(),
+                has_access=False,
+                role_assigned=False,
+                unverified_role_assigned=True,
+                button_clicked_at=0  # Reset button click when they rejoin
+            )
                 
-                if len(cleaned_members) != len(self.logged_members):
-                    self.logged_members = cleaned_members
-                    self.save_logged_members()
-                    logging.info(f"Cleaned up logged members: {len(self.logged_members)} remaining")
-                    
-        except FileNotFoundError:
-            self.logged_members = set()
-            logging.info("No logged members file found, starting fresh")
         except Exception as e:
-            logging.error(f"Error loading logged members: {e}")
-            self.logged_members = set()
+            log.error("Error handling member join for %s: %s", member.id, e)
+            # Let a later join event retry this member
+            state = self.guilds.get(guild.id)
+            if state:
+                state.join_dedup.discard(member.id)
+            raise
 
-    def save_logged_members(self):
-        """Save logged members to file"""
-        try:
-            with open('logged_members.json', 'w') as f:
-                json.dump({'logged_members': list(self.logged_members)}, f, indent=2)
-        except Exception as e:
-            logging.error(f"Error saving logged members: {e}")
+    async def send_raid_summary(self, pipeline, joins, guild_id=None):
+        """Post one summary embed for the joins processed during a raid"""
+        stats = pipeline.stats()
+        embed = discord.Embed(
+            title="🚨 Join Raid In Progress",
+            description=f"**{joins}** members joined and were given the Unverified role since the last summary",
+            color=0xff0000,
+            timestamp=datetime.now(timezone.utc)
+        )
+        embed.add_field(name="Join Rate", value=f"{stats['join_rate']}/s", inline=True)
+        embed.add_field(name="Queue Depth", value=str(stats['queue_depth']), inline=True)
+        embed.add_field(name="Max Lag", value=f"{stats['max_lag']:.1f}s", inline=True)
+        embed.add_field(name="Failed", value=str(stats['failed']), inline=True)
+        submit_log(self.bot, embed, guild_id)
 
-    async def role_assignment_loop(self):
-        """Background task to assign member roles and remove unverified roles"""
-        while True:
-            try:
-                await self.check_and_assign_roles()
-                await asyncio.sleep(30)  # Check every 30 seconds
-            except Exception as e:
-                logging.error(f"Error in role assignment loop: {e}")
-                await asyncio.sleep(60)  # Wait longer on error
+    def schedule_role_assignment(self, user_id, button_clicked_at, guild_id=None):
+        """Queue a member role grant for button_clicked_at + ROLE_ASSIGNMENT_DELAY"""
+        state = self.state(guild_id)
+        if state:
+            state.role_scheduler.schedule(int(user_id), button_clicked_at + get_settings(guild_id).role_assignment_delay)
 
-    async def cleanup_cooldowns_loop(self):
-        """Background task to clean up expired button cooldowns"""
-        while True:
-            try:
-                await self.cleanup_expired_cooldowns()
-                await asyncio.sleep(300)  # Check every 5 minutes
-            except Exception as e:
-                logging.error(f"Error in cooldown cleanup loop: {e}")
-                await asyncio.sleep(600)  # Wait longer on error
+    async def load_role_assignment_schedule(self, guild_id=None):
+        """Rebuild the role assignment schedule from persisted button clicks"""
+        pending = await (await aget_user_store(guild_id)).ascan_pending()
+        for data in pending:
+            self.schedule_role_assignment(data['user_id'], data['button_clicked_at'], guild_id)
+        if pending:
+            log.info("Scheduled %s pending role assignments for guild %s", len(pending), guild_id)
 
-    async def cleanup_expired_cooldowns(self):
-        """Clean up expired button cooldowns from file"""
+    @track('Welcome.check_and_assign_roles')
+    async def check_and_assign_roles(self, user_id, guild_id=None):
+        """Assign the member role to a user whose role assignment delay has passed"""
+        state = self.state(guild_id)
+        if state is None:
+            return
+        scheduler = state.role_scheduler
         try:
-            from .verification import COOLDOWN_FILE, RATE_LIMIT_SECONDS
-            import time
+            store = get_user_store(guild_id)
+            guild_handles = handles.for_guild(guild_id)
+            data = await store.aget(user_id)
             
-            try:
-                with open(COOLDOWN_FILE, 'r') as f:
-                    cooldowns = json.load(f)
-            except FileNotFoundError:
-                return
-            except Exception as e:
-                logging.error(f"Error reading cooldown file: {e}")
+            # The record may have changed since it was scheduled (rejoin, manual fix, ...)
+            if not data or not data.get('button_clicked_at') or data.get('has_access') or data.get('role_assigned'):
                 return
             
-            current_time = time.time()
-            expired_users = []
-            
-            for user_id, last_click in cooldowns.items():
-                if current_time - last_click >= RATE_LIMIT_SECONDS:
-                    expired_users.append(user_id)
-            
-            # Remove expired cooldowns
-            for user_id in expired_users:
-                del cooldowns[user_id]
-            
-            if expired_users:
-                try:
-                    with open(COOLDOWN_FILE, 'w') as f:
-                        json.dump(cooldowns, f, indent=2)
-                    logging.info(f"Cleaned up {len(expired_users)} expired button cooldowns")
-                except Exception as e:
-                    logging.error(f"Error saving cleaned cooldowns: {e}")
-                    
-        except Exception as e:
-            logging.error(f"Error in cleanup_expired_cooldowns: {e}")
+            due_at = data['button_clicked_at'] + get_settings(guild_id).role_assignment_delay
+            if due_at > time.time():
+                scheduler.schedule(user_id, due_at)
+                return
             
-            # Report critical error to owners
-            try:
-                await self.report_critical_error("Cooldown Cleanup Error", f"Error in cleanup_expired_cooldowns: {e}")
-            except Exception as report_error:
-                logging.error(f"Failed to report critical error: {report_error}")
-
-    async def check_and_assign_roles(self):
-        """Check if any users need role assignment"""
-        try:
-            # Load user data
-            from utils import safe_json_read
-            user_data = safe_json_read(USER_DATA_FILE, {})
-            if not user_data:
+            guild = guild_handles.guild
+            if not guild:
                 return
             
-            current_time = datetime.now(timezone.utc).timestamp()
-            delay_seconds = int(os.getenv('ROLE_ASSIGNMENT_DELAY', 300))  # 5 minutes in seconds
+            member = await member_cache.get(guild, user_id)
+            if not member:
+                # User left the server
+                store.delete(user_id)
+                log.info("Removed user %s from data (left server)", user_id)
+                return
             
-            # Create a list of users to remove (can't modify dict while iterating)
-            users_to_remove = []
+            # Check if user actually has member role before assigning
+            member_role = guild_handles.member_role
+            if not member_role:
+                return
             
-            for user_id_str, data in user_data.items():
-                user_id = int(user_id_str)
-                
-                # Check if user is still in the guild
-                guild_id = int(os.getenv('GUILD_ID', 0))
-                guild = self.bot.get_guild(guild_id)
-                if not guild:
-                    continue
+            if not role_index.holds(member, member_role.id):
+                await self.assign_member_role(user_id, guild_id)
+                # Remove unverified role when they get member role
+                await self.remove_unverified_role(user_id, guild_id)
                 
-                member = guild.get_member(user_id)
-                if not member:
-                    # User left the server, mark for removal
-                    users_to_remove.append(user_id_str)
-                    logging.info(f"User {user_id} left the server, will remove from data")
-                    continue
-                
-                # Only assign member role if user clicked the button and doesn't already have it
-                button_clicked_at = data.get('button_clicked_at', 0)
-                if button_clicked_at and not data.get('has_access', False) and not data.get('role_assigned', False):
-                    if current_time - button_clicked_at >= delay_seconds:
-                        # Check if user actually has member role before assigning
-                        member_role_id = int(os.getenv('MEMBER_ROLE_ID', 0))
-                        if member_role_id:
-                            guild = self.bot.get_guild(guild_id)
-                            if guild:
-                                member_role = guild.get_role(member_role_id)
-                                if member_role and member_role not in member.roles:
-                                    await self.assign_member_role(user_id)
-                                    # Remove unverified role when they get member role
-                                    await self.remove_unverified_role(user_id)
-                                else:
-                                    # User already has member role, just update data
-                                    data['has_access'] = True
-                                    data['role_assigned'] = True
-                                    user_data[user_id_str] = data
-                                    logging.info(f"User {user_id} already has member role, updated data")
-            
-            # Remove users who left the server
-            for user_id_str in users_to_remove:
-                del user_data[user_id_str]
-                logging.info(f"Removed user {user_id_str} from data (left server)")
-            
-            # Save updated data if any users were removed
-            if users_to_remove:
-                from utils import safe_json_write
-                safe_json_write(USER_DATA_FILE, user_data)
+                # assign_member_role logs its own failures; try again later if it did not stick
+                data = await store.aget(user_id)
+                if data and not data.get('has_access'):
+                    scheduler.schedule(user_id, time.time() + ROLE_ASSIGNMENT_RETRY_SECONDS)
+            else:
+                # User already has member role, just update data
+                store.update(user_id, has_access=True, role_assigned=True)
+                log.info("User %s already has member role, updated data", user_id)
                     
         except Exception as e:
-            logging.error(f"Error checking role assignments: {e}")
+            log.error("Error checking role assignment for %s: %s", user_id, e)
+            scheduler.schedule(user_id, time.time() + ROLE_ASSIGNMENT_RETRY_SECONDS)
             
             # Report critical error to owners
             try:
-                await self.report_critical_error("Role Assignment Error", f"Error in role assignment loop: {e}")
+                await self.report_critical_error("Role Assignment Error", f"Error in role assignment scheduler: {e}")
             except Exception as report_error:
-                logging.error(f"Failed to report critical error: {report_error}")
+                log.error("Failed to report critical error: %s", report_error)
 
-    async def assign_member_role(self, user_id):
+    async def assign_member_role(self, user_id, guild_id=None):
         """Assign member role to user"""
         try:
-            guild_id = int(os.getenv('GUILD_ID', 0))
-            member_role_id = int(os.getenv('MEMBER_ROLE_ID', 0))
-            logs_channel_id = int(os.getenv('LOGS_CHANNEL_ID', 0))
-            
-            if not guild_id or not member_role_id:
-                logging.error("GUILD_ID or MEMBER_ROLE_ID not set")
+            settings = get_settings(guild_id)
+            guild_handles = handles.for_guild(guild_id)
+            if not settings.guild_id or not settings.member_role_id:
+                log.error("GUILD_ID or MEMBER_ROLE_ID not set")
                 return
             
-            guild = self.bot.get_guild(guild_id)
+            guild = guild_handles.guild
             if not guild:
-                logging.error(f"Guild {guild_id} not found")
+                log.error("Guild %s not found", settings.guild_id)
                 return
             
-            member = guild.get_member(user_id)
+            member = await member_cache.get(guild, user_id)
             if not member:
-                logging.info(f"Member {user_id} not found in guild (likely left)")
+                log.info("Member %s not found in guild (likely left)", user_id)
                 return
             
-            role = guild.get_role(member_role_id)
+            role = guild_handles.member_role
             if not role:
-                logging.error(f"Role {member_role_id} not found")
+                log.error("Role %s not found", settings.member_role_id)
                 return
             
-            if role in member.roles:
-                logging.info(f"User {user_id} already has member role")
+            if role_index.holds(member, role.id):
+                log.info("User %s already has member role", user_id)
                 # Update user data to reflect they already have the role
-                from utils import safe_json_read
-                user_data = safe_json_read(USER_DATA_FILE, {})
-                
-                user_id_str = str(user_id)
-                if user_id_str in user_data:
-                    user_data[user_id_str]['has_access'] = True
-                    user_data[user_id_str]['role_assigned'] = True
-                    
-                    with open(USER_DATA_FILE, 'w') as f:
-                        json.dump(user_data, f, indent=2)
+                get_user_store(guild_id).update(user_id, has_access=True, role_assigned=True)
                 return
             
             await member.add_roles(role)
-            logging.info(f"Assigned member role to user {user_id}")
+            role_index.note_change(guild.id, user_id, added=[role.id])
+            ROLE_CHANGES.inc(role=role.name, action='grant')
+            log.info("Assigned member role to user %s", user_id)
             
             # Log to logs channel
-            if logs_channel_id:
-                logs_channel = guild.get_channel(logs_channel_id)
-                if logs_channel:
-                    embed = discord.Embed(
-                        title="✅ Member Role Assigned",
-                        description=f"**{member.mention}** has been assigned the Member role",
-                        color=0x00ff00,
-                        timestamp=datetime.now(timezone.utc)
-                    )
-                    embed.add_field(name="User ID", value=f"`{user_id}`", inline=True)
-                    embed.add_field(name="Role", value=f"✅ Member", inline=True)
-                    embed.set_thumbnail(url=member.display_avatar.url)
-                    
-                    try:
-                        await logs_channel.send(embed=embed)
-                    except discord.Forbidden:
-                        logging.warning(f"Bot doesn't have permission to send messages to logs channel {logs_channel_id}")
-                    except Exception as e:
-                        logging.error(f"Error sending log message: {e}")
+            if settings.logs_channel_id:
+                embed = discord.Embed(
+                    title="✅ Member Role Assigned",
+                    description=f"**{member.mention}** has been assigned the Member role",
+                    color=0x00ff00,
+                    timestamp=datetime.now(timezone.utc)
+                )
+                embed.add_field(name="User ID", value=f"`{user_id}`", inline=True)
+                embed.add_field(name="Role", value=f"✅ Member", inline=True)
+                embed.set_thumbnail(url=member.display_avatar.url)
+                submit_log(self.bot, embed, guild.id)
             
             # Update user data
-            try:
-                with open(USER_DATA_FILE, 'r') as f:
-                    user_data = json.load(f)
-            except FileNotFoundError:
-                user_data = {}
-            
-            user_id_str = str(user_id)
-            if user_id_str in user_data:
-                user_data[user_id_str]['has_access'] = True
-                user_data[user_id_str]['role_assigned'] = True
-                
-                with open(USER_DATA_FILE, 'w') as f:
-                    json.dump(user_data, f, indent=2)
+            get_user_store(guild_id).update(user_id, has_access=True, role_assigned=True)
             
         except Exception as e:
-            logging.error(f"Error assigning member role to {user_id}: {e}")
+            log.error("Error assigning member role to %s: %s", user_id, e)
             
             # Report critical error to owners
             try:
                 await self.report_critical_error("Member Role Assignment Error", f"Failed to assign member role to user {user_id}: {e}")
             except Exception as report_error:
-                logging.error(f"Failed to report critical error: {report_error}")
+                log.error("Failed to report critical error: %s", report_error)
 
-    async def remove_unverified_role(self, user_id):
+    async def remove_unverified_role(self, user_id, guild_id=None):
         """Remove unverified role from user"""
         try:
-            guild_id = int(os.getenv('GUILD_ID', 0))
-            unverified_role_id = int(os.getenv('UNVERIFIED_ROLE_ID', 0))
-            logs_channel_id = int(os.getenv('LOGS_CHANNEL_ID', 0))
-            
-            if not guild_id or not unverified_role_id:
-                logging.error("GUILD_ID or UNVERIFIED_ROLE_ID not set")
+            settings = get_settings(guild_id)
+            guild_handles = handles.for_guild(guild_id)
+            if not settings.guild_id or not settings.unverified_role_id:
+                log.error("GUILD_ID or UNVERIFIED_ROLE_ID not set")
                 return
             
-            guild = self.bot.get_guild(guild_id)
+            guild = guild_handles.guild
             if not guild:
-                logging.error(f"Guild {guild_id} not found")
+                log.error("Guild %s not found", settings.guild_id)
                 return
             
-            member = guild.get_member(user_id)
+            member = await member_cache.get(guild, user_id)
             if not member:
-                logging.info(f"Member {user_id} not found in guild (likely left)")
+                log.info("Member %s not found in guild (likely left)", user_id)
                 return
             
-            role = guild.get_role(unverified_role_id)
+            role = guild_handles.unverified_role
             if not role:
-                logging.error(f"Role {unverified_role_id} not found")
+                log.error("Role %s not found", settings.unverified_role_id)
                 return
             
-            if role not in member.roles:
-                logging.info(f"User {user_id} doesn't have unverified role")
+            if not role_index.holds(member, role.id):
+                log.info("User %s doesn't have unverified role", user_id)
                 return
             
             await member.remove_roles(role)
-            logging.info(f"Removed unverified role from user {user_id}")
+            role_index.note_change(guild.id, user_id, removed=[role.id])
+            ROLE_CHANGES.inc(role=role.name, action='remove')
+            log.info("Removed unverified role from user %s", user_id)
             
             # Log to logs channel
-            if logs_channel_id:
-                logs_channel = guild.get_channel(logs_channel_id)
-                if logs_channel:
-                    embed = discord.Embed(
-                        title="🔓 Unverified Role Removed",
-                        description=f"**{member.mention}** has had their Unverified role removed",
-                        color=0xffa500,
-                        timestamp=datetime.now(timezone.utc)
-                    )
-                    embed.add_field(name="User ID", value=f"`{user_id}`", inline=True)
-                    embed.add_field(name="Role Removed", value=f"🔓 Unverified", inline=True)
-                    embed.set_thumbnail(url=member.display_avatar.url)
-                    
-                    try:
-                        await logs_channel.send(embed=embed)
-                    except discord.Forbidden:
-                        logging.warning(f"Bot doesn't have permission to send messages to logs channel {logs_channel_id}")
-                    except Exception as e:
-                        logging.error(f"Error sending log message: {e}")
+            if settings.logs_channel_id:
+                embed = discord.Embed(
+                    title="🔓 Unverified Role Removed",
+                    description=f"**{member.mention}** has had their Unverified role removed",
+                    color=0xffa500,
+                    timestamp=datetime.now(timezone.utc)
+                )
+                embed.add_field(name="User ID", value=f"`{user_id}`", inline=True)
+                embed.add_field(name="Role Removed", value=f"🔓 Unverified", inline=True)
+                embed.set_thumbnail(url=member.display_avatar.url)
+                submit_log(self.bot, embed, guild.id)
             
             # Update user data to mark unverified role as removed
-            try:
-                with open(USER_DATA_FILE, 'r') as f:
-                    user_data = json.load(f)
-            except FileNotFoundError:
-                user_data = {}
-            
-            user_id_str = str(user_id)
-            if user_id_str in user_data:
-                user_data[user_id_str]['unverified_role_assigned'] = False
-                
-                with open(USER_DATA_FILE, 'w') as f:
-                    json.dump(user_data, f, indent=2)
+            get_user_store(guild_id).update(user_id, unverified_role_assigned=False)
             
         except Exception as e:
-            logging.error(f"Error removing unverified role from {user_id}: {e}")
+            log.error("Error removing unverified role from %s: %s", user_id, e)
 
-    async def sync_user_data_with_roles(self):
+    async def sync_user_data_with_roles(self, guild_id=None):
         """Sync user data with actual Discord roles to prevent incorrect assignments"""
         try:
-            guild_id = int(os.getenv('GUILD_ID', 0))
-            member_role_id = int(os.getenv('MEMBER_ROLE_ID', 0))
-            unverified_role_id = int(os.getenv('UNVERIFIED_ROLE_ID', 0))
-            
-            if not guild_id:
-                logging.error("GUILD_ID not set")
+            settings = get_settings(guild_id)
+            guild_handles = handles.for_guild(guild_id)
+            if not settings.guild_id:
+                log.error("GUILD_ID not set")
                 return
             
-            guild = self.bot.get_guild(guild_id)
+            guild = guild_handles.guild
             if not guild:
-                logging.error(f"Guild {guild_id} not found")
+                log.error("Guild %s not found", settings.guild_id)
                 return
             
+            member_role = guild_handles.member_role
+            unverified_role = guild_handles.unverified_role
+            
+            # Build the index before reading the store so the snapshot is as fresh as possible
+            if not role_index.ready(guild.id):
+                await role_index.build(guild)
+            
             # Load user data
-            try:
-                with open(USER_DATA_FILE, 'r') as f:
-                    user_data = json.load(f)
-            except FileNotFoundError:
-                logging.info("No user data file found, skipping sync")
+            store = await aget_user_store(guild_id)
+            user_data = await store.aall_users()
+            if not user_data:
+                log.info("No user data stored, skipping sync")
                 return
             
-            member_role = guild.get_role(member_role_id) if member_role_id else None
-            unverified_role = guild.get_role(unverified_role_id) if unverified_role_id else None
+            def role_flags(user_id):
+                has_member_role = bool(member_role) and role_index.has_role(guild.id, user_id, member_role.id)
+                has_unverified_role = bool(unverified_role) and role_index.has_role(guild.id, user_id, unverified_role.id)
+                return has_member_role, has_unverified_role
             
-            updated = False
-            users_to_remove = []
+            out_of_sync = []
+            left_server = []
             
-            for user_id_str, data in user_data.items():
-                user_id = int(user_id_str)
-                member = guild.get_member(user_id)
+            for index, data in enumerate(user_data, 1):
+                # Let the gateway breathe while walking very large user tables
+                if index % SYNC_CHUNK_SIZE == 0:
+                    log.info("User data sync: %s/%s users checked", index, len(user_data))
+                    await asyncio.sleep(0)
                 
-                if not member:
-                    # User left the server, mark for removal
-                    users_to_remove.append(user_id_str)
-                    logging.info(f"User {user_id} left the server, will remove from sync data")
-                    continue
-                
-                # Check if user has member role
-                has_member_role = member_role and member_role in member.roles
-                has_unverified_role = unverified_role and unverified_role in member.roles
+                user_id = data['user_id']
                 
-                # Update data to match actual Discord state
-                if data.get('has_access', False) != has_member_role:
-                    data['has_access'] = has_member_role
-                    data['role_assigned'] = has_member_role
-                    updated = True
-                    logging.info(f"Synced member role status for user {user_id}: {has_member_role}")
+                # Membership comes from the role index, which covers members the cache policy skips
+                if not role_index.is_member(guild.id, user_id):
+                    left_server.append(user_id)
+                    continue
                 
-                if data.get('unverified_role_assigned', False) != has_unverified_role:
-                    data['unverified_role_assigned'] = has_unverified_role
-                    updated = True
-                    logging.info(f"Synced unverified role status for user {user_id}: {has_unverified_role}")
+                has_member_role, has_unverified_role = role_flags(user_id)
+                if (data.get('has_access', False) != has_member_role
+                        or data.get('unverified_role_assigned', False) != has_unverified_role):
+                    out_of_sync.append(user_id)
                 
                 # If user has member role but no button click recorded, reset their data
                 if has_member_role and not data.get('button_clicked_at', 0):
-                    data['button_clicked_at'] = 0
-                    updated = True
-                    logging.info(f"Reset button click data for user {user_id} - they have member role but no click recorded")
-            
-            # Remove users who left the server
-            for user_id_str in users_to_remove:
-                del user_data[user_id_str]
-                logging.info(f"Removed user {user_id_str} from sync data (left server)")
-                updated = True
-            
-            if updated:
-                with open(USER_DATA_FILE, 'w') as f:
-                    json.dump(user_data, f, indent=2)
-                logging.info("User data synced with Discord roles")
+                    log.info("User %s has the member role but no button click recorded", user_id)
+            
+            # Everything below runs without yielding, against the index as it is now: clicks,
+            # joins and grants that landed during the walk are kept, and only the role flags
+            # this sync computes are written
+            left_server = [user_id for user_id in left_server if not role_index.is_member(guild.id, user_id)]
+            if left_server:
+                store.delete_many(left_server)
+                log.info("Removed %s users from sync data (left server)", len(left_server))
+            
+            updates = {}  # (has_member_role, has_unverified_role) -> user ids
+            for user_id in out_of_sync:
+                updates.setdefault(role_flags(user_id), []).append(user_id)
+            for (has_member_role, has_unverified_role), user_ids in updates.items():
+                store.update_many(
+                    user_ids,
+                    has_access=has_member_role,
+                    role_assigned=has_member_role,
+                    unverified_role_assigned=has_unverified_role
+                )
+                log.info("Synced %s users to member role %s, unverified role %s", len(user_ids), has_member_role, has_unverified_role)
+            if updates:
+                log.info("User data synced with Discord roles")
             
         except Exception as e:
-            logging.error(f"Error syncing user data with roles: {e}")
+            log.error("Error syncing user data with roles: %s", e)
 
     async def report_critical_error(self, error_type, error_message):
         """Report critical errors to owners via logs and DM"""
@@ -609,52 +551,12 @@ class Welcome(commands.Cog):
             from .verification import report_critical_error
             await report_critical_error(error_type, error_message, self.bot)
         except Exception as e:
-            logging.error(f"Error in welcome cog error reporting: {e}")
-
-    async def cleanup_logged_members_loop(self):
-        """Background task to clean up old logged members"""
-        while True:
-            try:
-                await self.cleanup_old_logged_members()
-                await asyncio.sleep(3600)  # Check every hour
-            except Exception as e:
-                logging.error(f"Error in logged members cleanup loop: {e}")
-                await asyncio.sleep(7200)  # Wait longer on error
-
-    async def cleanup_old_logged_members(self):
-        """Clean up old logged members (older than 24 hours)"""
-        try:
-            current_time = time.time()
-            
-            # Clean up old timestamps (older than 1 hour)
-            old_timestamps = []
-            for user_id, timestamp in self.member_join_timestamps.items():
-                if current_time - timestamp > 3600:  # 1 hour
-                    old_timestamps.append(user_id)
-            
-            for user_id in old_timestamps:
-                del self.member_join_timestamps[user_id]
-            
-            if old_timestamps:
-                logging.info(f"Cleaned up {len(old_timestamps)} old member join timestamps")
-            
-            # For logged_members, clear if too many entries
-            if len(self.logged_members) > 1000:  # If we have more than 1000 logged members
-                self.logged_members.clear()
-                self.save_logged_members()
-                logging.info("Cleared logged members set (too many entries)")
-                
-        except Exception as e:
-            logging.error(f"Error cleaning up old logged members: {e}")
+            log.error("Error in welcome cog error reporting: %s", e)
 
-    def cog_unload(self):
+    async def cog_unload(self):
         """Clean up when cog is unloaded"""
-        if self.role_assignment_task:
-            self.role_assignment_task.cancel()
-        if self.cooldown_cleanup_task:
-            self.cooldown_cleanup_task.cancel()
-        if hasattr(self, 'logged_members_cleanup_task') and self.logged_members_cleanup_task:
-            self.logged_members_cleanup_task.cancel()
+        for state in self.guilds.values():
+            await state.close()
 
 async def setup(bot):
     await bot.add_cog(Welcome(bot))
\ No newline at end of file
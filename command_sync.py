@@ -0,0 +1,94 @@
+import hashlib
+import json
+import logging
+import os
+import time
+
+import discord
+
+from config import guild_ids
+from utils import async_json_read, async_json_write
+
+log = logging.getLogger('gatekeeper.command_sync')
+
+COMMAND_SYNC_FILE = os.getenv('COMMAND_SYNC_FILE', 'command_sync.json')
+
+
+def command_tree_hash(tree):
+    """SHA-256 of the global commands exactly as they would be sent to Discord"""
+    commands = sorted(tree.get_commands(), key=lambda command: (command.name, type(command).__name__))
+    payload = json.dumps([command.to_dict(tree) for command in commands], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+async def sync_command_tree(bot, force=False):
+    """Push the slash commands to Discord only when they changed since the last sync.
+
+    With configured guilds the commands are registered on each of them,
+    which takes effect immediately; otherwise they are synced globally. The
+    hash, scope and application id of the last successful sync are kept in
+    COMMAND_SYNC_FILE. Returns (number synced or None when skipped, scope,
+    seconds taken).
+    """
+    started = time.perf_counter()
+    tree = bot.tree
+    guilds = guild_ids()
+    scope = _scope(guilds)
+    digest = command_tree_hash(tree)
+
+    state = await async_json_read(COMMAND_SYNC_FILE, {})
+    if not isinstance(state, dict):
+        state = {}
+    unchanged = (
+        state.get('hash') == digest
+        and state.get('scope') == scope
+        and state.get('application_id') == bot.application_id
+    )
+    if unchanged and not force:
+        log.info("Command tree unchanged (%s), skipping sync for %s", digest[:12], scope)
+        return None, scope, time.perf_counter() - started
+
+    if guilds:
+        for guild_id in guilds:
+            guild = discord.Object(id=guild_id)
+            tree.copy_global_to(guild=guild)
+            synced = await tree.sync(guild=guild)
+    else:
+        synced = await tree.sync()
+
+    # Commands left registered under the previous scope would show up twice
+    previous = state.get('scope')
+    if state.get('application_id') == bot.application_id and previous and previous != scope:
+        await _clear_scope(bot, previous, keep=guilds)
+    elif not state and guilds:
+        # First sync with this cache: earlier versions registered everything globally
+        await _clear_scope(bot, 'global')
+
+    await async_json_write(COMMAND_SYNC_FILE, {
+        'hash': digest,
+        'scope': scope,
+        'application_id': bot.application_id,
+        'synced_at': time.time(),
+    })
+    seconds = time.perf_counter() - started
+    log.warning("Synced %s slash commands to %s in %.2fs", len(synced), scope, seconds)
+    return len(synced), scope, seconds
+
+
+def _scope(guilds):
+    return f"guild:{','.join(map(str, sorted(guilds)))}" if guilds else 'global'
+
+
+async def _clear_scope(bot, scope, keep=()):
+    """Remove the commands registered under scope, except on the guilds in keep"""
+    # Sent straight to the API so the local tree keeps its commands for dispatch
+    try:
+        if scope == 'global':
+            await bot.http.bulk_upsert_global_commands(bot.application_id, payload=[])
+            log.warning("Cleared slash commands previously registered globally")
+            return
+        for guild_id in {int(part) for part in scope.split(':', 1)[1].split(',')} - set(keep):
+            await bot.http.bulk_upsert_guild_commands(bot.application_id, guild_id, payload=[])
+            log.warning("Cleared slash commands previously registered to guild %s", guild_id)
+    except (discord.HTTPException, ValueError) as e:
+        log.error("Could not clear slash commands registered to %s: %s", scope, e)
@@ -2,7 +2,10 @@ import discord
 from discord.ext import commands
 import os
 import logging
-import json
+from storage import aget_user_store
+from config import get_settings
+from log_sink import submit_log
+from utils import is_authorized_guild_or_owner
 
 async def setup(bot):
     @bot.tree.command(name="addunverified", description="Add unverified role to a user")
@@ -10,7 +13,6 @@ async def setup(bot):
     async def add_unverified_role(interaction: discord.Interaction, user: discord.Member):
         """Add unverified role to a user (admin only)"""
         # SECURITY: Check authorization
-        from main import is_authorized_guild_or_owner
         if not is_authorized_guild_or_owner(interaction):
             return await interaction.response.send_message(
                 "❌ You are not authorized to use this command.", ephemeral=True
@@ -23,7 +25,7 @@ async def setup(bot):
             return await interaction.response.send_message("❌ You need Administrator permissions!", ephemeral=True)
         
         try:
-            unverified_role_id = int(os.getenv('UNVERIFIED_ROLE_ID', 0))
+            unverified_role_id = get_settings(interaction.guild.id).unverified_role_id
             if not unverified_role_id:
                 await interaction.response.send_message("❌ UNVERIFIED_ROLE_ID not configured!", ephemeral=True)
                 return
@@ -39,28 +41,8 @@ async def setup(bot):
             
             await user.add_roles(unverified_role)
             
-            # Update user data
-            try:
-                with open('user_data.json', 'r') as f:
-                    user_data = json.load(f)
-            except FileNotFoundError:
-                user_data = {}
-            
-            user_id_str = str(user.id)
-            if user_id_str in user_data:
-                user_data[user_id_str]['unverified_role_assigned'] = True
-            else:
-                # Create new user data if they don't exist
-                user_data[user_id_str] = {
-                    'joined_at': 0,
-                    'has_access': False,
-                    'role_assigned': False,
-                    'unverified_role_assigned': True,
-                    'button_clicked_at': 0
-                }
-            
-            with open('user_data.json', 'w') as f:
-                json.dump(user_data, f, indent=2)
+            # Update user data (creates a fresh record if they don't exist)
+            (await aget_user_store(interaction.guild.id)).upsert(user.id, unverified_role_assigned=True)
             
             embed = discord.Embed(
                 title="🔒 Unverified Role Added",
@@ -75,18 +57,9 @@ async def setup(bot):
             
             await interaction.response.send_message(embed=embed, ephemeral=True)
             
-            # Log to logs channel
-            logs_channel_id = int(os.getenv('LOGS_CHANNEL_ID', 0))
-            if logs_channel_id:
-                logs_channel = interaction.guild.get_channel(logs_channel_id)
-                if logs_channel:
-                    try:
-                        await logs_channel.send(embed=embed)
-                    except discord.Forbidden:
-                        logging.warning(f"Bot doesn't have permission to send messages to logs channel {logs_channel_id}")
-                    except Exception as e:
-                        logging.error(f"Error sending log message: {e}")
-                    
+            # Log to logs channel (batched through the log sink)
+            submit_log(interaction.client, embed, interaction.guild.id)
+            
         except Exception as e:
             logging.error(f"Error adding unverified role: {e}")
             await interaction.response.send_message("❌ An error occurred while adding the role.", ephemeral=True) 
\ No newline at end of file
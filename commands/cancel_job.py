@@ -0,0 +1,34 @@
+import discord
+from discord.ext import commands
+import logging
+from commands.deferred import check_admin, running_jobs
+
+async def setup(bot):
+    @bot.tree.command(name="cancel", description="Cancel running admin commands such as /cleanup_roles")
+    @discord.app_commands.default_permissions(administrator=True)
+    async def cancel_job(interaction: discord.Interaction, command: str = None):
+        """Cancel this server's running admin commands, optionally only one by name (admin only)"""
+        try:
+            if not await check_admin(interaction):
+                return
+
+            name = command.lstrip('/') if command else None
+            jobs = running_jobs(interaction.guild.id, name)
+            if not jobs:
+                await interaction.response.send_message(
+                    f"ℹ️ No running {'/' + name if name else 'admin commands'} to cancel.", ephemeral=True
+                )
+                return
+
+            cancelled = [job for job in jobs if job.cancel()]
+            lines = [f"• /{job.name} started by {job.interaction.user.mention} {job.elapsed:.0f}s ago" for job in cancelled]
+            logging.info(f"{interaction.user} cancelled {len(cancelled)} running command(s)")
+            await interaction.response.send_message(f"⏹️ Cancelled:\n" + "\n".join(lines), ephemeral=True)
+
+        except Exception as e:
+            logging.error(f"Error in cancel command: {e}")
+            try:
+                if not interaction.response.is_done():
+                    await interaction.response.send_message("❌ An error occurred while cancelling.", ephemeral=True)
+            except Exception as response_error:
+                logging.error(f"Error sending error response: {response_error}")
@@ -8,24 +8,20 @@ from datetime import datetime, timezone, timedelta
 from typing import Dict, List, Optional, Set
 import asyncio
 import pytz
+from utils import async_json_read, async_json_write, is_authorized_guild_or_owner
 
 # File to store channel schedules
 SCHEDULE_FILE = "daily_channel_schedules.json"
 
 
-def load_schedules() -> Dict:
+async def load_schedules() -> Dict:
     """Load channel schedules from file"""
-    try:
-        with open(SCHEDULE_FILE, "r") as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return {}
+    return await async_json_read(SCHEDULE_FILE, {})
 
 
-def save_schedules(schedules: Dict) -> None:
+async def save_schedules(schedules: Dict) -> None:
     """Save channel schedules to file"""
-    with open(SCHEDULE_FILE, "w") as f:
-        json.dump(schedules, f, indent=2)
+    await async_json_write(SCHEDULE_FILE, schedules)
 
 
 async def timezone_autocomplete(
@@ -179,8 +175,6 @@ async def setup(bot):
         await interaction.response.defer(ephemeral=True)
 
         # SECURITY: Check authorization
-        from main import is_authorized_guild_or_owner
-
         if not is_authorized_guild_or_owner(interaction):
             return await interaction.followup.send(
                 "❌ You are not authorized to use this command.", ephemeral=True
@@ -239,12 +233,10 @@ async def setup(bot):
             "created_at": datetime.now(timezone.utc).isoformat(),
         }
 
-        # Save to memory and file
+        # Save to memory and file, apply it now and schedule the next transition
         cog = bot.get_cog("DailyChannelAccess")
         if cog:
-            cog.channel_schedules[channel.id] = schedule_data
-            cog.schedules[str(channel.id)] = schedule_data
-            save_schedules(cog.schedules)
+            await cog.set_schedule(channel.id, schedule_data, interaction.guild.id)
 
         # Get current time in the specified timezone
         tz = pytz.timezone(timezone_name)
@@ -290,8 +282,6 @@ async def setup(bot):
         await interaction.response.defer(ephemeral=True)
 
         # SECURITY: Check authorization
-        from main import is_authorized_guild_or_owner
-
         if not is_authorized_guild_or_owner(interaction):
             return await interaction.followup.send(
                 "❌ You are not authorized to use this command.", ephemeral=True
@@ -319,9 +309,7 @@ async def setup(bot):
         role_name = role.name if role else "Unknown Role"
 
         # Remove from memory and file
-        del cog.channel_schedules[channel.id]
-        del cog.schedules[str(channel.id)]
-        save_schedules(cog.schedules)
+        await cog.remove_schedule(channel.id)
 
         # Create embed response
         embed = discord.Embed(
@@ -360,8 +348,6 @@ async def setup(bot):
         await interaction.response.defer(ephemeral=True)
 
         # SECURITY: Check authorization
-        from main import is_authorized_guild_or_owner
-
         if not is_authorized_guild_or_owner(interaction):
             return await interaction.followup.send(
                 "❌ You are not authorized to use this command.", ephemeral=True
@@ -376,7 +362,8 @@ async def setup(bot):
             return
 
         cog = bot.get_cog("DailyChannelAccess")
-        if not cog or not cog.channel_schedules:
+        schedules = cog.guild_schedules(interaction.guild.id) if cog else {}
+        if not schedules:
             await interaction.followup.send(
                 "📋 No daily channel schedules configured.", ephemeral=True
             )
@@ -388,7 +375,7 @@ async def setup(bot):
             color=discord.Color.blue(),
         )
 
-        for channel_id, schedule in cog.channel_schedules.items():
+        for channel_id, schedule in schedules.items():
             channel = interaction.guild.get_channel(channel_id)
             role = interaction.guild.get_role(schedule["role_id"])
 
@@ -425,7 +412,7 @@ async def setup(bot):
                 )
 
         embed.set_footer(
-            text=f"Total schedules: {len(cog.channel_schedules)} | Users can always see channels, but only chat during scheduled times"
+            text=f"Total schedules: {len(schedules)} | Users can always see channels, but only chat during scheduled times"
         )
 
         await interaction.followup.send(embed=embed, ephemeral=True)
@@ -444,8 +431,6 @@ async def setup(bot):
         await interaction.response.defer(ephemeral=True)
 
         # SECURITY: Check authorization
-        from main import is_authorized_guild_or_owner
-
         if not is_authorized_guild_or_owner(interaction):
             return await interaction.followup.send(
                 "❌ You are not authorized to use this command.", ephemeral=True
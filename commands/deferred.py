@@ -0,0 +1,207 @@
+import asyncio
+import functools
+import inspect
+import logging
+import os
+import time
+
+import discord
+
+from perf import track
+from utils import is_authorized_guild_or_owner
+
+log = logging.getLogger('gatekeeper.commands')
+
+PROGRESS_EDIT_INTERVAL = float(os.getenv('PROGRESS_EDIT_INTERVAL', 2.0))  # Minimum seconds between progress edits
+
+# Running jobs; exclusive commands refuse to start twice in one guild
+jobs = set()
+
+
+async def check_admin(interaction):
+    """Shared authorization gate for admin commands; answers the interaction and returns False on refusal"""
+    # SECURITY: Check authorization
+    if not is_authorized_guild_or_owner(interaction):
+        await _refuse(interaction, "❌ You are not authorized to use this command.")
+        return False
+
+    # SECURITY: Block DMs and check admin permissions
+    if not interaction.guild:
+        await _refuse(interaction, "❌ This command can only be used in a server!")
+        return False
+
+    if not isinstance(interaction.user, discord.Member) or not interaction.user.guild_permissions.administrator:
+        await _refuse(interaction, "❌ You need Administrator permissions!")
+        return False
+    return True
+
+
+async def _refuse(interaction, message):
+    if not interaction.response.is_done():
+        await interaction.response.send_message(message, ephemeral=True)
+
+
+class CommandJob:
+    """Handle a deferred command uses to report progress and its result.
+
+    The interaction is acknowledged before the job starts, so the original
+    "thinking" response is edited in place: progress() at most once every
+    PROGRESS_EDIT_INTERVAL seconds (the latest text always lands), finish()
+    with the result. Interaction tokens expire after 15 minutes; past that,
+    edits fail quietly and the command's own log embed is the record.
+    """
+
+    def __init__(self, interaction, name, edit_interval=PROGRESS_EDIT_INTERVAL):
+        self.interaction = interaction
+        self.name = name
+        self.edit_interval = edit_interval
+        self.started = time.monotonic()
+        self.task = None
+        self.finished = False
+        self._last_edit = 0.0
+        self._pending = None
+        self._flush_task = None
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    async def progress(self, content):
+        """Show content as the job's status; throttled, so call it as often as convenient"""
+        if self.finished:
+            return
+        self._pending = content
+        wait = self._last_edit + self.edit_interval - time.monotonic()
+        if wait <= 0:
+            await self._flush_progress()
+        elif self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later(wait))
+
+    async def _flush_later(self, wait):
+        await asyncio.sleep(wait)
+        self._flush_task = None
+        await self._flush_progress()
+
+    async def _flush_progress(self):
+        content, self._pending = self._pending, None
+        if content is None or self.finished:
+            return
+        self._last_edit = time.monotonic()
+        try:
+            await self.interaction.edit_original_response(content=content)
+        except discord.HTTPException as e:
+            log.debug("Could not update progress for /%s: %s", self.name, e)
+
+    async def finish(self, content=None, *, embed=None):
+        """Replace the status message with the final result"""
+        self._stop_progress()
+        try:
+            await self.interaction.edit_original_response(content=content, embed=embed)
+        except discord.HTTPException as e:
+            log.warning("Could not send /%s result to %s: %s", self.name, self.interaction.user, e)
+
+    async def followup(self, content=None, **fields):
+        """Send an extra ephemeral message, e.g. when one result does not fit"""
+        try:
+            return await self.interaction.followup.send(content, ephemeral=True, **fields)
+        except discord.HTTPException as e:
+            log.warning("Could not send /%s followup to %s: %s", self.name, self.interaction.user, e)
+
+    def cancel(self):
+        if self.task and not self.task.done():
+            self.task.cancel()
+            return True
+        return False
+
+    def _stop_progress(self):
+        self.finished = True
+        if self._flush_task:
+            self._flush_task.cancel()
+            self._flush_task = None
+
+
+def deferred_command(name, error_message="❌ An error occurred while processing the command.", exclusive=False):
+    """Wrap an admin command so it is authorized, deferred and run as a background job.
+
+    The wrapped coroutine receives (job, interaction, *args) and reports through
+    job.progress()/job.finish(). Errors are logged, reported to the owners and
+    shown to the invoker; /cancel stops the job with CancelledError.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(interaction: discord.Interaction, *args, **kwargs):
+            if not await check_admin(interaction):
+                return
+
+            running = running_jobs(interaction.guild.id, name)
+            if exclusive and running:
+                running = running[0]
+                await interaction.response.send_message(
+                    f"⏳ /{name} is already running (started {running.elapsed:.0f}s ago by {running.interaction.user.mention}).",
+                    ephemeral=True
+                )
+                return
+
+            # Registered before the first await, so a second quick invocation sees it running
+            job = CommandJob(interaction, name)
+            jobs.add(job)
+            try:
+                # Acknowledge within Discord's 3 second window before any I/O
+                await interaction.response.defer(ephemeral=True, thinking=True)
+            except BaseException:
+                jobs.discard(job)
+                raise
+            job.task = asyncio.create_task(_run(func, job, error_message, interaction, args, kwargs), name=f"command:/{name}")
+            job.task.add_done_callback(lambda task: jobs.discard(job))
+
+        # discord.py builds the slash command options from the signature; hide the job parameter
+        signature = inspect.signature(func)
+        wrapper.__signature__ = signature.replace(parameters=list(signature.parameters.values())[1:])
+        return wrapper
+    return decorator
+
+
+async def _run(func, job, error_message, interaction, args, kwargs):
+    try:
+        await track(f"job:/{job.name}")(func)(job, interaction, *args, **kwargs)
+    except asyncio.CancelledError:
+        await job.finish(f"⏹️ /{job.name} was cancelled after {job.elapsed:.0f}s.")
+        raise
+    except Exception as e:
+        log.error("Error in %s command: %s", job.name, e)
+
+        # Report critical error to owners
+        try:
+            from utils import report_critical_error
+            await report_critical_error(f"/{job.name} Error", f"Error in {job.name} command: {e}", interaction.client, interaction)
+        except Exception as report_error:
+            log.error("Failed to report critical error: %s", report_error)
+
+        await job.finish(error_message)
+    finally:
+        if not job.finished:
+            await job.finish("✅ Done.")
+
+
+def running_jobs(guild_id=None, name=None):
+    return [
+        job for job in jobs
+        if (guild_id is None or job.interaction.guild.id == guild_id) and (name is None or job.name == name)
+    ]
+
+
+async def cancel_all():
+    """Cancel every running job and wait for them to finish (bot shutdown)"""
+    tasks = [job.task for job in jobs if job.cancel()]
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def wait_all():
+    """Wait for every running job to finish"""
+    while jobs:
+        tasks = [job.task for job in jobs if job.task]
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        else:
+            # Jobs still deferring their interaction get their task in a moment
+            await asyncio.sleep(0)
@@ -1,5 +1,6 @@
 import discord
 from discord.ext import commands
+from utils import is_authorized_guild_or_owner
 
 async def setup(bot):
     @bot.tree.command(name="help_admin", description="List all admin commands and their descriptions")
@@ -7,7 +8,6 @@ async def setup(bot):
         """List all admin commands and their descriptions"""
         try:
             # SECURITY: Check authorization
-            from main import is_authorized_guild_or_owner
             if not is_authorized_guild_or_owner(interaction):
                 if not interaction.response.is_done():
                     await interaction.response.send_message(
@@ -44,6 +44,18 @@ async def setup(bot):
                 inline=False
             )
             
+            embed.add_field(
+                name="/reloadconfig",
+                value="Reload settings from .env without restarting the bot",
+                inline=False
+            )
+            
+            embed.add_field(
+                name="/perf",
+                value="Show event loop lag, the slowest handlers and recent loop stalls",
+                inline=False
+            )
+            
             embed.add_field(
                 name="/checkuser",
                 value="Check a user's status, roles, and data (includes cooldown info)",
@@ -52,7 +64,7 @@ async def setup(bot):
             
             embed.add_field(
                 name="/fixuser",
-                value="Fix user roles and status, automatically clears expired cooldowns",
+                value="Fix user roles and status, automatically clears any button cooldown",
                 inline=False
             )
             
@@ -74,6 +86,24 @@ async def setup(bot):
                 inline=False
             )
             
+            embed.add_field(
+                name="/export_onboarding",
+                value="Download onboarding data as CSV or NDJSON (optionally gzipped and filtered)",
+                inline=False
+            )
+
+            embed.add_field(
+                name="/import_onboarding",
+                value="Load onboarding data from a CSV or NDJSON file (roles are not changed)",
+                inline=False
+            )
+
+            embed.add_field(
+                name="/cancel",
+                value="Cancel a long-running admin command such as /cleanup_roles",
+                inline=False
+            )
+            
             embed.add_field(
                 name="/daily_access_channel",
                 value="Set up daily chat access for a channel (users can always see, chat on schedule)",
@@ -0,0 +1,163 @@
+import discord
+from discord import app_commands
+import logging
+import os
+import tempfile
+import time
+from datetime import datetime, timezone
+from storage import aget_user_store
+from log_sink import submit_log
+from commands.deferred import deferred_command
+from onboarding_io import (
+    FORMATS, IMPORT_MAX_BYTES, STATUS_FILTERS, detect_format, download, export_users, import_users
+)
+from utils import run_blocking_io
+
+STATUS_CHOICES = [
+    app_commands.Choice(name="Everyone", value="all"),
+    app_commands.Choice(name="Waiting for role (clicked, no access)", value="pending"),
+    app_commands.Choice(name="Verified (has access)", value="verified"),
+    app_commands.Choice(name="Never clicked the button", value="not_clicked"),
+    app_commands.Choice(name="Unverified role assigned", value="unverified"),
+]
+FORMAT_CHOICES = [app_commands.Choice(name=fmt.upper(), value=fmt) for fmt in FORMATS]
+
+
+def _filters(status, joined_within_days):
+    filters = dict(STATUS_FILTERS.get(status, {}))
+    if joined_within_days > 0:
+        filters['joined_since'] = time.time() - joined_within_days * 86400
+    return filters
+
+
+def _describe(status, joined_within_days):
+    parts = [status]
+    if joined_within_days > 0:
+        parts.append(f"joined within {joined_within_days}d")
+    return ", ".join(parts)
+
+
+async def _temp_path(suffix):
+    fd, path = await run_blocking_io(tempfile.mkstemp, suffix=suffix, prefix='onboarding-')
+    await run_blocking_io(os.close, fd)
+    return path
+
+
+async def _remove(path):
+    try:
+        await run_blocking_io(os.remove, path)
+    except OSError as e:
+        logging.warning(f"Could not remove temporary file {path}: {e}")
+
+
+async def setup(bot):
+    @bot.tree.command(name="export_onboarding", description="Export stored onboarding data as a CSV or NDJSON file")
+    @discord.app_commands.default_permissions(administrator=True)
+    @app_commands.describe(
+        file_format="File format (CSV by default)",
+        status="Only export users in this onboarding state",
+        joined_within_days="Only export users who joined in the last N days (0 = any time)",
+        compress="Gzip the file (on by default; large exports may not fit Discord's upload limit otherwise)"
+    )
+    @app_commands.choices(file_format=FORMAT_CHOICES, status=STATUS_CHOICES)
+    @deferred_command("export_onboarding", "❌ An error occurred while exporting onboarding data.", exclusive=True)
+    async def export_onboarding(job, interaction: discord.Interaction, file_format: str = "csv",
+                                status: str = "all", joined_within_days: int = 0, compress: bool = True):
+        """Stream the guild's onboarding records into a file attachment (admin only)"""
+        guild = interaction.guild
+        store = await aget_user_store(guild.id)
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S')
+        filename = f"onboarding-{guild.id}-{stamp}.{file_format}" + (".gz" if compress else "")
+        path = await _temp_path(f".{file_format}")
+        try:
+            async def report_progress(exported):
+                await job.progress(f"📤 Exporting onboarding data: {exported} users written...")
+
+            exported = await export_users(
+                store, path, file_format, compress, on_progress=report_progress,
+                **_filters(status, joined_within_days)
+            )
+            size = await run_blocking_io(os.path.getsize, path)
+            if size > guild.filesize_limit:
+                await job.finish(
+                    f"❌ The export is {size / 1024 / 1024:.1f} MB, over this server's "
+                    f"{guild.filesize_limit / 1024 / 1024:.0f} MB upload limit. Enable compression or narrow the filters."
+                )
+                return
+
+            await job.followup(file=discord.File(path, filename=filename))
+
+            embed = discord.Embed(
+                title="📤 Onboarding Data Exported",
+                description=f"Exported **{exported}** users as `{filename}`",
+                color=discord.Color.blue(),
+                timestamp=discord.utils.utcnow()
+            )
+            embed.add_field(name="Filter", value=_describe(status, joined_within_days), inline=True)
+            embed.add_field(name="Size", value=f"{size / 1024:.0f} KB", inline=True)
+            embed.set_footer(text=f"Exported by {interaction.user.name} in {job.elapsed:.1f}s")
+            await job.finish(embed=embed)
+            submit_log(interaction.client, embed, guild.id)
+        finally:
+            await _remove(path)
+
+    @bot.tree.command(name="import_onboarding", description="Import onboarding data from a CSV or NDJSON file")
+    @discord.app_commands.default_permissions(administrator=True)
+    @app_commands.describe(
+        file="CSV or NDJSON export, optionally gzipped; needs a user_id column",
+        status="Only import rows in this onboarding state",
+        joined_within_days="Only import users who joined in the last N days (0 = any time)"
+    )
+    @app_commands.choices(status=STATUS_CHOICES)
+    @deferred_command("import_onboarding", "❌ An error occurred while importing onboarding data.", exclusive=True)
+    async def import_onboarding(job, interaction: discord.Interaction, file: discord.Attachment,
+                                status: str = "all", joined_within_days: int = 0):
+        """Stream an attachment into the guild's onboarding records; Discord roles are not changed (admin only)"""
+        fmt = detect_format(file.filename)
+        if fmt is None:
+            await job.finish("❌ Unsupported file type. Upload a .csv or .ndjson/.jsonl file (optionally .gz).")
+            return
+        if file.size > IMPORT_MAX_BYTES:
+            await job.finish(f"❌ The file is larger than {IMPORT_MAX_BYTES // (1024 * 1024)} MB.")
+            return
+
+        guild = interaction.guild
+        store = await aget_user_store(guild.id)
+        path = await _temp_path(os.path.splitext(file.filename)[1])
+        try:
+            await job.progress(f"📥 Downloading `{file.filename}`...")
+            try:
+                await download(file.url, path)
+            except Exception as e:
+                await job.finish(f"❌ Could not download `{file.filename}`: {e}")
+                return
+
+            async def report_progress(result):
+                await job.progress(f"📥 Importing onboarding data: {result.summary()}...")
+
+            result = await import_users(
+                store, path, fmt, on_progress=report_progress,
+                **_filters(status, joined_within_days)
+            )
+        finally:
+            await _remove(path)
+
+        # Imported button clicks may be due a role grant
+        welcome_cog = interaction.client.get_cog('Welcome')
+        if welcome_cog and result.imported:
+            await welcome_cog.load_role_assignment_schedule(guild.id)
+
+        embed = discord.Embed(
+            title="📥 Onboarding Data Imported",
+            description=f"Imported **{result.imported}** users from `{file.filename}`",
+            color=discord.Color.orange() if result.invalid else discord.Color.green(),
+            timestamp=discord.utils.utcnow()
+        )
+        embed.add_field(name="Filter", value=_describe(status, joined_within_days), inline=True)
+        embed.add_field(name="Filtered Out", value=str(result.skipped), inline=True)
+        embed.add_field(name="Invalid Rows", value=str(result.invalid), inline=True)
+        if result.errors:
+            embed.add_field(name="⚠️ Problems", value="\n".join(result.errors)[:1024], inline=False)
+        embed.set_footer(text=f"Imported by {interaction.user.name} in {result.elapsed:.1f}s")
+        await job.finish(embed=embed)
+        submit_log(interaction.client, embed, guild.id)
@@ -0,0 +1,64 @@
+import discord
+from discord.ext import commands
+import logging
+from datetime import datetime, timezone
+from perf import monitor, startup
+from commands.deferred import check_admin
+
+async def setup(bot):
+    @bot.tree.command(name="perf", description="Show event loop lag and the slowest handlers")
+    @discord.app_commands.default_permissions(administrator=True)
+    async def perf(interaction: discord.Interaction):
+        """Show loop lag, slow handlers and recent loop stalls (admin only)"""
+        try:
+            if not await check_admin(interaction):
+                return
+
+            p50, p99, worst = monitor.lag_percentiles()
+            embed = discord.Embed(
+                title="⏱️ Performance",
+                description=(
+                    f"Loop lag (last {len(monitor.lag_samples)} samples): "
+                    f"p50 **{p50 * 1000:.1f}ms**, p99 **{p99 * 1000:.1f}ms**, max **{worst * 1000:.1f}ms**"
+                ),
+                color=discord.Color.red() if p99 > monitor.stall_threshold else discord.Color.green(),
+                timestamp=datetime.now(timezone.utc)
+            )
+
+            offenders = monitor.top_offenders(10)
+            if offenders:
+                lines = [
+                    f"`{stats.tag}` — {stats.slow}/{stats.calls} slow, max {stats.max * 1000:.0f}ms, avg {stats.mean * 1000:.0f}ms"
+                    for stats in offenders
+                ]
+                embed.add_field(name=f"Top Handlers (slow ≥ {monitor.slow_threshold * 1000:.0f}ms)", value="\n".join(lines)[:1024], inline=False)
+            else:
+                embed.add_field(name="Top Handlers", value="No tracked handlers have run yet", inline=False)
+
+            if monitor.stalls:
+                when, tag, blocked, stack = monitor.stalls[-1]
+                embed.add_field(
+                    name=f"Last Loop Stall ({len(monitor.stalls)} recorded)",
+                    value=f"<t:{int(when)}:R> blocked ≥ **{blocked * 1000:.0f}ms** in `{tag}`\n```{''.join(stack[-3:])[-900:]}```",
+                    inline=False
+                )
+                recent = {}
+                for _, stall_tag, _, _ in monitor.stalls:
+                    recent[stall_tag] = recent.get(stall_tag, 0) + 1
+                ranked = sorted(recent.items(), key=lambda item: item[1], reverse=True)[:5]
+                embed.add_field(name="Stalls by Handler", value="\n".join(f"`{tag}`: {count}" for tag, count in ranked), inline=False)
+            else:
+                embed.add_field(name="Loop Stalls", value=f"None over {monitor.stall_threshold * 1000:.0f}ms", inline=False)
+
+            if startup.phases:
+                embed.add_field(name=f"Startup ({startup.total:.2f}s)", value=startup.summary()[:1024], inline=False)
+
+            await interaction.response.send_message(embed=embed, ephemeral=True)
+
+        except Exception as e:
+            logging.error(f"Error in perf command: {e}")
+            try:
+                if not interaction.response.is_done():
+                    await interaction.response.send_message("❌ An error occurred while collecting performance data.", ephemeral=True)
+            except Exception as response_error:
+                logging.error(f"Error sending error response: {response_error}")
@@ -0,0 +1,74 @@
+import discord
+from discord.ext import commands
+import logging
+from config import apply_settings, get_settings, guild_ids, read_settings
+from workers import owned_guild_ids
+from commands.deferred import deferred_command
+from utils import run_blocking_io
+
+log = logging.getLogger('gatekeeper.commands')
+
+
+def _snapshot():
+    """Settings of every configured guild; None keys the primary settings from the environment"""
+    primary = get_settings()
+    snapshot = {None: primary}
+    snapshot.update((guild_id, get_settings(guild_id)) for guild_id in guild_ids() if guild_id != primary.guild_id)
+    return snapshot
+
+
+def _changed(old, new):
+    """Names of the settings that differ, with the guild id for GUILDS_FILE guilds"""
+    changed = []
+    for guild_id in sorted(old.keys() | new.keys(), key=lambda guild_id: guild_id or 0):
+        before, after = old.get(guild_id), new.get(guild_id)
+        if before is None or after is None:
+            changed.append(f"guild `{guild_id}` {'added' if before is None else 'removed'}")
+            continue
+        suffix = f" ({guild_id})" if guild_id is not None else ""
+        changed.extend(
+            f"`{name}`{suffix}" for name in after.__dataclass_fields__
+            if getattr(after, name) != getattr(before, name)
+        )
+    return changed
+
+
+async def setup(bot):
+    @bot.tree.command(name="reloadconfig", description="Reload settings from .env without restarting")
+    @discord.app_commands.default_permissions(administrator=True)
+    @deferred_command("reloadconfig", "❌ An error occurred while reloading the configuration.", exclusive=True)
+    async def reload_config(job, interaction: discord.Interaction):
+        """Re-read .env and apply the new settings (admin only)"""
+        old = _snapshot()
+        settings, problems = apply_settings(*await run_blocking_io(read_settings))
+        changed = _changed(old, _snapshot())
+
+        # Push the new values into the long-lived components that hold them
+        client = interaction.client
+        if getattr(client, 'log_sink', None):
+            client.log_sink.channel_id = settings.logs_channel_id
+        for guild_id, sink in getattr(client, 'guild_log_sinks', {}).items():
+            sink.channel_id = get_settings(guild_id).logs_channel_id
+        welcome_cog = client.get_cog('Welcome')
+        if welcome_cog:
+            await job.progress("🔄 Settings loaded, restarting onboarding...")
+            # Start (or stop) onboarding for guilds added to (or removed from) GUILDS_FILE
+            await welcome_cog.sync_guilds()
+            for guild_id in owned_guild_ids():
+                await welcome_cog.load_role_assignment_schedule(guild_id)
+        daily_cog = client.get_cog('DailyChannelAccess')
+        if daily_cog:
+            await job.progress("🔄 Settings loaded, rescheduling daily channels...")
+            for guild_id in owned_guild_ids():
+                await daily_cog.load_guild(guild_id)
+
+        embed = discord.Embed(
+            title="🔄 Configuration Reloaded",
+            color=discord.Color.orange() if problems else discord.Color.green()
+        )
+        embed.add_field(name="Changed", value=", ".join(changed)[:1024] or "Nothing", inline=False)
+        if problems:
+            embed.add_field(name="⚠️ Problems", value="\n".join(problems)[:1024], inline=False)
+
+        log.info("Configuration reloaded by %s (%s changed, %s problems)", interaction.user, len(changed), len(problems))
+        await job.finish(embed=embed)
@@ -2,227 +2,147 @@ import discord
 from discord.ext import commands
 import os
 import logging
-import json
+from storage import aget_user_store
+from reconcile import RoleReconciler, plan_role_changes
+from config import get_settings
+from log_sink import submit_log
+from role_index import role_index
+from member_cache import member_cache, lazy_members
+from commands.deferred import deferred_command
 
 async def setup(bot):
     @bot.tree.command(name="removemember", description="Remove member role from a user")
     @discord.app_commands.default_permissions(administrator=True)
-    async def remove_member_role(interaction: discord.Interaction, user: discord.Member):
+    @deferred_command("removemember", "❌ An error occurred while removing the role.")
+    async def remove_member_role(job, interaction: discord.Interaction, user: discord.Member):
         """Remove member role from a user (admin only)"""
-        try:
-            # SECURITY: Check authorization
-            from main import is_authorized_guild_or_owner
-            if not is_authorized_guild_or_owner(interaction):
-                if not interaction.response.is_done():
-                    await interaction.response.send_message(
-                        "❌ You are not authorized to use this command.", ephemeral=True
-                    )
-                return
-            
-            # SECURITY: Block DMs and check admin permissions
-            if not interaction.guild:
-                if not interaction.response.is_done():
-                    await interaction.response.send_message("❌ This command can only be used in a server!", ephemeral=True)
-                return
-            
-            if not isinstance(interaction.user, discord.Member) or not interaction.user.guild_permissions.administrator:
-                if not interaction.response.is_done():
-                    await interaction.response.send_message("❌ You need Administrator permissions!", ephemeral=True)
-                return
-            
-            member_role_id = int(os.getenv('MEMBER_ROLE_ID', 0))
-            if not member_role_id:
-                if not interaction.response.is_done():
-                    await interaction.response.send_message("❌ MEMBER_ROLE_ID not configured!", ephemeral=True)
-                return
-            
-            member_role = interaction.guild.get_role(member_role_id)
-            if not member_role:
-                if not interaction.response.is_done():
-                    await interaction.response.send_message("❌ Member role not found!", ephemeral=True)
-                return
-            
-            if member_role not in user.roles:
-                if not interaction.response.is_done():
-                    await interaction.response.send_message(f"❌ {user.mention} doesn't have the member role!", ephemeral=True)
-                return
-            
-            await user.remove_roles(member_role)
-            
-            # Update user data
-            try:
-                with open('user_data.json', 'r') as f:
-                    user_data = json.load(f)
-            except FileNotFoundError:
-                user_data = {}
-            
-            user_id_str = str(user.id)
-            if user_id_str in user_data:
-                user_data[user_id_str]['has_access'] = False
-                user_data[user_id_str]['role_assigned'] = False
-                
-                with open('user_data.json', 'w') as f:
-                    json.dump(user_data, f, indent=2)
-            
-            embed = discord.Embed(
-                title="🔓 Member Role Removed",
-                description=f"**{user.mention}** has had their Member role removed",
-                color=discord.Color.orange(),
-                timestamp=discord.utils.utcnow()
-            )
-            embed.add_field(name="User ID", value=f"`{user.id}`", inline=True)
-            embed.add_field(name="Role Removed", value=f"🔓 Member", inline=True)
-            embed.set_thumbnail(url=user.display_avatar.url)
-            embed.set_footer(text=f"Removed by {interaction.user.name}")
-            
-            if not interaction.response.is_done():
-                await interaction.response.send_message(embed=embed, ephemeral=True)
-            
-            # Log to logs channel
-            logs_channel_id = int(os.getenv('LOGS_CHANNEL_ID', 0))
-            if logs_channel_id:
-                logs_channel = interaction.guild.get_channel(logs_channel_id)
-                if logs_channel:
-                    try:
-                        await logs_channel.send(embed=embed)
-                    except discord.Forbidden:
-                        logging.warning(f"Bot doesn't have permission to send messages to logs channel {logs_channel_id}")
-                    except Exception as e:
-                        logging.error(f"Error sending log message: {e}")
-                    
-        except Exception as e:
-            logging.error(f"Error removing member role: {e}")
-            try:
-                if not interaction.response.is_done():
-                    await interaction.response.send_message("❌ An error occurred while removing the role.", ephemeral=True)
-            except Exception as response_error:
-                logging.error(f"Error sending error response: {response_error}")
+        member_role_id = get_settings(interaction.guild.id).member_role_id
+        if not member_role_id:
+            await job.finish("❌ MEMBER_ROLE_ID not configured!")
+            return
+        
+        member_role = interaction.guild.get_role(member_role_id)
+        if not member_role:
+            await job.finish("❌ Member role not found!")
+            return
+        
+        if not user.get_role(member_role.id):
+            await job.finish(f"❌ {user.mention} doesn't have the member role!")
+            return
+        
+        await user.remove_roles(member_role)
+        
+        # Update user data
+        (await aget_user_store(interaction.guild.id)).update(user.id, has_access=False, role_assigned=False)
+        
+        embed = discord.Embed(
+            title="🔓 Member Role Removed",
+            description=f"**{user.mention}** has had their Member role removed",
+            color=discord.Color.orange(),
+            timestamp=discord.utils.utcnow()
+        )
+        embed.add_field(name="User ID", value=f"`{user.id}`", inline=True)
+        embed.add_field(name="Role Removed", value=f"🔓 Member", inline=True)
+        embed.set_thumbnail(url=user.display_avatar.url)
+        embed.set_footer(text=f"Removed by {interaction.user.name}")
+        
+        await job.finish(embed=embed)
+        
+        # Log to logs channel (batched through the log sink)
+        submit_log(interaction.client, embed, interaction.guild.id)
 
     @bot.tree.command(name="cleanup_roles", description="Remove unverified role from users who have member role")
     @discord.app_commands.default_permissions(administrator=True)
-    async def cleanup_roles(interaction: discord.Interaction):
+    @deferred_command("cleanup_roles", "❌ An error occurred during role cleanup.", exclusive=True)
+    async def cleanup_roles(job, interaction: discord.Interaction):
         """Remove unverified role from users who already have member role (admin only)"""
-        try:
-            # SECURITY: Check authorization
-            from main import is_authorized_guild_or_owner
-            if not is_authorized_guild_or_owner(interaction):
-                if not interaction.response.is_done():
-                    await interaction.response.send_message(
-                        "❌ You are not authorized to use this command.", ephemeral=True
-                    )
-                return
-            
-            # SECURITY: Block DMs and check admin permissions
-            if not interaction.guild:
-                if not interaction.response.is_done():
-                    await interaction.response.send_message("❌ This command can only be used in a server!", ephemeral=True)
-                return
-            
-            if not isinstance(interaction.user, discord.Member) or not interaction.user.guild_permissions.administrator:
-                if not interaction.response.is_done():
-                    await interaction.response.send_message("❌ You need Administrator permissions!", ephemeral=True)
-                return
-            
-            member_role_id = int(os.getenv('MEMBER_ROLE_ID', 0))
-            unverified_role_id = int(os.getenv('UNVERIFIED_ROLE_ID', 0))
-            
-            if not member_role_id or not unverified_role_id:
-                if not interaction.response.is_done():
-                    await interaction.response.send_message("❌ MEMBER_ROLE_ID or UNVERIFIED_ROLE_ID not configured!", ephemeral=True)
-                return
-            
-            member_role = interaction.guild.get_role(member_role_id)
-            unverified_role = interaction.guild.get_role(unverified_role_id)
-            
-            if not member_role or not unverified_role:
-                if not interaction.response.is_done():
-                    await interaction.response.send_message("❌ Member or Unverified role not found!", ephemeral=True)
-                return
-            
-            # Find users with both roles
-            users_to_cleanup = []
-            for member in interaction.guild.members:
-                if member_role in member.roles and unverified_role in member.roles:
-                    users_to_cleanup.append(member)
-            
-            if not users_to_cleanup:
-                if not interaction.response.is_done():
-                    await interaction.response.send_message("✅ No users found with both member and unverified roles!", ephemeral=True)
-                return
-            
-            # Remove unverified role from these users
-            cleaned_users = []
-            for member in users_to_cleanup:
-                try:
-                    await member.remove_roles(unverified_role)
-                    cleaned_users.append(member)
-                    logging.info(f"Removed unverified role from {member.display_name} ({member.id}) - they have member role")
-                except Exception as e:
-                    logging.error(f"Error removing unverified role from {member.id}: {e}")
-            
-            # Update user data
-            try:
-                with open('user_data.json', 'r') as f:
-                    user_data = json.load(f)
-            except FileNotFoundError:
-                user_data = {}
-            
-            for member in cleaned_users:
-                user_id_str = str(member.id)
-                if user_id_str in user_data:
-                    user_data[user_id_str]['unverified_role_assigned'] = False
-                    user_data[user_id_str]['has_access'] = True
-                    user_data[user_id_str]['role_assigned'] = True
-            
-            if cleaned_users:
-                with open('user_data.json', 'w') as f:
-                    json.dump(user_data, f, indent=2)
-            
-            # Create response embed
-            embed = discord.Embed(
-                title="🧹 Role Cleanup Complete",
-                description=f"Removed unverified role from **{len(cleaned_users)}** users who already have member role",
-                color=discord.Color.green(),
-                timestamp=discord.utils.utcnow()
+        settings = get_settings(interaction.guild.id)
+        member_role_id = settings.member_role_id
+        unverified_role_id = settings.unverified_role_id
+        
+        if not member_role_id or not unverified_role_id:
+            await job.finish("❌ MEMBER_ROLE_ID or UNVERIFIED_ROLE_ID not configured!")
+            return
+        
+        member_role = interaction.guild.get_role(member_role_id)
+        unverified_role = interaction.guild.get_role(unverified_role_id)
+        
+        if not member_role or not unverified_role:
+            await job.finish("❌ Member or Unverified role not found!")
+            return
+        
+        # Find users with both roles: the only change needed is dropping Unverified
+        guild = interaction.guild
+        if lazy_members():
+            # The index lags behind members outside the gateway cache, so sweep everyone's live roles
+            await job.progress("🔎 Scanning members for the unverified role...")
+            changes = []
+            async for member in member_cache.iter_members(guild):
+                if member.get_role(member_role.id) is not None:
+                    changes.extend(plan_role_changes([member], remove=[unverified_role]))
+        else:
+            if not role_index.ready(guild.id):
+                await role_index.build(guild)
+            both = role_index.members_with_all(guild.id, member_role.id, unverified_role.id)
+            changes = plan_role_changes(
+                await member_cache.resolve(guild, both),
+                remove=[unverified_role]
             )
-            
-            if cleaned_users:
-                user_list = "\n".join([f"• {user.mention} (`{user.id}`)" for user in cleaned_users[:10]])  # Show first 10
-                if len(cleaned_users) > 10:
-                    user_list += f"\n... and {len(cleaned_users) - 10} more"
-                
-                embed.add_field(name="Users Cleaned", value=user_list, inline=False)
-            
-            embed.set_footer(text=f"Cleaned by {interaction.user.name}")
-            
-            if not interaction.response.is_done():
-                await interaction.response.send_message(embed=embed, ephemeral=True)
-            
-            # Log to logs channel
-            logs_channel_id = int(os.getenv('LOGS_CHANNEL_ID', 0))
-            if logs_channel_id:
-                logs_channel = interaction.guild.get_channel(logs_channel_id)
-                if logs_channel:
-                    try:
-                        await logs_channel.send(embed=embed)
-                    except discord.Forbidden:
-                        logging.warning(f"Bot doesn't have permission to send messages to logs channel {logs_channel_id}")
-                    except Exception as e:
-                        logging.error(f"Error sending log message: {e}")
-                    
-        except Exception as e:
-            logging.error(f"Error in cleanup_roles: {e}")
-            
-            # Report critical error to owners
-            try:
-                from cogs.verification import report_critical_error
-                bot = interaction.client if hasattr(interaction, 'client') else None
-                await report_critical_error("Role Cleanup Error", f"Error in cleanup_roles command: {e}", bot, interaction)
-            except Exception as report_error:
-                logging.error(f"Failed to report critical error: {report_error}")
-            
-            try:
-                if not interaction.response.is_done():
-                    await interaction.response.send_message("❌ An error occurred during role cleanup.", ephemeral=True)
-            except Exception as response_error:
-                logging.error(f"Error sending error response: {response_error}") 
\ No newline at end of file
+        
+        if not changes:
+            await job.finish("✅ No users found with both member and unverified roles!")
+            return
+        
+        await job.progress(f"🧹 Removing unverified role from **{len(changes)}** users...")
+        
+        async def report_progress(progress):
+            await job.progress(f"🧹 Role cleanup: {progress.summary()}")
+        
+        reconciler = RoleReconciler(
+            f"cleanup_roles:{interaction.guild.id}",
+            changes,
+            reason=f"Role cleanup by {interaction.user}",
+            on_progress=report_progress
+        )
+        progress = await reconciler.run()
+        cleaned_users = progress.applied
+        logging.info(f"Role cleanup finished: {progress.summary()}")
+        
+        # Update user data
+        if cleaned_users:
+            (await aget_user_store(interaction.guild.id)).update_many(
+                [member.id for member in cleaned_users],
+                unverified_role_assigned=False,
+                has_access=True,
+                role_assigned=True
+            )
+        
+        # Create response embed
+        embed = discord.Embed(
+            title="🧹 Role Cleanup Complete",
+            description=f"Removed unverified role from **{len(cleaned_users)}** users who already have member role",
+            color=discord.Color.green(),
+            timestamp=discord.utils.utcnow()
+        )
+        
+        if cleaned_users:
+            user_list = "\n".join([f"• {user.mention} (`{user.id}`)" for user in cleaned_users[:10]])  # Show first 10
+            if len(cleaned_users) > 10:
+                user_list += f"\n... and {len(cleaned_users) - 10} more"
+            
+            embed.add_field(name="Users Cleaned", value=user_list, inline=False)
+        
+        if progress.failed or progress.gone or progress.retried:
+            embed.add_field(
+                name="Details",
+                value=f"Failed: {progress.failed}\nLeft server: {progress.gone}\nRetried from an earlier run: {progress.retried}",
+                inline=False
+            )
+        
+        embed.set_footer(text=f"Cleaned by {interaction.user.name} in {progress.elapsed:.0f}s")
+        
+        # The interaction token expires after 15 minutes; the logs channel still gets the result
+        await job.finish(embed=embed)
+        
+        # Log to logs channel (batched through the log sink)
+        submit_log(interaction.client, embed, interaction.guild.id)
@@ -0,0 +1,284 @@
+import json
+import logging
+import os
+from dataclasses import dataclass, fields, replace
+
+from dotenv import load_dotenv
+
+DEFAULT_OWNER_USER_IDS = frozenset({890323443252351046, 879714530769391686})
+DEFAULT_CALENDLY_LINK = 'https://ajtradingprofits.com/book-your-onboarding-call-today'
+
+# Environment variable for each Settings field
+ENV_NAMES = {
+    'guild_id': 'GUILD_ID',
+    'member_role_id': 'MEMBER_ROLE_ID',
+    'unverified_role_id': 'UNVERIFIED_ROLE_ID',
+    'welcome_channel_id': 'WELCOME_CHANNEL_ID',
+    'logs_channel_id': 'LOGS_CHANNEL_ID',
+    'role_assignment_delay': 'ROLE_ASSIGNMENT_DELAY',
+    'calendly_link': 'CALENDLY_LINK',
+    'owner_user_ids': 'OWNER_USER_IDS',
+}
+REQUIRED = ('guild_id', 'member_role_id', 'unverified_role_id', 'welcome_channel_id')
+
+# Extra guilds: {"<guild id>": {"member_role_id": ..., ...}} using the Settings field names
+GUILDS_FILE = os.getenv('GUILDS_FILE', 'guilds.json')
+# Per-guild fields; the rest (owners) are shared, and these are never inherited across guilds
+GUILD_ID_FIELDS = ('member_role_id', 'unverified_role_id', 'welcome_channel_id', 'logs_channel_id')
+GUILD_FIELDS = GUILD_ID_FIELDS + ('role_assignment_delay', 'calendly_link')
+
+
+@dataclass(frozen=True)
+class Settings:
+    """Bot configuration parsed once from the environment"""
+
+    guild_id: int = 0
+    member_role_id: int = 0
+    unverified_role_id: int = 0
+    welcome_channel_id: int = 0
+    logs_channel_id: int = 0
+    role_assignment_delay: int = 300  # Seconds between the button click and the member role
+    calendly_link: str = DEFAULT_CALENDLY_LINK
+    owner_user_ids: frozenset = DEFAULT_OWNER_USER_IDS
+
+    @classmethod
+    def from_env(cls, env=None):
+        """Build settings from env, returning (settings, problems); bad values keep their defaults"""
+        env = os.environ if env is None else env
+        values = {}
+        problems = []
+        for field in fields(cls):
+            raw = env.get(ENV_NAMES[field.name], '').strip()
+            if not raw:
+                if field.name in REQUIRED:
+                    problems.append(f"{ENV_NAMES[field.name]} is not set")
+                continue
+            try:
+                values[field.name] = _parse(field, raw)
+            except ValueError as e:
+                problems.append(f"{ENV_NAMES[field.name]}={raw!r} is invalid ({e})")
+        return cls(**values), problems
+
+    def for_guild(self, guild_id, overrides):
+        """Settings for another guild: its own role and channel IDs, shared owners and defaults"""
+        values = {'guild_id': guild_id, **{name: 0 for name in GUILD_ID_FIELDS}}
+        problems = []
+        by_name = {field.name: field for field in fields(self)}
+        for name, raw in overrides.items():
+            if name not in GUILD_FIELDS:
+                problems.append(f"{GUILDS_FILE}: guild {guild_id} has unknown setting {name!r}")
+                continue
+            try:
+                values[name] = _parse(by_name[name], str(raw).strip())
+            except ValueError as e:
+                problems.append(f"{GUILDS_FILE}: guild {guild_id} {name}={raw!r} is invalid ({e})")
+        for name in REQUIRED:
+            if name != 'guild_id' and not values.get(name):
+                problems.append(f"{GUILDS_FILE}: guild {guild_id} has no {name}")
+        return replace(self, **values), problems
+
+
+def _parse(field, raw):
+    if field.name == 'owner_user_ids':
+        return frozenset(int(part) for part in raw.split(',') if part.strip())
+    if field.type in (int, 'int'):
+        value = int(raw)
+        if value < 0:
+            raise ValueError("must not be negative")
+        return value
+    return raw
+
+
+def _load_guilds(settings, filename=GUILDS_FILE):
+    """Read the extra guilds file into {guild id: Settings}, returning (guilds, problems)"""
+    if not os.path.exists(filename):
+        return {}, []
+    try:
+        with open(filename, 'r') as f:
+            data = json.load(f)
+        if not isinstance(data, dict):
+            raise ValueError("expected an object keyed by guild id")
+    except (OSError, ValueError) as e:
+        return {}, [f"{filename} could not be read ({e})"]
+
+    guilds = {}
+    problems = []
+    for key, overrides in data.items():
+        if not str(key).isdigit() or not isinstance(overrides, dict):
+            problems.append(f"{filename}: {key!r} is not a guild id with a settings object")
+            continue
+        guild_id = int(key)
+        if guild_id == settings.guild_id:
+            problems.append(f"{filename}: guild {guild_id} is GUILD_ID, configure it in .env instead")
+            continue
+        guilds[guild_id], guild_problems = settings.for_guild(guild_id, overrides)
+        problems.extend(guild_problems)
+    return guilds, problems
+
+
+_settings = None
+_guild_settings = {}  # guild id -> Settings for the guilds in GUILDS_FILE
+
+
+def get_settings(guild_id=None):
+    """Current settings, loaded from the environment on first use.
+
+    With a guild_id, the settings for that guild: GUILD_ID's come from the
+    environment, extra guilds from GUILDS_FILE, and any other guild gets the
+    shared values with every role and channel ID unset.
+    """
+    if _settings is None:
+        reload_settings(read_dotenv=False)
+    if guild_id is None or guild_id == _settings.guild_id:
+        return _settings
+    settings = _guild_settings.get(guild_id)
+    if settings is None:
+        settings = replace(_settings, guild_id=guild_id, **{name: 0 for name in GUILD_ID_FIELDS})
+    return settings
+
+
+def guild_ids():
+    """Every configured guild id, GUILD_ID first"""
+    get_settings()
+    primary = (_settings.guild_id,) if _settings.guild_id else ()
+    return primary + tuple(_guild_settings)
+
+
+def is_configured_guild(guild_id):
+    return guild_id in guild_ids()
+
+
+def guild_state_path(filename, guild_id=None):
+    """The file holding guild_id's share of some state.
+
+    GUILD_ID keeps the plain name, so single-guild deployments find their
+    existing files; every other guild gets "<name>.<guild id><ext>".
+    """
+    if guild_id is None or guild_id == get_settings().guild_id:
+        return filename
+    root, ext = os.path.splitext(filename)
+    return f"{root}.{guild_id}{ext}"
+
+
+def reload_settings(read_dotenv=True):
+    """Re-read .env, the environment and GUILDS_FILE and swap in new settings; returns (settings, problems)"""
+    return apply_settings(*read_settings(read_dotenv))
+
+
+def read_settings(read_dotenv=True):
+    """Read .env, the environment and GUILDS_FILE into (settings, guilds, problems) without applying them.
+
+    This is the part of a reload that touches the disk, so the event loop runs
+    it on the storage executor and hands the result to apply_settings().
+    """
+    if read_dotenv:
+        load_dotenv(override=True)
+    settings, problems = Settings.from_env()
+    guilds, guild_problems = _load_guilds(settings)
+    problems += guild_problems
+    if not settings.guild_id and guilds:
+        # GUILD_ID is optional when every guild is listed in GUILDS_FILE
+        problems = [problem for problem in problems if problem != f"{ENV_NAMES['guild_id']} is not set"]
+    return settings, guilds, problems
+
+
+def apply_settings(settings, guilds, problems):
+    """Swap in settings from read_settings(); returns (settings, problems)"""
+    global _settings, _guild_settings
+    for problem in problems:
+        logging.warning(f"Config: {problem}")
+    _settings = settings
+    _guild_settings = guilds
+    handles.invalidate()
+    return settings, problems
+
+
+class GuildHandles:
+    """Resolved Guild/Role/Channel objects for the configured IDs.
+
+    Lookups are cached until a guild, role or channel event (or a settings
+    reload) invalidates them. Missing objects are not cached, so a handle that
+    could not be resolved before the guild was available is retried. The
+    shared `handles` resolves GUILD_ID; for_guild() returns the handles of
+    any other guild.
+    """
+
+    INVALIDATING_EVENTS = (
+        'on_guild_available', 'on_guild_unavailable', 'on_guild_update', 'on_guild_remove',
+        'on_guild_role_create', 'on_guild_role_update', 'on_guild_role_delete',
+        'on_guild_channel_create', 'on_guild_channel_update', 'on_guild_channel_delete',
+    )
+
+    def __init__(self, guild_id=None, parent=None):
+        self.guild_id = guild_id  # None follows GUILD_ID
+        self._parent = parent
+        self._bot = None
+        self._cache = {}
+        self._guilds = {}  # guild id -> GuildHandles
+
+    def bind(self, bot):
+        """Attach to the bot and invalidate on guild, role and channel events"""
+        self._bot = bot
+        for event in self.INVALIDATING_EVENTS:
+            bot.add_listener(self._on_change, event)
+        self.invalidate()
+
+    def for_guild(self, guild_id):
+        """Handles for guild_id (these same handles for GUILD_ID or None)"""
+        if self._parent is not None:
+            return self._parent.for_guild(guild_id)
+        if guild_id is None or guild_id == get_settings().guild_id:
+            return self
+        guild_handles = self._guilds.get(guild_id)
+        if guild_handles is None:
+            guild_handles = self._guilds[guild_id] = GuildHandles(guild_id, parent=self)
+        return guild_handles
+
+    @property
+    def settings(self):
+        return get_settings(self.guild_id)
+
+    def invalidate(self):
+        self._cache.clear()
+        for guild_handles in self._guilds.values():
+            guild_handles.invalidate()
+
+    async def _on_change(self, *args):
+        self.invalidate()
+
+    def _resolve(self, name, lookup):
+        if self._parent is not None and self._bot is None:
+            self._bot = self._parent._bot
+        value = self._cache.get(name)
+        if value is None and self._bot is not None:
+            value = lookup()
+            if value is not None:
+                self._cache[name] = value
+        return value
+
+    @property
+    def guild(self):
+        return self._resolve('guild', lambda: self._bot.get_guild(self.settings.guild_id))
+
+    @property
+    def member_role(self):
+        return self._resolve('member_role', lambda: self._role(self.settings.member_role_id))
+
+    @property
+    def unverified_role(self):
+        return self._resolve('unverified_role', lambda: self._role(self.settings.unverified_role_id))
+
+    @property
+    def welcome_channel(self):
+        return self._resolve('welcome_channel', lambda: self._bot.get_channel(self.settings.welcome_channel_id))
+
+    @property
+    def logs_channel(self):
+        return self._resolve('logs_channel', lambda: self._bot.get_channel(self.settings.logs_channel_id))
+
+    def _role(self, role_id):
+        guild = self.guild
+        return guild.get_role(role_id) if guild and role_id else None
+
+
+handles = GuildHandles()
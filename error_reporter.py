@@ -0,0 +1,236 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import sys
+import time
+import traceback
+from collections import deque
+from datetime import datetime, timezone
+
+import discord
+
+from config import get_settings
+from metrics import ERRORS_REPORTED
+
+log = logging.getLogger('gatekeeper.errors')
+
+ERROR_REPORT_WINDOW = float(os.getenv('ERROR_REPORT_WINDOW', 300))  # Repeats of an error within this many seconds are batched into one digest
+ERROR_REPORT_BURST = int(os.getenv('ERROR_REPORT_BURST', 5))  # Distinct new errors sent right away per window; the rest wait for the digest
+ERROR_REPORT_MAX_TRACKED = 500  # Distinct errors remembered per window before new ones are only counted
+
+_NUMBERS = re.compile(r'\d+')
+_FRAME = re.compile(r'File "([^"]+)", line (\d+), in (\S+)')
+
+
+def fingerprint(error_type, error_message, stack=None):
+    """Stable key for "the same error": type, message with ids and counts masked, and the failing line"""
+    frames = _FRAME.findall(stack or '')
+    where = ''
+    if frames:
+        path, line, function = frames[-1]
+        where = f"{os.path.basename(path)}:{line}:{function}"
+    text = f"{error_type}|{_NUMBERS.sub('#', error_message)}|{where}"
+    return hashlib.sha1(text.encode()).hexdigest()[:12]
+
+
+class _Incident:
+    __slots__ = ('key', 'error_type', 'message', 'first_seen', 'last_seen', 'unreported')
+
+    def __init__(self, key, error_type, message):
+        self.key = key
+        self.error_type = error_type
+        self.message = message
+        self.first_seen = self.last_seen = time.time()
+        self.unreported = 0
+
+
+class ErrorReporter:
+    """Sends critical errors to the owners without flooding them or the API.
+
+    report() never awaits: it fingerprints the error and hands it to a
+    background task. The first occurrence of an error is sent straight away
+    (up to `burst` distinct errors per window); repeats within the window are
+    only counted, and when the window closes everything counted is sent as
+    one digest. An error that stays quiet for a whole window is forgotten, so
+    its next occurrence is reported immediately again. Owner DM channels are
+    opened once and reused instead of fetching each owner on every report.
+    """
+
+    def __init__(self, window=ERROR_REPORT_WINDOW, burst=ERROR_REPORT_BURST, clock=time.monotonic):
+        self.window = window
+        self.burst = burst
+        self.bot = None
+        self._clock = clock
+        self._incidents = {}  # fingerprint -> _Incident seen in the current or previous window
+        self._outbox = deque()  # embeds waiting to be delivered
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._window_started = clock()
+        self._sent_in_window = 0
+        self._untracked = 0
+        self._dm_channels = {}  # owner id -> DMChannel
+
+    def report(self, error_type, error_message, bot=None, interaction=None):
+        """Record a critical error; call from inside the except block to capture its traceback"""
+        if bot is not None:
+            self.bot = bot
+        stack = traceback.format_exc() if sys.exc_info()[0] is not None else None
+        log.critical("CRITICAL ERROR: %s - %s", error_type, error_message)
+
+        key = fingerprint(error_type, error_message, stack)
+        incident = self._incidents.get(key)
+        if incident is None:
+            if len(self._incidents) >= ERROR_REPORT_MAX_TRACKED:
+                self._untracked += 1
+                ERRORS_REPORTED.inc(result='dropped')
+                self._ensure_running()
+                return
+            incident = self._incidents[key] = _Incident(key, error_type, error_message)
+            if self._sent_in_window < self.burst:
+                self._sent_in_window += 1
+                self._outbox.append(_error_embed(incident, stack, interaction))
+                ERRORS_REPORTED.inc(result='sent')
+                self._ensure_running()
+                self._wakeup.set()
+                return
+
+        incident.message = error_message
+        incident.last_seen = time.time()
+        incident.unreported += 1
+        ERRORS_REPORTED.inc(result='aggregated')
+        self._ensure_running()
+
+    def _ensure_running(self):
+        if self._task is not None and not self._task.done():
+            return
+        try:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        except RuntimeError:
+            pass  # No loop yet; the next report starts the task
+
+    async def _run(self):
+        while True:
+            remaining = self._window_started + self.window - self._clock()
+            if remaining > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    pass
+            self._wakeup.clear()
+            if self._clock() - self._window_started >= self.window:
+                self._close_window()
+            await self._deliver_all()
+
+    def _close_window(self):
+        """Queue a digest of the repeats counted this window and start a new one"""
+        repeated = [incident for incident in self._incidents.values() if incident.unreported]
+        if repeated or self._untracked:
+            self._outbox.append(_digest_embed(repeated, self._untracked, self.window))
+        cutoff = time.time() - self.window
+        self._incidents = {
+            key: incident for key, incident in self._incidents.items()
+            if incident.last_seen > cutoff
+        }
+        for incident in self._incidents.values():
+            incident.unreported = 0
+        self._untracked = 0
+        self._sent_in_window = 0
+        self._window_started = self._clock()
+
+    async def _deliver_all(self):
+        while self._outbox:
+            embed = self._outbox.popleft()
+            try:
+                await self._deliver(embed)
+            except Exception as e:
+                log.error("Error in error reporting system: %s", e)
+
+    async def _deliver(self, embed):
+        settings = get_settings()
+        owner_ids = sorted(settings.owner_user_ids)
+        if not owner_ids:
+            log.error("No owner IDs configured for error reporting")
+            return
+        bot = self.bot
+        if bot is None or bot.is_closed():
+            log.warning("Bot not available, dropping error report %r", embed.title)
+            return
+
+        # Send to logs channel, pinging the owners
+        if settings.logs_channel_id:
+            logs_channel = bot.get_channel(settings.logs_channel_id)
+            if logs_channel:
+                owner_mentions = " ".join(f"<@{owner_id}>" for owner_id in owner_ids)
+                try:
+                    await logs_channel.send(f"🚨 **CRITICAL ERROR DETECTED** {owner_mentions}", embed=embed)
+                except discord.HTTPException as e:
+                    log.error("Failed to send error to logs channel: %s", e)
+
+        # DM owners over channels opened once
+        for owner_id in owner_ids:
+            try:
+                channel = self._dm_channels.get(owner_id)
+                if channel is None:
+                    channel = self._dm_channels[owner_id] = await bot.create_dm(discord.Object(id=owner_id))
+                await channel.send(embed=embed)
+            except discord.HTTPException as e:
+                self._dm_channels.pop(owner_id, None)
+                log.error("Failed to DM owner %s: %s", owner_id, e)
+
+    async def aclose(self):
+        """Send the pending digest and anything queued (bot shutdown)"""
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        self._close_window()
+        await self._deliver_all()
+
+
+def _error_embed(incident, stack, interaction):
+    embed = discord.Embed(
+        title=f"🚨 CRITICAL ERROR: {incident.error_type}",
+        description=f"**Error:** {incident.message}"[:4096],
+        color=0xff0000,
+        timestamp=datetime.now(timezone.utc)
+    )
+
+    # Add context information
+    if interaction:
+        embed.add_field(name="User", value=f"{interaction.user.mention} (`{interaction.user.id}`)", inline=True)
+        embed.add_field(name="Guild", value=f"{interaction.guild.name if interaction.guild else 'DM'} (`{interaction.guild.id if interaction.guild else 'N/A'}`)", inline=True)
+        embed.add_field(name="Channel", value=f"{interaction.channel.mention if interaction.channel else 'N/A'}", inline=True)
+
+    # Add stack trace for debugging
+    if stack:
+        if len(stack) > 1000:
+            stack = stack[:1000] + "..."
+        embed.add_field(name="Stack Trace", value=f"```{stack}```", inline=False)
+
+    embed.set_footer(text=f"AJ Trading Academy Bot - Critical Error Report · {incident.key}")
+    return embed
+
+
+def _digest_embed(incidents, untracked, window):
+    embed = discord.Embed(
+        title="🚨 Repeated Critical Errors",
+        description=f"Errors that kept happening during the last {window / 60:.0f} minutes",
+        color=0xff0000,
+        timestamp=datetime.now(timezone.utc)
+    )
+    incidents = sorted(incidents, key=lambda incident: incident.unreported, reverse=True)
+    for incident in incidents[:24]:
+        embed.add_field(
+            name=f"{incident.error_type} ×{incident.unreported}"[:256],
+            value=f"{incident.message[:900]}\nLast seen <t:{int(incident.last_seen)}:R> · `{incident.key}`",
+            inline=False
+        )
+    hidden = sum(incident.unreported for incident in incidents[24:]) + untracked
+    if hidden:
+        embed.add_field(name="Other", value=f"{hidden} more occurrences not listed", inline=False)
+    embed.set_footer(text="AJ Trading Academy Bot - Critical Error Digest")
+    return embed
+
+
+error_reporter = ErrorReporter()
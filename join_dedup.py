@@ -0,0 +1,177 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+
+from utils import async_json_read, run_blocking_io
+from metrics import STORAGE_WRITE_SECONDS
+
+log = logging.getLogger('gatekeeper.join')
+
+JOIN_DEDUP_FILE = os.getenv('JOIN_DEDUP_FILE', 'join_dedup.log')
+JOIN_DEDUP_TTL = float(os.getenv('JOIN_DEDUP_TTL', 86400))  # Seconds a processed join suppresses repeats
+JOIN_DEDUP_MAX = int(os.getenv('JOIN_DEDUP_MAX', 50000))  # Oldest entries are evicted past this size
+JOIN_DEDUP_FLUSH_DELAY = 1.0  # Seconds to batch appends during join bursts
+LEGACY_LOGGED_MEMBERS_FILE = 'logged_members.json'
+
+
+class JoinDedup:
+    """Member ids whose join was handled recently, expiring after ttl seconds.
+
+    Entries live in an OrderedDict in the order they were added, so the
+    oldest are always at the front: lookups and inserts are O(1), expiry pops
+    only what has expired, and hitting max_size evicts just the oldest entry
+    rather than wiping the set. Changes are appended to a log file
+    ("<id> <seen_at>" or "-<id>") in small batches; the log is rewritten as a
+    snapshot of the live entries once it grows to twice their number.
+    """
+
+    def __init__(self, path=JOIN_DEDUP_FILE, ttl=JOIN_DEDUP_TTL, max_size=JOIN_DEDUP_MAX, clock=time.time):
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max(1, max_size)
+        self._clock = clock
+        self._seen = OrderedDict()  # member id -> seen_at, oldest first
+        self._appends = []
+        self._log_lines = 0
+        self._flush_handle = None
+        self._writes = set()
+        self.evicted = 0
+
+    def __len__(self):
+        self.expire()
+        return len(self._seen)
+
+    def __contains__(self, member_id):
+        return self.seen_at(member_id) is not None
+
+    def seen_at(self, member_id):
+        """When member_id's join was handled, or None if it was not (or has expired)"""
+        seen_at = self._seen.get(int(member_id))
+        if seen_at is None:
+            return None
+        if self._clock() - seen_at >= self.ttl:
+            self.expire()
+            return None
+        return seen_at
+
+    def add(self, member_id):
+        member_id = int(member_id)
+        now = self._clock()
+        self._seen.pop(member_id, None)
+        self._seen[member_id] = now
+        self.expire(now)
+        while len(self._seen) > self.max_size:
+            self._seen.popitem(last=False)
+            self.evicted += 1
+        self._append(f"{member_id} {now:.3f}")
+
+    def discard(self, member_id):
+        member_id = int(member_id)
+        if self._seen.pop(member_id, None) is not None:
+            self._append(f"-{member_id}")
+
+    def expire(self, now=None):
+        cutoff = (self._clock() if now is None else now) - self.ttl
+        while self._seen:
+            member_id, seen_at = next(iter(self._seen.items()))
+            if seen_at > cutoff:
+                break
+            self._seen.popitem(last=False)
+
+    async def load(self):
+        """Replay the log (or import the legacy logged_members.json once)"""
+        # The legacy file belongs to GUILD_ID, whose log keeps the default name
+        legacy = self.path == JOIN_DEDUP_FILE and os.path.exists(LEGACY_LOGGED_MEMBERS_FILE)
+        if legacy and not os.path.exists(self.path):
+            data = await async_json_read(LEGACY_LOGGED_MEMBERS_FILE, {})
+            now = self._clock()
+            for member_id in data.get('logged_members', []) if isinstance(data, dict) else []:
+                if str(member_id).isdigit():
+                    self._seen[int(member_id)] = now
+            snapshot = self._snapshot_lines()
+            self._log_lines = len(snapshot)
+            await run_blocking_io(self._write_snapshot, snapshot)
+            # Keep the old file around for reference, but never import it twice
+            await run_blocking_io(os.replace, LEGACY_LOGGED_MEMBERS_FILE, f"{LEGACY_LOGGED_MEMBERS_FILE}.migrated")
+            log.warning("Imported %s members from %s into %s", len(self._seen), LEGACY_LOGGED_MEMBERS_FILE, self.path)
+            return
+        lines = await run_blocking_io(self._read_lines)
+        for line in lines:
+            try:
+                if line.startswith('-'):
+                    self._seen.pop(int(line[1:]), None)
+                else:
+                    member_id, seen_at = line.split()
+                    member_id = int(member_id)
+                    self._seen.pop(member_id, None)
+                    self._seen[member_id] = float(seen_at)
+            except ValueError:
+                continue  # A torn last line from a crash mid-append
+        self._log_lines = len(lines)
+        self.expire()
+        while len(self._seen) > self.max_size:
+            self._seen.popitem(last=False)
+        log.info("Loaded %s recent joins from %s", len(self._seen), self.path)
+
+    def _read_lines(self):
+        try:
+            with open(self.path, 'r') as f:
+                return [line.strip() for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def _append(self, line):
+        self._appends.append(line)
+        if self._flush_handle is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                return
+            self._flush_handle = loop.call_later(JOIN_DEDUP_FLUSH_DELAY, self._flush_in_background)
+
+    def _flush_in_background(self):
+        self._flush_handle = None
+        task = asyncio.get_running_loop().create_task(self.flush())
+        self._writes.add(task)
+        task.add_done_callback(self._writes.discard)
+
+    async def flush(self):
+        """Write queued changes; compacts the log once it is twice the live size"""
+        if self._flush_handle:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._appends:
+            return
+        lines, self._appends = self._appends, []
+        self._log_lines += len(lines)
+        try:
+            if self._log_lines > 2 * len(self) + 1000:
+                snapshot = self._snapshot_lines()
+                self._log_lines = len(snapshot)
+                await run_blocking_io(self._write_snapshot, snapshot)
+            else:
+                await run_blocking_io(self._append_lines, lines)
+        except Exception as e:
+            log.error("Error writing %s: %s", self.path, e)
+
+    async def aclose(self):
+        await self.flush()
+        if self._writes:
+            await asyncio.gather(*self._writes, return_exceptions=True)
+
+    def _snapshot_lines(self):
+        return [f"{member_id} {seen_at:.3f}" for member_id, seen_at in self._seen.items()]
+
+    def _append_lines(self, lines):
+        with STORAGE_WRITE_SECONDS.time(kind='dedup'):
+            with open(self.path, 'a') as f:
+                f.write('\n'.join(lines) + '\n')
+
+    def _write_snapshot(self, lines):
+        with STORAGE_WRITE_SECONDS.time(kind='dedup'):
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, 'w') as f:
+                f.write('\n'.join(lines) + '\n' if lines else '')
+            os.replace(temp_path, self.path)
@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+
+from metrics import JOINS_PROCESSED
+
+log = logging.getLogger('gatekeeper.join')
+
+JOIN_WORKERS = int(os.getenv('JOIN_WORKERS', 4))
+RAID_JOIN_THRESHOLD = int(os.getenv('RAID_JOIN_THRESHOLD', 15))  # Joins within RAID_WINDOW that switch on raid mode
+RAID_WINDOW = float(os.getenv('RAID_WINDOW', 10))
+RAID_SUMMARY_INTERVAL = float(os.getenv('RAID_SUMMARY_INTERVAL', 30))
+
+
+class JoinPipeline:
+    """Queue of member joins processed by a bounded worker pool.
+
+    on_member_join only calls submit(), so the gateway handler returns at once
+    however many members arrive. A member already waiting in the queue is not
+    queued twice. The join rate is tracked over a sliding window; when it
+    reaches raid_threshold the pipeline enters raid mode, which the handler
+    uses to skip per-member log embeds, and on_summary is called every
+    summary_interval with the joins processed since the last summary. Raid
+    mode ends once the rate falls below half the threshold and the queue has
+    drained.
+    """
+
+    def __init__(self, handler, workers=JOIN_WORKERS, raid_threshold=RAID_JOIN_THRESHOLD,
+                 raid_window=RAID_WINDOW, summary_interval=RAID_SUMMARY_INTERVAL,
+                 on_summary=None, clock=time.monotonic):
+        self._handler = handler  # async callable(member, raid_mode)
+        self._on_summary = on_summary  # async callable(pipeline, joins_since_last_summary)
+        self.workers = max(1, workers)
+        self.raid_threshold = raid_threshold
+        self.raid_window = raid_window
+        self.summary_interval = summary_interval
+        self._clock = clock
+        self._queue = asyncio.Queue()
+        self._pending = {}  # member id -> (member, enqueued_at)
+        self._recent = deque()  # submit times within raid_window
+        self._tasks = []
+        self.raid_mode = False
+        self.raid_started_at = None
+        self.raids = 0
+        self.processed = 0
+        self.failed = 0
+        self.duplicates = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0  # Worst lag since the last summary
+        self._since_summary = 0
+
+    @property
+    def depth(self):
+        return self._queue.qsize()
+
+    @property
+    def join_rate(self):
+        """Joins per second over the sliding window"""
+        self._trim(self._clock())
+        return len(self._recent) / self.raid_window if self.raid_window else 0.0
+
+    def stats(self):
+        return {
+            'queue_depth': self.depth,
+            'last_lag': round(self.last_lag, 3),
+            'max_lag': round(self.max_lag, 3),
+            'join_rate': round(self.join_rate, 2),
+            'raid_mode': self.raid_mode,
+            'raids': self.raids,
+            'processed': self.processed,
+            'failed': self.failed,
+            'duplicates': self.duplicates,
+        }
+
+    def submit(self, member):
+        """Queue a join; returns False if the member was already waiting"""
+        now = self._clock()
+        self._recent.append(now)
+        self._trim(now)
+        if not self.raid_mode and len(self._recent) >= self.raid_threshold:
+            self.raid_mode = True
+            self.raid_started_at = now
+            self.raids += 1
+            log.warning("Join raid detected: %s joins in %.0fs, switching to summary logging", len(self._recent), self.raid_window)
+
+        if member.id in self._pending:
+            # Keep the newest member object but don't process the member twice
+            self._pending[member.id] = (member, self._pending[member.id][1])
+            self.duplicates += 1
+            return False
+        self._pending[member.id] = (member, now)
+        self._queue.put_nowait(member.id)
+        return True
+
+    def discard(self, member_id):
+        """Drop a queued join (the member left before it was processed)"""
+        return self._pending.pop(member_id, None) is not None
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+            self._tasks.append(asyncio.create_task(self._summary_loop()))
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        await self._summarize()
+
+    def _trim(self, now):
+        while self._recent and now - self._recent[0] > self.raid_window:
+            self._recent.popleft()
+
+    async def _worker(self):
+        while True:
+            member_id = await self._queue.get()
+            try:
+                entry = self._pending.pop(member_id, None)
+                if entry is None:
+                    continue
+                member, enqueued_at = entry
+                self.last_lag = self._clock() - enqueued_at
+                self.max_lag = max(self.max_lag, self.last_lag)
+                raid_mode = self.raid_mode
+                try:
+                    await self._handler(member, raid_mode)
+                    self.processed += 1
+                    JOINS_PROCESSED.inc(result='ok')
+                except Exception as e:
+                    self.failed += 1
+                    JOINS_PROCESSED.inc(result='failed')
+                    log.error("Error processing join for %s: %s", member_id, e)
+                if raid_mode:
+                    self._since_summary += 1
+            finally:
+                self._queue.task_done()
+
+    async def _summary_loop(self):
+        while True:
+            await asyncio.sleep(self.summary_interval)
+            try:
+                await self._summarize()
+            except Exception as e:
+                log.error("Error sending join raid summary: %s", e)
+
+    async def _summarize(self):
+        now = self._clock()
+        self._trim(now)
+        if self.raid_mode and self._since_summary and self._on_summary:
+            await self._on_summary(self, self._since_summary)
+            self._since_summary = 0
+            self.max_lag = self.last_lag
+        if self.raid_mode and self.depth == 0 and len(self._recent) < self.raid_threshold / 2:
+            self.raid_mode = False
+            log.info("Join raid over after %.0fs, back to per-member logging", now - self.raid_started_at)
@@ -0,0 +1,186 @@
+import asyncio
+import logging
+import os
+from collections import Counter, deque
+from datetime import datetime, timezone
+
+import discord
+
+from config import get_settings
+from metrics import LOG_SINK_DROPPED
+
+log = logging.getLogger('gatekeeper.log_sink')
+
+LOG_SINK_MAX_QUEUE = int(os.getenv('LOG_SINK_MAX_QUEUE', 1000))
+LOG_SINK_FLUSH_INTERVAL = float(os.getenv('LOG_SINK_FLUSH_INTERVAL', 2.0))
+LOG_SINK_DIGEST_THRESHOLD = int(os.getenv('LOG_SINK_DIGEST_THRESHOLD', 30))
+LOG_SINK_DROP_POLICY = os.getenv('LOG_SINK_DROP_POLICY', 'oldest')  # 'oldest' or 'newest'
+LOG_SINK_CLOSE_TIMEOUT = float(os.getenv('LOG_SINK_CLOSE_TIMEOUT', 10.0))  # Seconds close() waits for the queue to drain
+EMBEDS_PER_MESSAGE = 10  # Discord's limit per message
+
+
+class LogSink:
+    """Queue of log-channel embeds sent in batches by one background task.
+
+    Handlers call submit(), which never awaits. The task sends up to ten embeds
+    per message as soon as ten are waiting or flush_interval seconds after the
+    first one arrived. When the backlog passes digest_threshold the queued
+    embeds are collapsed into a single digest embed instead. If the queue is
+    full, the drop policy discards the oldest or the newest embed and the number
+    of dropped embeds is reported in the next message.
+    """
+
+    def __init__(self, bot, channel_id, max_queue=LOG_SINK_MAX_QUEUE,
+                 flush_interval=LOG_SINK_FLUSH_INTERVAL, digest_threshold=LOG_SINK_DIGEST_THRESHOLD,
+                 drop_policy=LOG_SINK_DROP_POLICY):
+        self.bot = bot
+        self.channel_id = channel_id
+        self.max_queue = max_queue
+        self.flush_interval = flush_interval
+        self.digest_threshold = digest_threshold
+        self.drop_policy = drop_policy
+        self._queue = deque()
+        self._has_items = asyncio.Event()
+        self._batch_full = asyncio.Event()
+        self._task = None
+        self._closing = False
+        self.sent_messages = 0
+        self.dropped = 0
+        self._unreported_drops = 0
+
+    def __len__(self):
+        return len(self._queue)
+
+    def submit(self, embed):
+        """Queue an embed for the logs channel; returns False if it was dropped"""
+        if not self.channel_id:
+            return False
+        if len(self._queue) >= self.max_queue:
+            self.dropped += 1
+            self._unreported_drops += 1
+            LOG_SINK_DROPPED.inc()
+            if self.drop_policy == 'newest':
+                return False
+            self._queue.popleft()
+        self._queue.append(embed)
+        self._has_items.set()
+        if len(self._queue) >= EMBEDS_PER_MESSAGE:
+            self._batch_full.set()
+        return True
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._closing = False
+            self._task = asyncio.create_task(self._run())
+        return self._task
+
+    async def close(self, timeout=LOG_SINK_CLOSE_TIMEOUT):
+        """Have the background task send whatever is still queued, waiting up to timeout seconds"""
+        task, self._task = self._task, None
+        self._closing = True
+        # Wake the task wherever it waits; a batch already being sent completes first
+        self._has_items.set()
+        self._batch_full.set()
+        try:
+            if task is None or task.done():
+                await asyncio.wait_for(self.flush(), timeout)
+            else:
+                await asyncio.wait_for(task, timeout)
+        except asyncio.TimeoutError:
+            log.warning("Log sink did not finish sending within %ss, %s log embeds still queued", timeout, len(self._queue))
+        except Exception as e:
+            log.error("Error flushing log sink on shutdown: %s", e)
+
+    async def _run(self):
+        while True:
+            await self._has_items.wait()
+            if not self._closing:
+                try:
+                    await asyncio.wait_for(self._batch_full.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            try:
+                await self.flush()
+            except Exception as e:
+                log.error("Error flushing log sink: %s", e)
+            if self._closing and not self._queue:
+                return
+
+    async def flush(self):
+        """Send everything queued right now"""
+        while self._queue:
+            if len(self._queue) >= self.digest_threshold:
+                batch = list(self._queue)
+                self._queue.clear()
+                embeds = [self._digest(batch)]
+            else:
+                embeds = [self._queue.popleft() for _ in range(min(EMBEDS_PER_MESSAGE, len(self._queue)))]
+            await self._send(embeds)
+        self._has_items.clear()
+        self._batch_full.clear()
+
+    def _digest(self, batch):
+        """Collapse a burst of embeds into one summary embed"""
+        counts = Counter(embed.title or "Untitled" for embed in batch)
+        embed = discord.Embed(
+            title="📊 Activity Digest",
+            description=f"**{len(batch)}** events collapsed into one summary during a burst",
+            color=0x5865f2,
+            timestamp=datetime.now(timezone.utc)
+        )
+        lines = [f"{title}: **{count}**" for title, count in counts.most_common(20)]
+        embed.add_field(name="Events", value="\n".join(lines)[:1024], inline=False)
+
+        first = batch[0].timestamp
+        last = batch[-1].timestamp
+        if first and last:
+            embed.add_field(
+                name="Window",
+                value=f"<t:{int(first.timestamp())}:T> - <t:{int(last.timestamp())}:T>",
+                inline=False
+            )
+        return embed
+
+    async def _send(self, embeds):
+        channel = self.bot.get_channel(self.channel_id)
+        if not channel:
+            log.warning("Logs channel %s not found, dropping %s log embeds", self.channel_id, len(embeds))
+            return
+        content = None
+        if self._unreported_drops:
+            content = f"⚠️ {self._unreported_drops} log events were dropped (log queue full)"
+            self._unreported_drops = 0
+        try:
+            await channel.send(content=content, embeds=embeds)
+            self.sent_messages += 1
+        except discord.Forbidden:
+            log.warning("Bot doesn't have permission to send messages to logs channel %s", self.channel_id)
+        except Exception as e:
+            log.error("Error sending log message: %s", e)
+
+
+def submit_log(bot, embed, guild_id=None):
+    """Hand an embed to guild_id's log sink (GUILD_ID's by default) without waiting for it to be sent"""
+    sink = getattr(bot, 'log_sink', None)
+    if sink is None:
+        log.warning("Log sink not initialized, dropping log embed")
+        return False
+    if guild_id is not None and guild_id != get_settings().guild_id:
+        sink = guild_log_sink(bot, guild_id)
+    return sink.submit(embed)
+
+
+def guild_log_sink(bot, guild_id):
+    """The log sink for another guild's logs channel, started on first use"""
+    sinks = bot.__dict__.setdefault('guild_log_sinks', {})
+    sink = sinks.get(guild_id)
+    if sink is None:
+        sink = sinks[guild_id] = LogSink(bot, get_settings(guild_id).logs_channel_id)
+        sink.start()
+    return sink
+
+
+def all_log_sinks(bot):
+    """GUILD_ID's sink followed by every other guild's"""
+    sinks = [bot.log_sink] if getattr(bot, 'log_sink', None) else []
+    return sinks + list(getattr(bot, 'guild_log_sinks', {}).values())
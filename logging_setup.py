@@ -0,0 +1,193 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import time
+from datetime import datetime, timezone
+
+LOG_FILE = os.getenv('LOG_FILE', 'bot.log')
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'WARNING').upper()
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', 10 * 1024 * 1024))  # Rotate once the file reaches this size
+LOG_ROTATE_WHEN = os.getenv('LOG_ROTATE_WHEN', 'midnight')  # ...or on this schedule, whichever comes first
+LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', 7))
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+LOG_SAMPLE_BURST = int(os.getenv('LOG_SAMPLE_BURST', 20))  # Identical INFO/DEBUG messages allowed per window
+LOG_SAMPLE_WINDOW = float(os.getenv('LOG_SAMPLE_WINDOW', 60))
+
+# Subsystems whose routine messages repeat per member or job update; everything at WARNING and above always passes
+SAMPLED_SUBSYSTEMS = ('gatekeeper.welcome', 'gatekeeper.verification', 'gatekeeper.join', 'gatekeeper.reconcile', 'gatekeeper.commands')
+
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'taskName'}
+
+_listener = None
+_TRACEBACK_FORMATTER = logging.Formatter()
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, msg, plus any extra= fields"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_FIELDS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class SizedTimedRotatingFileHandler(logging.handlers.TimedRotatingFileHandler):
+    """Rotates on a schedule and also whenever the file would grow past max_bytes"""
+
+    def __init__(self, filename, max_bytes=LOG_MAX_BYTES, when=LOG_ROTATE_WHEN, backup_count=LOG_BACKUP_COUNT):
+        super().__init__(filename, when=when, backupCount=backup_count, encoding='utf-8', delay=True, utc=True)
+        self.max_bytes = max_bytes
+        self._formatted = None  # (record, text) measured by shouldRollover, reused by emit
+
+    def shouldRollover(self, record):
+        if super().shouldRollover(record):
+            return True
+        if self.max_bytes <= 0:
+            return False
+        if self.stream is None:
+            self.stream = self._open()
+        text = self.format(record)
+        self._formatted = (record, text)
+        return self.stream.tell() + len(text) + 1 >= self.max_bytes
+
+    def format(self, record):
+        # emit() formats the record shouldRollover() just measured; hand back that text
+        formatted, self._formatted = self._formatted, None
+        if formatted is not None and formatted[0] is record:
+            return formatted[1]
+        return super().format(record)
+
+    def rotation_filename(self, default_name):
+        # Size rollovers can happen several times inside one time slot
+        if os.path.exists(default_name):
+            suffix = 1
+            while os.path.exists(f"{default_name}.{suffix}"):
+                suffix += 1
+            return f"{default_name}.{suffix}"
+        return default_name
+
+
+class SamplingFilter(logging.Filter):
+    """Lets the first `burst` copies of a chatty message through per window, then counts the rest.
+
+    Messages are keyed by logger and unformatted template, so "Assigned member
+    role to user %s" is one key no matter how many users it fires for. The
+    number suppressed is attached to the next record that gets through.
+    """
+
+    def __init__(self, subsystems=SAMPLED_SUBSYSTEMS, burst=LOG_SAMPLE_BURST, window=LOG_SAMPLE_WINDOW, clock=time.monotonic):
+        super().__init__()
+        self.subsystems = tuple(subsystems)
+        self.burst = burst
+        self.window = window
+        self.clock = clock
+        self._seen = {}  # (logger, template) -> [window start, count, suppressed]
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or self.burst <= 0 or not record.name.startswith(self.subsystems):
+            return True
+        key = (record.name, record.msg)
+        now = self.clock()
+        state = self._seen.get(key)
+        if state is None or now - state[0] >= self.window:
+            suppressed = state[2] if state else 0
+            if len(self._seen) > 10000:
+                self._seen.clear()
+            self._seen[key] = [now, 1, 0]
+            if suppressed:
+                record.suppressed = suppressed
+            return True
+        state[1] += 1
+        if state[1] <= self.burst:
+            return True
+        state[2] += 1
+        return False
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Never blocks the event loop: when the queue is full the record is dropped"""
+
+    dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        # Resolve the message and traceback now (the args may change later), but keep
+        # the exception separate so the JSON formatter can put it in its own field
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _TRACEBACK_FORMATTER.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging():
+    """Route all logging through a queue to a rotating JSON-lines file and the console.
+
+    Callers only pay for a level check and a queue put; formatting and disk
+    writes happen on the QueueListener's thread. Returns the listener.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+
+    # Clear any existing handlers
+    for handler in logging.root.handlers[:]:
+        logging.root.removeHandler(handler)
+
+    level = getattr(logging, LOG_LEVEL, logging.WARNING)
+
+    file_handler = SizedTimedRotatingFileHandler(LOG_FILE)
+    file_handler.setFormatter(JsonFormatter())
+    file_handler.setLevel(level)
+
+    # Console handler (minimal output)
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter('%(levelname)-8s | %(message)s'))
+    console_handler.setLevel(logging.ERROR)  # Only errors to console
+
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    queue_handler = _DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter())
+
+    logging.root.setLevel(level)
+    logging.root.addHandler(queue_handler)
+
+    _listener = logging.handlers.QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+    # Reduce discord.py logging noise
+    logging.getLogger('discord').setLevel(logging.ERROR)
+    logging.getLogger('discord.http').setLevel(logging.ERROR)
+    logging.getLogger('discord.gateway').setLevel(logging.ERROR)
+    return _listener
+
+
+def stop_logging():
+    """Flush queued records to disk; safe to call more than once"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
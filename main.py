@@ -1,6 +1,8 @@
+import time
+_process_started = time.perf_counter()
+
 import sys
 import subprocess
-import importlib.metadata  # Replace deprecated pkg_resources
 import logging
 import discord
 from discord.ext import commands
@@ -8,70 +10,42 @@ import asyncio
 from dotenv import load_dotenv
 import os
 from datetime import datetime, timezone
-import json
 
-# Load environment variables
+# Load environment variables before the modules that read them at import (WORKER_COUNT, METRICS_PORT, ...)
 load_dotenv()
 
-# Security Configuration
-OWNER_USER_IDS = {890323443252351046, 879714530769391686}
-GUILD_ID = int(os.getenv('GUILD_ID', 0))
-MEMBER_ROLE_ID = int(os.getenv('MEMBER_ROLE_ID', 0))
-UNVERIFIED_ROLE_ID = int(os.getenv('UNVERIFIED_ROLE_ID', 0))
-WELCOME_CHANNEL_ID = int(os.getenv('WELCOME_CHANNEL_ID', 0))
-ROLE_ASSIGNMENT_DELAY = int(os.getenv('ROLE_ASSIGNMENT_DELAY', 5))
-CHECK_INTERVAL = int(os.getenv('CHECK_INTERVAL', 30))
-CALENDLY_LINK = os.getenv('CALENDLY_LINK', 'https://calendly.com/ajtradingprofits-support/mastermind-call')
+from utils import is_authorized_guild_or_owner, get_or_create_welcome_message
+from log_sink import LogSink, all_log_sinks
+from config import get_settings, handles
+from role_index import role_index
+from member_cache import member_cache, client_options
+from metrics import discord_trace_config, start_metrics_server, LOG_SINK_QUEUE, CACHED_MEMBERS
+from perf import monitor as perf_monitor, startup
+from logging_setup import setup_logging, stop_logging
+from command_sync import sync_command_tree
+from error_reporter import error_reporter
+from workers import WORKER_COUNT, is_supervisor, shard_options, supervise, worker_index
 
-def is_authorized_guild_or_owner(interaction):
-    """Check if user is authorized to use commands"""
-    if interaction.guild and interaction.guild.id == GUILD_ID:
-        return True
-    if interaction.user.id in OWNER_USER_IDS:
-        return True
-    return False
+startup.record('imports', time.perf_counter() - _process_started)
 
-async def get_or_create_welcome_message(welcome_channel, embed, view):
-    """Get message ID and edit it, or create new if needed."""
-    try:
-        with open('welcome_message.json', 'r') as f:
-            data = json.load(f)
-            msg_id = data.get('message_id')
-    except:
-        msg_id = None
-    
-    if msg_id:
-        try:
-            msg = await welcome_channel.fetch_message(msg_id)
-            await msg.edit(embed=embed, view=view)
-            return msg
-        except:
-            pass
-    
-    # Create new message only if needed
-    msg = await welcome_channel.send(embed=embed, view=view)
-    with open('welcome_message.json', 'w') as f:
-        json.dump({'message_id': msg.id, 'channel_id': welcome_channel.id}, f)
-    return msg
 
 def check_and_install_requirements():
-    """Check and install required packages using modern importlib.metadata"""
+    """Install any requirement whose distribution is missing.
+
+    Only runs with --check-deps or CHECK_DEPENDENCIES=1; each requirement is
+    looked up by name instead of walking every installed distribution.
+    """
+    import importlib.metadata
     try:
         with open('requirements.txt') as f:
-            requirements = [line.strip() for line in f if line.strip()]
-        
-        # Use importlib.metadata instead of deprecated pkg_resources
-        try:
-            installed = {dist.metadata['name'].lower().replace('-', '_') for dist in importlib.metadata.distributions()}
-        except Exception:
-            # Fallback for older Python versions
-            import pkg_resources
-            installed = {pkg.key for pkg in pkg_resources.working_set}
+            requirements = [line.strip() for line in f if line.strip() and not line.startswith('#')]
         
         missing = []
         for requirement in requirements:
-            pkg_name = requirement.split('>=')[0].lower().replace('-', '_')
-            if pkg_name not in installed:
+            pkg_name = requirement.split('>=')[0].split('==')[0].strip()
+            try:
+                importlib.metadata.version(pkg_name)
+            except importlib.metadata.PackageNotFoundError:
                 missing.append(requirement)
         
         if missing:
@@ -86,43 +60,6 @@ def check_and_install_requirements():
         print(f"❌ Error checking/installing packages: {e}")
         sys.exit(1)
 
-# Run the check at startup
-print("🔍 Checking dependencies...", end=" ")
-check_and_install_requirements()
-
-def setup_logging():
-    """Setup clean, production-ready logging"""
-    # Clear any existing handlers
-    for handler in logging.root.handlers[:]:
-        logging.root.removeHandler(handler)
-    
-    # Create formatter
-    formatter = logging.Formatter(
-        '%(asctime)s | %(levelname)-8s | %(name)-15s | %(message)s',
-        datefmt='%H:%M:%S'
-    )
-    
-    # File handler
-    file_handler = logging.FileHandler('bot.log', encoding='utf-8')
-    file_handler.setFormatter(formatter)
-    file_handler.setLevel(logging.WARNING)  # Only warnings and errors
-    
-    # Console handler (minimal output)
-    console_handler = logging.StreamHandler()
-    console_handler.setFormatter(logging.Formatter('%(levelname)-8s | %(message)s'))
-    console_handler.setLevel(logging.ERROR)  # Only errors to console
-    
-    # Setup root logger
-    logging.basicConfig(
-        level=logging.WARNING,
-        handlers=[file_handler, console_handler]
-    )
-    
-    # Reduce discord.py logging noise
-    logging.getLogger('discord').setLevel(logging.ERROR)
-    logging.getLogger('discord.http').setLevel(logging.ERROR)
-    logging.getLogger('discord.gateway').setLevel(logging.ERROR)
-
 setup_logging()
 
 # Set up intents
@@ -132,15 +69,52 @@ intents.message_content = True
 intents.guilds = True
 intents.guild_messages = True
 
-class AIdapticsWhopGatekeeper(commands.Bot):
+# SHARD_COUNT=auto (or a number) runs on AutoShardedBot, for deployments serving many guilds;
+# with WORKER_COUNT > 1 each worker process connects only its share of the shards
+SHARD_COUNT = os.getenv('SHARD_COUNT', '').strip().lower()
+BotBase = commands.AutoShardedBot if SHARD_COUNT or WORKER_COUNT > 1 else commands.Bot
+
+class AIdapticsWhopGatekeeper(BotBase):
     def __init__(self):
-        super().__init__(command_prefix='!', intents=intents)
+        # The trace times every REST call per route for the metrics exporter
+        # MEMBER_CACHE_POLICY=onboarding skips chunking and caches only members being onboarded
+        super().__init__(command_prefix='!', intents=intents, http_trace=discord_trace_config(),
+                         **shard_options(), **client_options(intents))
         self.startup_time = datetime.now(timezone.utc)
+        self.log_sink = None
+        self.guild_log_sinks = {}  # Log sinks of guilds other than GUILD_ID
+        self.metrics_server = None
+        self._connect_started = None
         
     async def setup_hook(self):
+        with startup.phase('services'):
+            # Cached guild/role/channel handles, refreshed on guild and role events
+            handles.bind(self)
+            # role_id -> member ids, maintained from member events
+            role_index.bind(self)
+            # Member lookups by id under the member cache policy
+            member_cache.bind(self)
+            member_cache.start()
+            CACHED_MEMBERS.set_function(lambda: sum(len(guild._members) for guild in self.guilds) + len(member_cache))
+            
+            # Batched logs-channel sender used by every cog (other guilds get theirs on first use)
+            self.log_sink = LogSink(self, get_settings().logs_channel_id)
+            self.log_sink.start()
+            LOG_SINK_QUEUE.set_function(lambda: sum(len(sink) for sink in all_log_sinks(self)))
+            
+            # Local Prometheus exporter (METRICS_PORT=0 disables it)
+            self.metrics_server = await start_metrics_server()
+            
+            # Loop lag sampler and stall watchdog behind /perf
+            perf_monitor.start()
+            
+            # Owner error reports are sent, batched and deduplicated in the background
+            error_reporter.bot = self
+        
         print("🔧 Loading cogs...", end=" ")
         try:
-            await self.load_extension('cogs')
+            with startup.phase('cogs'):
+                await self.load_extension('cogs')
             print(f"✅ All cogs loaded successfully!")
             logging.info("All cogs loaded via cogs/__init__.py loader")
         except Exception as e:
@@ -149,27 +123,69 @@ class AIdapticsWhopGatekeeper(commands.Bot):
 
         print("🔧 Loading commands...", end=" ")
         try:
-            await self.load_extension('commands')
+            with startup.phase('commands'):
+                await self.load_extension('commands')
             print(f"✅ All commands loaded successfully!")
             logging.info("All commands loaded via commands/__init__.py loader")
         except Exception as e:
             print(f"❌ Failed to load commands: {e}")
             logging.error(f"Failed to load commands: {e}")
         
+        # Time every slash command for /perf
+        perf_monitor.instrument_tree(self.tree)
+        
         print("🔄 Syncing commands...", end=" ")
         
-        # Sync commands globally
+        # Only talk to Discord when the command definitions changed (or --force-sync)
+        force = '--force-sync' in sys.argv or os.getenv('FORCE_COMMAND_SYNC', '').lower() in ('1', 'true', 'yes')
         try:
-            synced = await self.tree.sync()
-            print(f"✅ Synced {len(synced)} slash commands")
-            logging.info(f"Synced {len(synced)} slash commands globally")
+            with startup.phase('tree sync'):
+                if worker_index() == 0:
+                    synced, scope, seconds = await sync_command_tree(self, force=force)
+                else:
+                    # Commands belong to the application, so one worker syncing them is enough
+                    synced, scope, seconds = None, None, 0.0
+            if synced is None:
+                print(f"⏭️ Slash commands unchanged, skipped sync ({seconds:.2f}s)")
+            else:
+                print(f"✅ Synced {synced} slash commands to {scope} in {seconds:.2f}s")
         except Exception as e:
             print(f"❌ Failed to sync commands: {e}")
             logging.error(f"Failed to sync commands: {e}")
+        
+        # Gateway connect and member chunking run between here and the first on_ready
+        self._connect_started = time.perf_counter()
+
+    async def close(self):
+        """Flush queued log embeds, then pending writes after cogs have shut down"""
+        from commands.deferred import cancel_all
+        await cancel_all()
+        # commands.Bot.close() unloads these too, but only after the log sinks' last chance to send;
+        # unloading them first lets embeds the cogs submit while tearing down reach the logs channel
+        for extension in tuple(self.extensions):
+            try:
+                await self.unload_extension(extension)
+            except Exception as e:
+                logging.error(f"Error unloading {extension} on shutdown: {e}")
+        for cog in tuple(self.cogs):
+            try:
+                await self.remove_cog(cog)
+            except Exception as e:
+                logging.error(f"Error removing cog {cog} on shutdown: {e}")
+        await error_reporter.aclose()
+        for sink in all_log_sinks(self):
+            await sink.close()
+        if self.metrics_server:
+            self.metrics_server.close()
+        perf_monitor.stop()
+        member_cache.stop()
+        await super().close()
+        from storage import aclose_user_store
+        await aclose_user_store()
 
     async def on_ready(self):
         print(f"\n🤖 {self.user} is now online!")
-        print(f"📊 Connected to {len(self.guilds)} guild(s)")
+        print(f"📊 Connected to {len(self.guilds)} guild(s)" + (f" over {self.shard_count} shard(s)" if self.shard_count else ""))
         print(f"👥 Serving {sum(guild.member_count or 0 for guild in self.guilds)} members")
         
         # Set custom status
@@ -191,6 +207,13 @@ class AIdapticsWhopGatekeeper(commands.Bot):
         print("=" * 60)
         
         logging.info(f"Bot started successfully as {self.user}")
+        
+        # on_ready fires again after reconnects; only the first one ends startup
+        if self._connect_started is not None:
+            startup.record('cache fill', time.perf_counter() - self._connect_started)
+            self._connect_started = None
+            print(f"⏱️ Startup took {startup.total:.2f}s: {startup.summary()}")
+            logging.warning(f"Startup took {startup.total:.2f}s: {startup.summary()}")
 
     async def on_command_error(self, ctx, error):
         """Handle command errors"""
@@ -317,14 +340,27 @@ if __name__ == "__main__":
     print("🚀 Starting AJ Trading Academy Gatekeeper...")
     print("=" * 60)
     
+    # Dependency probing is opt-in; deploys install requirements.txt up front
+    if '--check-deps' in sys.argv or os.getenv('CHECK_DEPENDENCIES', '').lower() in ('1', 'true', 'yes'):
+        print("🔍 Checking dependencies...", end=" ")
+        check_and_install_requirements()
+    
+    # WORKER_COUNT > 1: this process only starts and watches the shard workers
+    if is_supervisor():
+        supervise(sys.argv)
+        stop_logging()
+        sys.exit(0)
+    
     token = os.getenv('TOKEN')
     if not token:
         print("❌ CRITICAL ERROR: TOKEN environment variable is not set!")
         print("   Please check your .env file and ensure TOKEN is properly configured.")
         logging.error("Bot startup failed: TOKEN environment variable missing")
-        input("Press Enter to exit...")
+        if sys.stdin.isatty():
+            input("Press Enter to exit...")
         sys.exit(1)
     
+    exit_code = 0
     try:
         bot.run(token, log_handler=None)  # Disable discord.py's default logging
     except discord.LoginFailure:
@@ -334,6 +370,11 @@ if __name__ == "__main__":
     except Exception as e:
         print(f"❌ CRITICAL ERROR: Failed to start bot: {e}")
         logging.error(f"Bot startup failed: {e}")
+        exit_code = 1  # Lets the worker supervisor restart a crashed worker
     finally:
+        stop_logging()
         print("\n👋 Bot shutdown complete.")
-        input("Press Enter to exit...")
\ No newline at end of file
+        # Workers run without a terminal
+        if sys.stdin.isatty():
+            input("Press Enter to exit...")
+    sys.exit(exit_code)
\ No newline at end of file
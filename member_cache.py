@@ -0,0 +1,211 @@
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+
+import discord
+
+from config import get_settings
+from metrics import MEMBER_LOOKUPS
+
+log = logging.getLogger('gatekeeper.members')
+
+# 'full' chunks every guild and caches every member; 'onboarding' caches only members
+# being onboarded (Unverified role or a pending role grant) and fetches the rest on demand
+MEMBER_CACHE_POLICY = os.getenv('MEMBER_CACHE_POLICY', 'full').strip().lower()
+MEMBER_LRU_SIZE = int(os.getenv('MEMBER_LRU_SIZE', 2000))  # Fetched members kept under the onboarding policy
+MEMBER_CACHE_PRUNE_INTERVAL = float(os.getenv('MEMBER_CACHE_PRUNE_INTERVAL', 600))  # Seconds between cache prunes
+MEMBER_FETCH_CHUNK = 1000  # Members per fetch_members page (the API maximum) and between loop yields
+MEMBER_FETCH_ONE_BY_ONE = 50  # resolve() fetches up to this many missing members individually, else streams
+
+
+def lazy_members():
+    return MEMBER_CACHE_POLICY == 'onboarding'
+
+
+def client_options(intents):
+    """Bot keyword arguments for the member cache policy"""
+    if not lazy_members():
+        return {}
+    # Members still arrive through join and update events; the startup chunk of everyone is skipped
+    return {'chunk_guilds_at_startup': False, 'member_cache_flags': discord.MemberCacheFlags.from_intents(intents)}
+
+
+class MemberCache:
+    """Looks members up by id: gateway cache, then an LRU of fetched members, then the API.
+
+    Under the 'full' policy the gateway cache holds everyone, so a miss means
+    the member left. Under 'onboarding' guilds are never chunked: members
+    that hold neither the Unverified role nor a pending role grant are pruned
+    from the gateway cache, and anyone else is fetched when needed and kept in
+    a bounded LRU, so memory no longer grows with the size of the guild.
+    Bulk work streams members from the API in pages via iter_members().
+    """
+
+    def __init__(self, size=MEMBER_LRU_SIZE):
+        self.size = max(1, size)
+        self.bot = None
+        self._lru = OrderedDict()  # (guild id, member id) -> Member, least recently used first
+        self._task = None
+        self._seen_hooks = []  # callables(member) told about every member looked up or released
+        self.pruned = 0
+
+    def __len__(self):
+        return len(self._lru)
+
+    def bind(self, bot):
+        self.bot = bot
+        if lazy_members():
+            bot.add_listener(self._on_member_update, 'on_member_update')
+        bot.add_listener(self._on_raw_member_remove, 'on_raw_member_remove')
+
+    def on_member_seen(self, callback):
+        """Call callback(member) with the current Member whenever one is looked up or released.
+
+        Role updates of members outside the gateway cache are not dispatched
+        as on_member_update, so this is how indexes catch up with them.
+        """
+        self._seen_hooks.append(callback)
+
+    def _seen(self, member):
+        if lazy_members():
+            for callback in self._seen_hooks:
+                callback(member)
+        return member
+
+    def start(self):
+        if lazy_members() and self._task is None:
+            self._task = asyncio.create_task(self._prune_loop())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def get(self, guild, member_id):
+        """The member with member_id, or None if they are not in guild"""
+        member = guild.get_member(member_id)
+        if member is not None:
+            MEMBER_LOOKUPS.inc(result='cache')
+            return self._seen(member)
+        key = (guild.id, member_id)
+        member = self._lru.get(key)
+        if member is not None:
+            # Seen when it was stored; the fresher gateway copy wins whenever there is one
+            self._lru.move_to_end(key)
+            MEMBER_LOOKUPS.inc(result='lru')
+            return member
+        if not lazy_members():
+            MEMBER_LOOKUPS.inc(result='missing')
+            return None
+        try:
+            member = await guild.fetch_member(member_id)
+        except discord.NotFound:
+            MEMBER_LOOKUPS.inc(result='missing')
+            return None
+        MEMBER_LOOKUPS.inc(result='fetched')
+        self._remember(member)
+        return self._seen(member)
+
+    async def resolve(self, guild, member_ids):
+        """Members for member_ids that are still in guild, in a page stream when many must be fetched"""
+        found, missing = [], set()
+        for member_id in member_ids:
+            member = guild.get_member(member_id)
+            if member is not None:
+                found.append(self._seen(member))
+                continue
+            member = self._lru.get((guild.id, member_id))
+            if member is not None:
+                found.append(member)
+            else:
+                missing.add(member_id)
+        if not missing or not lazy_members():
+            return found
+        if len(missing) <= MEMBER_FETCH_ONE_BY_ONE:
+            for member_id in missing:
+                member = await self.get(guild, member_id)
+                if member is not None:
+                    found.append(member)
+            return found
+        async for member in self.iter_members(guild):
+            if member.id in missing:
+                found.append(self._seen(member))
+        return found
+
+    async def iter_members(self, guild):
+        """Every member of guild: from the cache under 'full', else streamed from the API page by page"""
+        if not lazy_members():
+            for index, member in enumerate(list(guild.members), 1):
+                yield member
+                if index % MEMBER_FETCH_CHUNK == 0:
+                    await asyncio.sleep(0)
+            return
+        # Streamed members are not cached, so a full sweep costs one page of memory
+        async for member in guild.fetch_members(limit=None):
+            yield member
+
+    def wanted(self, member):
+        """Whether the onboarding policy keeps member in the gateway cache"""
+        if self.bot and self.bot.user and member.id == self.bot.user.id:
+            return True
+        unverified_role_id = get_settings(member.guild.id).unverified_role_id
+        if unverified_role_id and member.get_role(unverified_role_id) is not None:
+            return True
+        welcome = self.bot.get_cog('Welcome') if self.bot else None
+        state = welcome.state(member.guild.id) if welcome else None
+        return bool(state and member.id in state.role_scheduler)
+
+    def release(self, member):
+        """Move member from the gateway cache to the LRU once onboarding no longer needs it"""
+        if not lazy_members():
+            return
+        # Members re-added to the cache by an undispatched update carry roles no index has seen
+        self._seen(member)
+        if self.wanted(member):
+            return
+        guild = member.guild
+        if guild.get_member(member.id) is not None:
+            guild._remove_member(member)
+            self.pruned += 1
+        self._remember(member)
+
+    def prune(self, guild):
+        """Release every cached member of guild the policy does not keep"""
+        before = self.pruned
+        for member in list(guild.members):
+            self.release(member)
+        return self.pruned - before
+
+    def _remember(self, member):
+        key = (member.guild.id, member.id)
+        self._lru[key] = member
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.size:
+            self._lru.popitem(last=False)
+
+    def forget(self, guild_id, member_id):
+        self._lru.pop((guild_id, member_id), None)
+
+    async def _prune_loop(self):
+        # Member update events for uncached members add them to the cache; sweep them out periodically
+        while True:
+            await asyncio.sleep(MEMBER_CACHE_PRUNE_INTERVAL)
+            for guild in list(self.bot.guilds):
+                try:
+                    pruned = self.prune(guild)
+                except Exception as e:
+                    log.error("Member cache prune failed for guild %s: %s", guild.id, e)
+                    continue
+                if pruned:
+                    log.info("Pruned %s members from the cache of %s (%s cached)", pruned, guild.id, len(guild.members))
+
+    async def _on_member_update(self, before, after):
+        # The bot's own grant echoing back is usually what ends a member's onboarding
+        self.release(after)
+
+    async def _on_raw_member_remove(self, payload):
+        self.forget(payload.guild_id, payload.user.id)
+
+
+member_cache = MemberCache()
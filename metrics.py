@@ -0,0 +1,271 @@
+import asyncio
+import bisect
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 9108))  # 0 disables the exporter
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()  # Storage writes report from the I/O thread
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def collect(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}')
+        return lines
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    """Gauge set directly or read from a callback at scrape time"""
+
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._functions = {}
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, func, **labels):
+        self._functions[self._key(labels)] = func
+
+    def collect(self):
+        for key, func in list(self._functions.items()):
+            try:
+                value = func()
+            except Exception as e:
+                logging.debug(f"Gauge {self.name} callback failed: {e}")
+                continue
+            with self._lock:
+                self._values[key] = value
+        return super().collect()
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def collect(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        with self._lock:
+            items = sorted((key, [list(state[0]), state[1], state[2]]) for key, state in self._values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def counter(name, documentation, labelnames=()):
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name, documentation, labelnames=()):
+    return REGISTRY.register(Gauge(name, documentation, labelnames))
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+# Gatekeeper metrics
+JOINS_PROCESSED = counter('gatekeeper_joins_processed_total', 'Member joins processed by the join pipeline', ['result'])
+BUTTON_CLICKS = counter('gatekeeper_button_clicks_total', 'Onboarding button clicks', ['result'])
+ROLE_CHANGES = counter('gatekeeper_role_changes_total', 'Roles granted or removed by the bot', ['role', 'action'])
+DISCORD_REQUEST_SECONDS = histogram('gatekeeper_discord_request_seconds', 'Discord REST request latency per route', ['method', 'route'])
+DISCORD_RESPONSES = counter('gatekeeper_discord_responses_total', 'Discord REST responses per route and status', ['method', 'route', 'status'])
+DISCORD_RATE_LIMITS = counter('gatekeeper_discord_rate_limits_total', 'Discord REST 429 responses per route', ['method', 'route'])
+STORAGE_WRITE_SECONDS = histogram('gatekeeper_storage_write_seconds', 'Disk write latency', ['kind'])
+ROLE_ASSIGNMENT_QUEUE = gauge('gatekeeper_role_assignment_queue_depth', 'Pending delayed member role grants')
+JOIN_QUEUE = gauge('gatekeeper_join_queue_depth', 'Member joins waiting in the join pipeline')
+JOIN_LAG = gauge('gatekeeper_join_lag_seconds', 'Queue wait of the most recently processed join')
+LOG_SINK_QUEUE = gauge('gatekeeper_log_sink_queue_depth', 'Embeds waiting to be sent to the logs channel')
+LOG_SINK_DROPPED = counter('gatekeeper_log_sink_dropped_total', 'Embeds dropped because the log queue was full')
+DAILY_TRANSITIONS = counter('gatekeeper_daily_access_transitions_total', 'Daily access channel open/close transitions applied', ['state'])
+UPTIME = gauge('gatekeeper_uptime_seconds', 'Seconds since the metrics module was loaded')
+LOOP_LAG_SECONDS = histogram('gatekeeper_loop_lag_seconds', 'How late the event loop wakes a short sleep',
+                             buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 3.0))
+LOOP_STALLS = counter('gatekeeper_loop_stalls_total', 'Times the event loop was blocked past PERF_STALL_MS', ['handler'])
+HANDLER_SECONDS = histogram('gatekeeper_handler_seconds', 'Duration of tracked event handlers and commands', ['handler'])
+MEMBER_LOOKUPS = counter('gatekeeper_member_lookups_total', 'Member lookups by id, by where the member was found', ['result'])
+CACHED_MEMBERS = gauge('gatekeeper_cached_members', 'Members held in the gateway cache and the fetched-member LRU')
+ERRORS_REPORTED = counter('gatekeeper_errors_reported_total', 'Critical errors reported to owners, sent at once or batched into a digest', ['result'])
+
+_started = time.monotonic()
+UPTIME.set_function(lambda: round(time.monotonic() - _started, 1))
+
+
+_SNOWFLAKE = re.compile(r'/\d{15,}')
+_API_PREFIX = re.compile(r'^/api/v\d+')
+_WEBHOOK_TOKEN = re.compile(r'(/webhooks/\{id\})/[^/]+')
+
+
+def route_label(path):
+    """Collapse IDs and tokens out of a Discord API path so labels stay bounded"""
+    path = _API_PREFIX.sub('', path)
+    path = _SNOWFLAKE.sub('/{id}', path)
+    return _WEBHOOK_TOKEN.sub(r'\1/{token}', path)
+
+
+def discord_trace_config():
+    """aiohttp TraceConfig that times every Discord REST request and counts 429s"""
+    import aiohttp
+
+    async def on_request_start(session, context, params):
+        context.started = time.perf_counter()
+
+    async def on_request_end(session, context, params):
+        route = route_label(params.url.path)
+        DISCORD_REQUEST_SECONDS.observe(time.perf_counter() - context.started, method=params.method, route=route)
+        status = params.response.status
+        DISCORD_RESPONSES.inc(method=params.method, route=route, status=status)
+        if status == 429:
+            DISCORD_RATE_LIMITS.inc(method=params.method, route=route)
+
+    async def on_request_exception(session, context, params):
+        route = route_label(params.url.path)
+        DISCORD_REQUEST_SECONDS.observe(time.perf_counter() - context.started, method=params.method, route=route)
+        DISCORD_RESPONSES.inc(method=params.method, route=route, status='error')
+
+    trace = aiohttp.TraceConfig()
+    trace.on_request_start.append(on_request_start)
+    trace.on_request_end.append(on_request_end)
+    trace.on_request_exception.append(on_request_exception)
+    return trace
+
+
+async def _handle_scrape(reader, writer):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        # Drain the headers; the exporter only cares about the request line
+        while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b'\r\n', b'\n', b''):
+            pass
+        parts = request_line.decode('latin-1').split()
+        if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+            status, body = '200 OK', REGISTRY.render().encode()
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        else:
+            status, body, content_type = '404 Not Found', b'Not Found\n', 'text/plain'
+        writer.write(
+            f'HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n'
+            f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode() + body
+        )
+        await writer.drain()
+    except Exception as e:
+        logging.debug(f"Metrics scrape failed: {e}")
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT):
+    """Serve GET /metrics in Prometheus text format; returns the server or None when disabled"""
+    if not port:
+        return None
+    try:
+        server = await asyncio.start_server(_handle_scrape, host, port)
+    except OSError as e:
+        logging.error(f"Could not start metrics exporter on {host}:{port}: {e}")
+        return None
+    logging.info(f"Metrics exporter listening on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,245 @@
+import csv
+import gzip
+import io
+import itertools
+import json
+import logging
+import os
+import time
+from datetime import datetime
+
+from storage import USER_FIELDS, BOOL_FIELDS, STORAGE_PAGE_SIZE
+from utils import run_blocking_io
+
+log = logging.getLogger('gatekeeper.onboarding_io')
+
+EXPORT_FIELDS = ('user_id',) + USER_FIELDS
+FORMATS = ('csv', 'ndjson')
+IMPORT_MAX_BYTES = int(os.getenv('IMPORT_MAX_BYTES', 100 * 1024 * 1024))  # Largest attachment /import_onboarding accepts
+DOWNLOAD_CHUNK = 64 * 1024
+MAX_REPORTED_ERRORS = 10  # Bad rows described in the import result; the rest are only counted
+
+# Named filters for the commands, as storage page() arguments
+STATUS_FILTERS = {
+    'all': {},
+    'pending': {'clicked': True, 'has_access': False, 'role_assigned': False},
+    'verified': {'has_access': True},
+    'not_clicked': {'clicked': False},
+    'unverified': {'unverified_role_assigned': True},
+}
+
+_TRUE = {'1', 'true', 'yes', 'y', 't'}
+_FALSE = {'0', 'false', 'no', 'n', 'f', ''}
+
+
+def detect_format(filename):
+    """'csv' or 'ndjson' from a file name, ignoring a trailing .gz"""
+    name = filename.lower()
+    if name.endswith('.gz'):
+        name = name[:-3]
+    if name.endswith('.csv'):
+        return 'csv'
+    if name.endswith(('.ndjson', '.jsonl', '.json')):
+        return 'ndjson'
+    return None
+
+
+def matches(record, clicked=None, joined_since=None, **state):
+    """Python twin of UserStore.page()'s filters, for rows being imported"""
+    if clicked is not None and bool(record.get('button_clicked_at')) != clicked:
+        return False
+    if joined_since is not None and (record.get('joined_at') or 0) < joined_since:
+        return False
+    return all(bool(record.get(field)) == value for field, value in state.items())
+
+
+def parse_record(row):
+    """Validate one imported row into {'user_id': int, field: value, ...}; absent columns are left out"""
+    raw_id = str(row.get('user_id', '')).strip()
+    if not raw_id.isdigit() or int(raw_id) <= 0:
+        raise ValueError(f"invalid user_id {raw_id!r}")
+    record = {'user_id': int(raw_id)}
+    for field in USER_FIELDS:
+        value = row.get(field)
+        if value is None:
+            continue
+        if field in BOOL_FIELDS:
+            record[field] = _parse_bool(field, value)
+        else:
+            record[field] = _parse_timestamp(field, value)
+    return record
+
+
+def _parse_bool(field, value):
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in _TRUE:
+        return True
+    if text in _FALSE:
+        return False
+    raise ValueError(f"invalid {field} {value!r}")
+
+
+def _parse_timestamp(field, value):
+    """Unix seconds, or an ISO 8601 date as spreadsheets tend to produce"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    text = str(value).strip()
+    if not text:
+        return 0
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(text.replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        raise ValueError(f"invalid {field} {value!r}") from None
+
+
+def _open_text(path, mode, compress=None):
+    """Open path as text; compress=None sniffs the gzip magic bytes (reading only)"""
+    if compress is None:
+        with open(path, 'rb') as f:
+            compress = f.read(2) == b'\x1f\x8b'
+    if compress:
+        return gzip.open(path, mode + 't', encoding='utf-8', newline='')
+    return open(path, mode, encoding='utf-8', newline='')
+
+
+def _rows(handle, fmt):
+    """(line number, row dict or None) for every row; None marks a line that is not valid JSON"""
+    if fmt == 'csv':
+        reader = csv.DictReader(handle)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_no, line in enumerate(handle, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield line_no, row if isinstance(row, dict) else None
+
+
+def _take(rows, count):
+    return list(itertools.islice(rows, count))
+
+
+class ImportResult:
+    """Counters for an import run"""
+
+    def __init__(self):
+        self.imported = 0
+        self.skipped = 0  # Valid rows the filters excluded
+        self.invalid = 0
+        self.errors = []  # The first MAX_REPORTED_ERRORS problems, as "line N: reason"
+        self.started_at = time.monotonic()
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started_at
+
+    def summary(self):
+        return f"{self.imported} imported, {self.skipped} filtered out, {self.invalid} invalid"
+
+    def reject(self, line_no, reason):
+        self.invalid += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(f"line {line_no}: {reason}")
+
+
+async def export_users(store, path, fmt='csv', compress=True, on_progress=None, **filters):
+    """Write the users matching filters to path, one store page at a time; returns the row count.
+
+    Pages come from the store in user id order and are encoded on the loop,
+    then written (and gzipped) on the storage executor, so memory holds one
+    page and the loop never waits on the disk.
+    """
+    handle = await run_blocking_io(_open_text, path, 'w', compress)
+    exported = 0
+    try:
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS) if fmt == 'csv' else None
+        if writer:
+            writer.writeheader()
+        async for record in store.aiter_users(**filters):
+            if writer:
+                writer.writerow(record)
+            else:
+                buffer.write(json.dumps(record) + '\n')
+            exported += 1
+            if exported % STORAGE_PAGE_SIZE == 0:
+                await run_blocking_io(handle.write, buffer.getvalue())
+                buffer.seek(0)
+                buffer.truncate()
+                if on_progress:
+                    await on_progress(exported)
+        await run_blocking_io(handle.write, buffer.getvalue())
+    finally:
+        await run_blocking_io(handle.close)
+    return exported
+
+
+async def import_users(store, path, fmt, on_progress=None, **filters):
+    """Upsert the rows of a CSV or NDJSON file (gzipped or not) into store, a page at a time.
+
+    Only the columns present in the file are written, so a file with just
+    user_id and has_access updates that flag and leaves the rest alone.
+    Rows failing validation are counted and skipped, not fatal.
+    """
+    result = ImportResult()
+    handle = await run_blocking_io(_open_text, path, 'r')
+    try:
+        rows = _rows(handle, fmt)
+        while True:
+            # Parsing and decompression happen on the storage executor
+            chunk = await run_blocking_io(_take, rows, STORAGE_PAGE_SIZE)
+            if not chunk:
+                break
+            for line_no, row in chunk:
+                if row is None:
+                    result.reject(line_no, "not a JSON object")
+                    continue
+                try:
+                    record = parse_record(row)
+                except ValueError as e:
+                    result.reject(line_no, str(e))
+                    continue
+                if filters and not matches(record, **filters):
+                    result.skipped += 1
+                    continue
+                user_id = record.pop('user_id')
+                store.upsert(user_id, **record)
+                result.imported += 1
+            await store.aflush()
+            if on_progress:
+                await on_progress(result)
+    finally:
+        await run_blocking_io(handle.close)
+    log.info("Imported onboarding data from %s: %s", path, result.summary())
+    return result
+
+
+async def download(url, path, max_bytes=IMPORT_MAX_BYTES):
+    """Stream url to path in chunks instead of reading the attachment into memory"""
+    import aiohttp
+
+    received = 0
+    handle = await run_blocking_io(open, path, 'wb')
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.get(url) as response:
+                response.raise_for_status()
+                async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK):
+                    received += len(chunk)
+                    if received > max_bytes:
+                        raise ValueError(f"file is larger than {max_bytes // (1024 * 1024)} MB")
+                    await run_blocking_io(handle.write, chunk)
+    finally:
+        await run_blocking_io(handle.close)
+    return received
@@ -0,0 +1,220 @@
+import asyncio
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from contextlib import contextmanager
+
+from metrics import LOOP_LAG_SECONDS, HANDLER_SECONDS, LOOP_STALLS
+
+PERF_SLOW_CALLBACK_MS = float(os.getenv('PERF_SLOW_CALLBACK_MS', 1000))  # Handlers slower than this are recorded
+PERF_STALL_MS = float(os.getenv('PERF_STALL_MS', 100))  # Loop blocked this long gets a stack sample
+PERF_SAMPLE_INTERVAL = float(os.getenv('PERF_SAMPLE_INTERVAL', 0.05))
+RECENT_LAG_SAMPLES = 1200  # About a minute of lag samples at the default interval
+RECENT_EVENTS = 50
+STACK_DEPTH = 12
+
+_PROJECT_DIRS = ('cogs', 'commands')
+
+
+class HandlerStats:
+    __slots__ = ('tag', 'calls', 'slow', 'total', 'max', 'last_slow_at')
+
+    def __init__(self, tag):
+        self.tag = tag
+        self.calls = 0
+        self.slow = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last_slow_at = None
+
+    @property
+    def mean(self):
+        return self.total / self.calls if self.calls else 0.0
+
+
+class PerfMonitor:
+    """Samples event loop lag and records slow handlers and loop stalls.
+
+    A task on the loop records how late each short sleep wakes up. A daemon
+    thread watches the same heartbeat; when the loop has not ticked for
+    stall_ms it grabs the loop thread's stack, so the code that is blocking the
+    loop is captured while it is still running. Handlers wrapped with track()
+    are timed, and anything slower than slow_ms is kept with its cog/command tag.
+    """
+
+    def __init__(self, slow_ms=PERF_SLOW_CALLBACK_MS, stall_ms=PERF_STALL_MS, interval=PERF_SAMPLE_INTERVAL):
+        self.slow_threshold = slow_ms / 1000
+        self.stall_threshold = stall_ms / 1000
+        self.interval = interval
+        self.handlers = {}
+        self.lag_samples = deque(maxlen=RECENT_LAG_SAMPLES)
+        self.slow_calls = deque(maxlen=RECENT_EVENTS)  # (when, tag, seconds)
+        self.stalls = deque(maxlen=RECENT_EVENTS)  # (when, tag, seconds, stack lines)
+        self._active = {}  # task -> tag of the tracked handler it is running
+        self._loop = None
+        self._loop_thread = None
+        self._heartbeat = time.monotonic()
+        self._task = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._sample_lag())
+        self._thread = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        self._stop.set()
+
+    async def _sample_lag(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self._heartbeat = time.monotonic()
+            lag = max(0.0, loop.time() - started - self.interval)
+            self.lag_samples.append(lag)
+            LOOP_LAG_SECONDS.observe(lag)
+
+    def _watch(self):
+        sampled_heartbeat = None
+        while not self._stop.wait(self.interval):
+            heartbeat = self._heartbeat
+            blocked = time.monotonic() - heartbeat - self.interval
+            if blocked < self.stall_threshold or heartbeat == sampled_heartbeat:
+                continue
+            # One sample per stall: the heartbeat only moves once the loop runs again
+            sampled_heartbeat = heartbeat
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            stack = traceback.format_list(traceback.extract_stack(frame)[-STACK_DEPTH:])
+            tag = self._active.get(self._current_task()) or _tag_from_stack(stack)
+            self.stalls.append((time.time(), tag, blocked, stack))
+            LOOP_STALLS.inc(handler=tag)
+            logging.warning(f"Event loop blocked for at least {blocked * 1000:.0f}ms in {tag}:\n{''.join(stack[-4:])}")
+
+    def _current_task(self):
+        try:
+            return asyncio.current_task(self._loop)
+        except RuntimeError:
+            return None
+
+    def record(self, tag, seconds):
+        stats = self.handlers.get(tag)
+        if stats is None:
+            stats = self.handlers[tag] = HandlerStats(tag)
+        stats.calls += 1
+        stats.total += seconds
+        stats.max = max(stats.max, seconds)
+        HANDLER_SECONDS.observe(seconds, handler=tag)
+        if seconds >= self.slow_threshold:
+            stats.slow += 1
+            stats.last_slow_at = time.time()
+            self.slow_calls.append((time.time(), tag, seconds))
+            logging.warning(f"Slow handler {tag}: {seconds * 1000:.0f}ms")
+
+    def track(self, tag):
+        """Decorator timing an async handler under tag (e.g. 'Welcome.on_member_join')"""
+        def decorator(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                task = asyncio.current_task()
+                previous = self._active.get(task)
+                self._active[task] = tag
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    self.record(tag, time.perf_counter() - started)
+                    if previous is None:
+                        self._active.pop(task, None)
+                    else:
+                        self._active[task] = previous
+            return wrapper
+        return decorator
+
+    def instrument_tree(self, tree):
+        """Time every registered slash command as 'command:/name'"""
+        for command in tree.walk_commands():
+            callback = getattr(command, '_callback', None)
+            if callback is None or getattr(callback, '__perf_tracked__', False):
+                continue
+            wrapped = self.track(f"command:/{command.qualified_name}")(callback)
+            wrapped.__perf_tracked__ = True
+            command._callback = wrapped
+
+    def lag_percentiles(self):
+        samples = sorted(self.lag_samples)
+        if not samples:
+            return 0.0, 0.0, 0.0
+
+        def pick(fraction):
+            return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+        return pick(0.50), pick(0.99), samples[-1]
+
+    def top_offenders(self, limit=10):
+        """Handlers ordered by slow calls, then worst duration"""
+        ranked = sorted(self.handlers.values(), key=lambda stats: (stats.slow, stats.max), reverse=True)
+        return ranked[:limit]
+
+
+class StartupTimer:
+    """Durations of the startup phases (imports, cog load, tree sync, cache fill, ...)"""
+
+    def __init__(self):
+        self.phases = []  # (name, seconds) in the order they finished
+
+    def record(self, name, seconds):
+        self.phases.append((name, seconds))
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    @property
+    def total(self):
+        return sum(seconds for _, seconds in self.phases)
+
+    def summary(self):
+        return " | ".join(f"{name} {seconds:.2f}s" for name, seconds in self.phases)
+
+
+def _tag_from_stack(stack):
+    """Name the innermost frame that belongs to a cog or command module"""
+    for entry in reversed(stack):
+        # Entries look like '  File "/path/cogs/welcome.py", line 12, in on_member_join\n    ...'
+        header = entry.strip().splitlines()[0]
+        try:
+            path = header.split('"')[1]
+            function = header.rsplit(' in ', 1)[1]
+        except IndexError:
+            continue
+        parts = path.replace('\\', '/').split('/')
+        if len(parts) >= 2 and parts[-2] in _PROJECT_DIRS:
+            return f"{parts[-2]}/{parts[-1]}:{function}"
+    return 'unknown'
+
+
+monitor = PerfMonitor()
+track = monitor.track
+startup = StartupTimer()
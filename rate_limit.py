@@ -0,0 +1,97 @@
+import time
+from collections import deque
+
+
+class CooldownLimiter:
+    """Per-key cooldown plus a global token bucket, kept entirely in memory.
+
+    Each accepted key is blocked for `cooldown` seconds. Expiries are appended
+    to time buckets `resolution` seconds wide; because the cooldown is fixed,
+    buckets are created in order and eviction only ever pops from the front,
+    so both checks and eviction are O(1) amortized. Nothing is persisted: a
+    restart simply forgets cooldowns that would have lapsed within seconds.
+
+    The global bucket refills at `global_rate` tokens per second up to
+    `global_burst`, capping how many clicks are processed per second no matter
+    how many distinct users are clicking.
+    """
+
+    def __init__(self, cooldown, global_rate=0.0, global_burst=0, resolution=1.0, clock=time.time):
+        self.cooldown = cooldown
+        self.global_rate = global_rate
+        self.global_burst = global_burst or max(1, int(global_rate))
+        self.resolution = resolution
+        self._clock = clock
+        self._last = {}  # key -> time of the accepted hit
+        self._buckets = deque()  # [slot, [keys...]] in expiry order
+        self._tokens = float(self.global_burst)
+        self._refilled_at = clock()
+        self.limited_user = 0
+        self.limited_global = 0
+
+    def __len__(self):
+        return len(self._last)
+
+    def __contains__(self, key):
+        return self.remaining(key) > 0
+
+    def acquire(self, key):
+        """Record a hit for key; returns 0.0 if allowed, else seconds until it would be"""
+        now = self._clock()
+        self._evict(now)
+
+        remaining = self._remaining(key, now)
+        if remaining > 0:
+            self.limited_user += 1
+            return remaining
+
+        if self.global_rate > 0:
+            self._refill(now)
+            if self._tokens < 1:
+                self.limited_global += 1
+                return (1 - self._tokens) / self.global_rate
+            self._tokens -= 1
+
+        self._last[key] = now
+        slot = int((now + self.cooldown) // self.resolution) + 1
+        if self._buckets and self._buckets[-1][0] >= slot:
+            self._buckets[-1][1].append(key)
+        else:
+            self._buckets.append([slot, [key]])
+        return 0.0
+
+    def remaining(self, key):
+        """Seconds left on key's cooldown, 0.0 if it has none"""
+        return self._remaining(key, self._clock())
+
+    def last_hit(self, key):
+        """Time of key's last accepted hit while its cooldown is active, else None"""
+        return self._last.get(key) if self.remaining(key) > 0 else None
+
+    def reset(self, key):
+        """Drop key's cooldown; returns True if one was active"""
+        active = self.remaining(key) > 0
+        self._last.pop(key, None)
+        return active
+
+    def _remaining(self, key, now):
+        last = self._last.get(key)
+        if last is None:
+            return 0.0
+        return max(0.0, last + self.cooldown - now)
+
+    def _refill(self, now):
+        elapsed = now - self._refilled_at
+        self._refilled_at = now
+        if elapsed > 0:
+            self._tokens = min(float(self.global_burst), self._tokens + elapsed * self.global_rate)
+
+    def _evict(self, now):
+        current = int(now // self.resolution)
+        while self._buckets and self._buckets[0][0] <= current:
+            _, keys = self._buckets.popleft()
+            for key in keys:
+                last = self._last.get(key)
+                # A key clicked again after this bucket was filled belongs to a later bucket
+                if last is not None and last + self.cooldown <= now:
+                    del self._last[key]
@@ -0,0 +1,227 @@
+import asyncio
+import logging
+import os
+import time
+
+import discord
+
+from storage import aget_user_store
+from member_cache import lazy_members
+from metrics import ROLE_CHANGES
+from role_index import role_index
+
+log = logging.getLogger('gatekeeper.reconcile')
+
+ROLE_SYNC_WORKERS = int(os.getenv('ROLE_SYNC_WORKERS', 4))
+ROLE_SYNC_RATE = float(os.getenv('ROLE_SYNC_RATE', 10))  # Role edits per second across all workers
+ROLE_SYNC_MAX_ATTEMPTS = 3
+PROGRESS_INTERVAL = 3.0  # Seconds between progress callbacks and failed-member saves
+
+
+class RoleChange:
+    """Roles to add to and remove from a single member"""
+
+    __slots__ = ('member', 'add', 'remove')
+
+    def __init__(self, member, add=(), remove=()):
+        self.member = member
+        self.add = list(add)
+        self.remove = list(remove)
+
+    async def apply(self, reason=None):
+        """Apply the change with one API call, two when a stale cached copy must be re-fetched first"""
+        if len(self.add) + len(self.remove) == 1:
+            # The dedicated add/remove role routes are atomic; prefer them for single changes
+            if self.add:
+                await self.member.add_roles(*self.add, reason=reason)
+            else:
+                await self.member.remove_roles(*self.remove, reason=reason)
+        else:
+            member = self.member
+            if lazy_members() and member.guild.get_member(member.id) is None:
+                # LRU and streamed copies can hold stale roles, and roles= writes back the whole list
+                member = await member.guild.fetch_member(member.id)
+            remove_ids = {role.id for role in self.remove}
+            roles = [role for role in member.roles[1:] if role.id not in remove_ids]
+            roles.extend(role for role in self.add if role not in roles)
+            await member.edit(roles=roles, reason=reason)
+        role_index.note_change(
+            self.member.guild.id, self.member.id,
+            added=[role.id for role in self.add], removed=[role.id for role in self.remove]
+        )
+        for role in self.add:
+            ROLE_CHANGES.inc(role=role.name, action='grant')
+        for role in self.remove:
+            ROLE_CHANGES.inc(role=role.name, action='remove')
+
+
+def plan_role_changes(members, add=(), remove=(), predicate=None):
+    """Diff desired against actual roles for every member passing predicate.
+
+    Only members that are actually missing a role in add, or holding a role in
+    remove, get a RoleChange, so members already in the desired state cost
+    nothing when the plan is applied.
+    """
+    changes = []
+    for member in members:
+        if predicate and not predicate(member):
+            continue
+        role_ids = {role.id for role in member.roles}
+        to_add = [role for role in add if role.id not in role_ids]
+        to_remove = [role for role in remove if role.id in role_ids]
+        if to_add or to_remove:
+            changes.append(RoleChange(member, to_add, to_remove))
+    return changes
+
+
+class ReconcileProgress:
+    """Live counters for a reconciliation run"""
+
+    def __init__(self, total, retried=0):
+        self.total = total
+        self.retried = retried  # Changes that failed in an earlier run and were queued first
+        self.done = 0
+        self.failed = 0
+        self.gone = 0  # Members that left before their change was applied
+        self.applied = []  # Members whose change succeeded
+        self.started_at = time.monotonic()
+        self.finished = False
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started_at
+
+    @property
+    def rate(self):
+        return self.done / self.elapsed if self.elapsed > 0 else 0.0
+
+    def summary(self):
+        return (
+            f"{self.done}/{self.total} processed, {len(self.applied)} changed, "
+            f"{self.failed} failed, {self.gone} left the server ({self.rate:.1f}/s)"
+        )
+
+
+class _Pacer:
+    """Spaces requests evenly and lets a 429 pause every worker at once"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+
+    async def wait(self):
+        now = time.monotonic()
+        slot = max(now, self._next)
+        self._next = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def pause(self, seconds):
+        self._next = max(self._next, time.monotonic() + seconds)
+
+
+class RoleReconciler:
+    """Apply a list of RoleChange objects through a bounded worker pool.
+
+    Requests are paced to ROLE_SYNC_RATE so the guild-wide member route bucket
+    is not drained by one sweep, and 429s back off every worker. The changes
+    are a diff against live member state, so a run that was interrupted needs
+    no position to resume from: the next run simply plans what is still left.
+    Members whose edit failed (or was still pending when the run stopped) are
+    saved under the run's name and go to the front of the next run's queue.
+    """
+
+    def __init__(self, name, changes, workers=ROLE_SYNC_WORKERS, rate=ROLE_SYNC_RATE,
+                 reason=None, on_progress=None, progress_interval=PROGRESS_INTERVAL):
+        self.name = name
+        self.changes = sorted(changes, key=lambda change: change.member.id)
+        self.workers = max(1, workers)
+        self.reason = reason
+        self.on_progress = on_progress
+        self.progress_interval = progress_interval
+        self._pacer = _Pacer(rate)
+        self._failed_key = f'reconcile:{name}:failed'
+        self._failed = set()
+        self._completed = set()
+        self.progress = None
+
+    async def run(self):
+        store = await aget_user_store(self.changes[0].member.guild.id if self.changes else None)
+        failed = await store.aget_meta(self._failed_key, '') or ''
+        retry = {int(member_id) for member_id in failed.split(',') if member_id.isdigit()}
+        # Earlier failures that still need their change go first; the rest of the plan follows in id order
+        pending = sorted(self.changes, key=lambda change: change.member.id not in retry)
+        self.progress = ReconcileProgress(len(pending), retried=sum(change.member.id in retry for change in pending))
+        if self.progress.retried:
+            log.info("%s: retrying %s members that failed in an earlier run", self.name, self.progress.retried)
+
+        queue = asyncio.Queue()
+        for change in pending:
+            queue.put_nowait(change)
+
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.workers)]
+        reporter = asyncio.create_task(self._report_loop(store))
+        try:
+            await queue.join()
+        finally:
+            for task in workers:
+                task.cancel()
+            reporter.cancel()
+            await self._save_failed(store)
+
+        self.progress.finished = True
+        await self._report()
+        return self.progress
+
+    async def _save_failed(self, store):
+        """Persist the members a later run should try first: failed ones and, if interrupted, unfinished ones"""
+        unfinished = {change.member.id for change in self.changes if change.member.id not in self._completed}
+        await store.aset_meta(self._failed_key, ','.join(map(str, sorted(self._failed | unfinished))))
+
+    async def _worker(self, queue):
+        while True:
+            change = await queue.get()
+            try:
+                await self._apply(change)
+                self._completed.add(change.member.id)
+                self.progress.done += 1
+            finally:
+                queue.task_done()
+
+    async def _apply(self, change):
+        for attempt in range(ROLE_SYNC_MAX_ATTEMPTS):
+            await self._pacer.wait()
+            try:
+                await change.apply(reason=self.reason)
+                self.progress.applied.append(change.member)
+                return
+            except discord.NotFound:
+                self.progress.gone += 1
+                return
+            except discord.HTTPException as e:
+                if e.status == 429 or e.status >= 500:
+                    backoff = 2 ** attempt
+                    self._pacer.pause(backoff)
+                    log.warning("%s: HTTP %s for %s, backing off %ss", self.name, e.status, change.member.id, backoff)
+                    continue
+                log.error("%s: failed to update roles for %s: %s", self.name, change.member.id, e)
+                break
+            except Exception as e:
+                log.error("%s: failed to update roles for %s: %s", self.name, change.member.id, e)
+                break
+        self.progress.failed += 1
+        self._failed.add(change.member.id)
+
+    async def _report_loop(self, store):
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            await self._save_failed(store)
+            await self._report()
+
+    async def _report(self):
+        if not self.on_progress:
+            return
+        try:
+            await self.on_progress(self.progress)
+        except Exception as e:
+            log.error("%s: progress callback failed: %s", self.name, e)
@@ -0,0 +1,173 @@
+import asyncio
+import logging
+
+from member_cache import member_cache, lazy_members
+
+log = logging.getLogger('gatekeeper.role_index')
+
+INDEX_BUILD_CHUNK = 5000  # Members indexed between event loop yields
+
+
+class RoleIndex:
+    """role_id -> set of member ids per guild, kept current from gateway events.
+
+    The index is built once when a guild becomes available, from the member
+    cache or, when members are not all cached, from a paged member fetch; it
+    holds ids only, so it stays small on very large guilds. It is then
+    maintained from member join/update/remove events and from the bot's own
+    role edits (note_change), so "who has role X" is a set lookup instead of
+    a scan over every member's role list. Until a guild has been built,
+    ready() is False; holds() falls back to the member's own roles and bulk
+    queries await build() first.
+    """
+
+    def __init__(self):
+        self._roles = {}  # guild id -> {role id -> set of member ids}
+        self._members = {}  # guild id -> ids of every member
+        self._ready = set()
+        self._building = {}
+
+    def bind(self, bot):
+        """Keep the index current from the bot's member and guild events"""
+        bot.add_listener(self._on_guild_available, 'on_guild_available')
+        bot.add_listener(self._on_guild_remove, 'on_guild_remove')
+        bot.add_listener(self._on_guild_remove, 'on_guild_unavailable')
+        bot.add_listener(self._on_member_join, 'on_member_join')
+        bot.add_listener(self._on_member_update, 'on_member_update')
+        bot.add_listener(self._on_raw_member_remove, 'on_raw_member_remove')
+        bot.add_listener(self._on_role_delete, 'on_guild_role_delete')
+        # Members outside the gateway cache change roles without on_member_update
+        member_cache.on_member_seen(self.refresh_member)
+
+    def ready(self, guild_id):
+        return guild_id in self._ready
+
+    def is_member(self, guild_id, member_id):
+        """Whether member_id is in the guild; only meaningful once the guild is ready()"""
+        return member_id in self._members.get(guild_id, _EMPTY)
+
+    async def build(self, guild):
+        """(Re)index every member of guild, yielding to the loop between chunks"""
+        task = self._building.get(guild.id)
+        if task is None:
+            task = self._building[guild.id] = asyncio.ensure_future(self._build(guild))
+            task.add_done_callback(lambda _: self._building.pop(guild.id, None))
+        await asyncio.shield(task)
+
+    async def _build(self, guild):
+        self._ready.discard(guild.id)
+        roles = self._roles[guild.id] = {}
+        members = self._members[guild.id] = set()
+        index = 0
+        async for member in member_cache.iter_members(guild):
+            members.add(member.id)
+            for role_id in _role_ids(member):
+                roles.setdefault(role_id, set()).add(member.id)
+            index += 1
+            if index % INDEX_BUILD_CHUNK == 0:
+                await asyncio.sleep(0)
+        self._ready.add(guild.id)
+        log.info("Role index built for %s: %s members, %s roles", guild.name, len(members), len(roles))
+
+    def members_with(self, guild_id, role_id):
+        """Ids of members holding role_id; the returned set must not be modified"""
+        return self._roles.get(guild_id, {}).get(role_id, _EMPTY)
+
+    def members_with_all(self, guild_id, *role_ids):
+        """Ids of members holding every role in role_ids, in O(smallest set)"""
+        sets = sorted((self.members_with(guild_id, role_id) for role_id in role_ids), key=len)
+        if not sets:
+            return set()
+        first, rest = sets[0], sets[1:]
+        return {member_id for member_id in first if all(member_id in other for other in rest)}
+
+    def has_role(self, guild_id, member_id, role_id):
+        return member_id in self.members_with(guild_id, role_id)
+
+    def holds(self, member, role_id):
+        """Whether member has role_id, from the index once its guild is built.
+
+        Under the onboarding cache policy the index can lag behind members
+        that left the gateway cache, so the Member object itself is asked.
+        """
+        if self.ready(member.guild.id) and not lazy_members():
+            return self.has_role(member.guild.id, member.id, role_id)
+        return member.get_role(role_id) is not None
+
+    def note_change(self, guild_id, member_id, added=(), removed=()):
+        """Record a role edit the bot made without waiting for its gateway echo"""
+        roles = self._roles.get(guild_id)
+        if roles is None:
+            return
+        for role_id in added:
+            roles.setdefault(role_id, set()).add(member_id)
+        for role_id in removed:
+            _discard(roles, role_id, member_id)
+
+    def refresh_member(self, member):
+        """Replace member's indexed roles with the ones on the Member object"""
+        roles = self._roles.get(member.guild.id)
+        if roles is None:
+            return
+        self._members.setdefault(member.guild.id, set()).add(member.id)
+        current = _role_ids(member)
+        indexed = {role_id for role_id, members in roles.items() if member.id in members}
+        self.note_change(member.guild.id, member.id, added=current - indexed, removed=indexed - current)
+
+    def forget_member(self, guild_id, member_id):
+        self._members.get(guild_id, set()).discard(member_id)
+        roles = self._roles.get(guild_id)
+        if roles is None:
+            return
+        for role_id in [role_id for role_id, members in roles.items() if member_id in members]:
+            _discard(roles, role_id, member_id)
+
+    async def _on_guild_available(self, guild):
+        await self.build(guild)
+
+    async def _on_guild_remove(self, guild):
+        self._roles.pop(guild.id, None)
+        self._members.pop(guild.id, None)
+        self._ready.discard(guild.id)
+
+    async def _on_member_join(self, member):
+        members = self._members.get(member.guild.id)
+        if members is not None:
+            members.add(member.id)
+        self.note_change(member.guild.id, member.id, added=_role_ids(member))
+
+    async def _on_member_update(self, before, after):
+        before_ids, after_ids = _role_ids(before), _role_ids(after)
+        if before_ids != after_ids:
+            self.note_change(after.guild.id, after.id, added=after_ids - before_ids, removed=before_ids - after_ids)
+
+    async def _on_raw_member_remove(self, payload):
+        # The raw event also fires for members that were never cached
+        self.forget_member(payload.guild_id, payload.user.id)
+
+    async def _on_role_delete(self, role):
+        roles = self._roles.get(role.guild.id)
+        if roles is not None:
+            roles.pop(role.id, None)
+
+
+_EMPTY = frozenset()
+
+
+def _role_ids(member):
+    # member.roles builds and sorts Role objects; the raw id list is all the index needs
+    raw = getattr(member, '_roles', None)
+    if raw is not None:
+        return set(raw)
+    return {role.id for role in member.roles if role.id != member.guild.id}
+
+
+def _discard(roles, role_id, member_id):
+    members = roles.get(role_id)
+    if members is not None:
+        members.discard(member_id)
+        if not members:
+            del roles[role_id]
+
+
+role_index = RoleIndex()
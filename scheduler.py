@@ -0,0 +1,99 @@
+import asyncio
+import heapq
+import logging
+import time
+
+
+class DeadlineScheduler:
+    """Min-heap of (due_at, key) deadlines driven by a single sleeping task.
+
+    The task sleeps exactly until the earliest deadline and wakes early only
+    when a sooner deadline is scheduled, so there are no idle scans. Scheduling
+    and cancelling are O(log n); rescheduled or cancelled entries are skipped
+    lazily when they reach the top of the heap.
+    """
+
+    def __init__(self, handler, name="scheduler", clock=time.time):
+        self._handler = handler  # async callable(key)
+        self._name = name
+        self._clock = clock
+        self._heap = []
+        self._due = {}  # key -> current due_at; anything else in the heap is stale
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def __len__(self):
+        return len(self._due)
+
+    def __contains__(self, key):
+        return key in self._due
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def next_due(self):
+        """Return the earliest live deadline, or None when nothing is scheduled"""
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def schedule(self, key, due_at):
+        """Schedule (or reschedule) key to fire at due_at"""
+        self._due[key] = due_at
+        heapq.heappush(self._heap, (due_at, key))
+        if self._heap[0] == (due_at, key):
+            self._wakeup.set()
+        # Keep the heap from filling up with stale entries after many reschedules
+        if len(self._heap) > 2 * len(self._due) + 64:
+            self._heap = [(due, k) for k, due in self._due.items()]
+            heapq.heapify(self._heap)
+
+    def cancel(self, key):
+        """Forget a pending deadline; returns True if one was scheduled"""
+        return self._due.pop(key, None) is not None
+
+    def clear(self):
+        self._due.clear()
+        self._heap.clear()
+        self._wakeup.set()
+
+    def start(self):
+        if not self.running:
+            self._task = asyncio.create_task(self._run())
+        return self._task
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def _drop_stale(self):
+        while self._heap:
+            due_at, key = self._heap[0]
+            if self._due.get(key) == due_at:
+                return
+            heapq.heappop(self._heap)
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            self._drop_stale()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+
+            due_at, key = self._heap[0]
+            delay = due_at - self._clock()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._heap)
+            del self._due[key]
+            try:
+                await self._handler(key)
+            except Exception as e:
+                logging.error(f"Error in {self._name} handler for {key}: {e}")
@@ -0,0 +1,587 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+from utils import run_blocking_io
+from config import guild_state_path
+from metrics import STORAGE_WRITE_SECONDS
+
+log = logging.getLogger('gatekeeper.storage')
+
+DATABASE_FILE = os.getenv('DATABASE_FILE', 'gatekeeper.db')
+LEGACY_USER_DATA_FILE = 'user_data.json'
+
+# Write-behind durability knobs: dirty records are flushed at most this many
+# seconds after they change, or immediately once this many users are dirty
+STORAGE_FLUSH_DELAY = float(os.getenv('STORAGE_FLUSH_DELAY', 1.0))
+STORAGE_MAX_DIRTY = int(os.getenv('STORAGE_MAX_DIRTY', 500))
+STORAGE_PAGE_SIZE = 1000  # Users per page when streaming the table
+
+# Column order used for full-record writes and exports
+USER_FIELDS = ('joined_at', 'button_clicked_at', 'has_access', 'role_assigned', 'unverified_role_assigned')
+BOOL_FIELDS = {'has_access', 'role_assigned', 'unverified_role_assigned'}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    joined_at REAL NOT NULL DEFAULT 0,
+    button_clicked_at REAL NOT NULL DEFAULT 0,
+    has_access INTEGER NOT NULL DEFAULT 0,
+    role_assigned INTEGER NOT NULL DEFAULT 0,
+    unverified_role_assigned INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_users_pending ON users(button_clicked_at)
+    WHERE button_clicked_at > 0 AND has_access = 0 AND role_assigned = 0;
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def _row_to_record(row):
+    """Convert a sqlite row into the user record dict used by the cogs"""
+    record = {'user_id': row['user_id']}
+    for field in USER_FIELDS:
+        value = row[field]
+        record[field] = bool(value) if field in BOOL_FIELDS else value
+    return record
+
+
+def _check_fields(fields):
+    """Reject unknown column names before they reach the SQL text"""
+    unknown = set(fields) - set(USER_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown user fields: {', '.join(sorted(unknown))}")
+
+
+def _db_value(field, value):
+    if field in BOOL_FIELDS:
+        return 1 if value else 0
+    return value or 0
+
+
+def _upsert_sql(columns):
+    if not columns:
+        return 'INSERT OR IGNORE INTO users (user_id) VALUES (?)'
+    placeholders = ', '.join('?' for _ in columns)
+    updates = ', '.join(f'{field} = excluded.{field}' for field in columns)
+    return (
+        f"INSERT INTO users (user_id, {', '.join(columns)}) VALUES (?, {placeholders}) "
+        f"ON CONFLICT(user_id) DO UPDATE SET {updates}"
+    )
+
+
+def _update_sql(columns):
+    assignments = ', '.join(f'{field} = ?' for field in columns)
+    return f'UPDATE users SET {assignments} WHERE user_id = ?'
+
+
+def _new_record(user_id):
+    record = {'user_id': int(user_id)}
+    for field in USER_FIELDS:
+        record[field] = False if field in BOOL_FIELDS else 0
+    return record
+
+
+def _apply_ops(record, ops):
+    """Replay queued (op, fields) tuples on top of a record (None = no such user)"""
+    for op, fields in ops:
+        if op == 'delete':
+            record = None
+            continue
+        if record is None:
+            if op == 'update':
+                continue
+            record = _new_record(fields.get('user_id', 0))
+        for field, value in fields.items():
+            if field in BOOL_FIELDS:
+                value = bool(value)
+            record[field] = value
+    return record
+
+
+class UserStore:
+    """SQLite (WAL) store for per-user onboarding state.
+
+    Every operation touches a single row or an indexed range, so the cost of a
+    join or button click no longer depends on how many users are stored.
+    """
+
+    def __init__(self, path=DATABASE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('PRAGMA busy_timeout=5000')
+        self._conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def get(self, user_id):
+        """Return the record for a user, or None if we have never seen them"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT * FROM users WHERE user_id = ?', (int(user_id),)
+            ).fetchone()
+        return _row_to_record(row) if row else None
+
+    def upsert(self, user_id, **fields):
+        """Insert a user or update only the given fields of an existing one"""
+        _check_fields(fields)
+        columns = list(fields)
+        values = [_db_value(field, fields[field]) for field in columns]
+        with self._lock:
+            self._conn.execute(_upsert_sql(columns), [int(user_id)] + values)
+
+    def upsert_many(self, records):
+        """Write full records ({user_id: record}) in a single transaction"""
+        rows = [
+            [int(user_id)] + [_db_value(field, record.get(field, 0)) for field in USER_FIELDS]
+            for user_id, record in records.items()
+        ]
+        if not rows:
+            return
+        sql = (
+            f"INSERT OR REPLACE INTO users (user_id, {', '.join(USER_FIELDS)}) "
+            f"VALUES (?, {', '.join('?' for _ in USER_FIELDS)})"
+        )
+        with self._lock:
+            with self._transaction():
+                self._conn.executemany(sql, rows)
+
+    def update(self, user_id, **fields):
+        """Update fields of an existing user; returns False if the user is unknown"""
+        return self.update_many([user_id], **fields) > 0
+
+    def update_many(self, user_ids, **fields):
+        """Apply the same field update to several existing users in one transaction"""
+        _check_fields(fields)
+        if not fields:
+            return 0
+        columns = list(fields)
+        values = [_db_value(field, fields[field]) for field in columns]
+        rows = [values + [int(user_id)] for user_id in user_ids]
+        if not rows:
+            return 0
+        with self._lock:
+            with self._transaction():
+                cursor = self._conn.executemany(_update_sql(columns), rows)
+        return cursor.rowcount
+
+    def delete(self, user_id):
+        return self.delete_many([user_id]) > 0
+
+    def delete_many(self, user_ids):
+        rows = [(int(user_id),) for user_id in user_ids]
+        if not rows:
+            return 0
+        with self._lock:
+            with self._transaction():
+                cursor = self._conn.executemany('DELETE FROM users WHERE user_id = ?', rows)
+        return cursor.rowcount
+
+    def apply_batch(self, batch):
+        """Replay queued operations ({user_id: [(op, fields), ...]}) in one transaction"""
+        with self._lock:
+            with self._transaction():
+                for user_id, ops in batch.items():
+                    for op, fields in ops:
+                        if op == 'delete':
+                            self._conn.execute('DELETE FROM users WHERE user_id = ?', (user_id,))
+                            continue
+                        columns = [field for field in fields if field != 'user_id']
+                        values = [_db_value(field, fields[field]) for field in columns]
+                        if op == 'upsert':
+                            self._conn.execute(_upsert_sql(columns), [user_id] + values)
+                        elif columns:
+                            self._conn.execute(_update_sql(columns), values + [user_id])
+
+    def scan_by_state(self, **state):
+        """Return all users whose boolean flags match, e.g. scan_by_state(has_access=False)"""
+        _check_fields(state)
+        where = ' AND '.join(f'{field} = ?' for field in state) or '1'
+        values = [_db_value(field, value) for field, value in state.items()]
+        with self._lock:
+            rows = self._conn.execute(f'SELECT * FROM users WHERE {where}', values).fetchall()
+        return [_row_to_record(row) for row in rows]
+
+    def scan_pending(self, due_before=None):
+        """Return users who clicked the button but have not been given access yet.
+
+        Uses the partial index on button_clicked_at, so only pending users are read.
+        """
+        sql = 'SELECT * FROM users WHERE button_clicked_at > 0 AND has_access = 0 AND role_assigned = 0'
+        values = []
+        if due_before is not None:
+            sql += ' AND button_clicked_at <= ?'
+            values.append(due_before)
+        sql += ' ORDER BY button_clicked_at'
+        with self._lock:
+            rows = self._conn.execute(sql, values).fetchall()
+        return [_row_to_record(row) for row in rows]
+
+    def all_users(self):
+        with self._lock:
+            rows = self._conn.execute('SELECT * FROM users').fetchall()
+        return [_row_to_record(row) for row in rows]
+
+    def page(self, after_id=0, limit=STORAGE_PAGE_SIZE, clicked=None, joined_since=None, **state):
+        """Up to limit users with user_id > after_id, in id order, matching the filters.
+
+        Keyset paging on the primary key: each page costs the same however
+        deep into the table it is. clicked filters on button_clicked_at being
+        set, joined_since on joined_at, and state on the boolean flags.
+        """
+        _check_fields(state)
+        where = ['user_id > ?'] + [f'{field} = ?' for field in state]
+        values = [int(after_id)] + [_db_value(field, value) for field, value in state.items()]
+        if clicked is not None:
+            where.append('button_clicked_at > 0' if clicked else 'button_clicked_at = 0')
+        if joined_since is not None:
+            where.append('joined_at >= ?')
+            values.append(joined_since)
+        sql = f"SELECT * FROM users WHERE {' AND '.join(where)} ORDER BY user_id LIMIT ?"
+        with self._lock:
+            rows = self._conn.execute(sql, values + [int(limit)]).fetchall()
+        return [_row_to_record(row) for row in rows]
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+
+    def get_meta(self, key, default=None):
+        with self._lock:
+            row = self._conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row['value'] if row else default
+
+    def set_meta(self, key, value):
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO meta (key, value) VALUES (?, ?) '
+                'ON CONFLICT(key) DO UPDATE SET value = excluded.value',
+                (key, value)
+            )
+
+    def migrate_from_json(self, filename=LEGACY_USER_DATA_FILE):
+        """One-shot import of the legacy user_data.json file"""
+        meta_key = f'migrated:{filename}'
+        if self.get_meta(meta_key) or not os.path.exists(filename):
+            return 0
+        try:
+            with open(filename, 'r') as f:
+                user_data = json.load(f)
+        except Exception as e:
+            log.error("Error reading %s for migration: %s", filename, e)
+            return 0
+
+        records = {
+            user_id: data for user_id, data in user_data.items()
+            if str(user_id).isdigit() and isinstance(data, dict)
+        }
+        self.upsert_many(records)
+        self.set_meta(meta_key, str(len(records)))
+
+        # Keep the old file around for reference, but never import it twice
+        os.replace(filename, f"{filename}.migrated")
+        log.warning("Migrated %s users from %s to %s", len(records), filename, self.path)
+        return len(records)
+
+    def _transaction(self):
+        return _Transaction(self._conn)
+
+
+class _Transaction:
+    """BEGIN/COMMIT around a batch (the connection runs in autocommit mode)"""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __enter__(self):
+        self._conn.execute('BEGIN')
+        return self._conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self._conn.execute('ROLLBACK' if exc_type else 'COMMIT')
+        return False
+
+
+class WriteBehindUserStore:
+    """Write-behind cache in front of UserStore.
+
+    Writes are queued in memory per user (consecutive writes to the same user
+    are coalesced) and flushed off the event loop in one transaction, either
+    max_flush_delay seconds after the first dirty write or as soon as max_dirty
+    users are pending. Point reads replay the queued writes over the stored row,
+    and scans flush first, so callers always see their own writes.
+
+    Code running on the event loop should use the a* read methods, which do
+    their SQLite work on the storage executor instead of the loop.
+    """
+
+    def __init__(self, store, max_flush_delay=STORAGE_FLUSH_DELAY, max_dirty=STORAGE_MAX_DIRTY):
+        self.store = store
+        self.max_flush_delay = max_flush_delay
+        self.max_dirty = max_dirty
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._dirty = {}  # user_id -> [(op, fields), ...] not yet handed to a flush
+        self._flushing = {}  # operations a flush is currently writing
+        self._dirty_event = None
+        self._full_event = None
+        self._task = None
+
+    @property
+    def dirty_count(self):
+        return len(self._dirty)
+
+    def _queue(self, user_id, op, fields=None):
+        user_id = int(user_id)
+        fields = dict(fields or {})
+        if op != 'delete':
+            _check_fields(fields)
+            fields['user_id'] = user_id
+        with self._lock:
+            ops = self._dirty.setdefault(user_id, [])
+            if op == 'delete':
+                ops[:] = [('delete', {})]
+            elif ops and (ops[-1][0] == op or (ops[-1][0] == 'upsert' and op == 'update')):
+                # Same kind of write (or an update on a row we just upserted) folds into one
+                ops[-1] = (ops[-1][0], {**ops[-1][1], **fields})
+            else:
+                ops.append((op, fields))
+            dirty_count = len(self._dirty)
+        self._schedule_flush(dirty_count)
+
+    def _schedule_flush(self, dirty_count):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No event loop (scripts, shutdown): behave as a write-through store
+            self.flush()
+            return
+        if self._task is None or self._task.done():
+            self._dirty_event = asyncio.Event()
+            self._full_event = asyncio.Event()
+            self._task = loop.create_task(self._flush_loop())
+        self._dirty_event.set()
+        if dirty_count >= self.max_dirty:
+            self._full_event.set()
+
+    async def _flush_loop(self):
+        while True:
+            await self._dirty_event.wait()
+            try:
+                await asyncio.wait_for(self._full_event.wait(), timeout=self.max_flush_delay)
+            except asyncio.TimeoutError:
+                pass
+            self._dirty_event.clear()
+            self._full_event.clear()
+            try:
+                await run_blocking_io(self.flush)
+            except Exception as e:
+                log.error("Error flushing user data: %s", e)
+            if self._dirty:
+                self._dirty_event.set()
+
+    def flush(self):
+        """Write every queued change in one transaction; returns the number of users written"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty:
+                    return 0
+                batch = self._dirty
+                self._dirty = {}
+                self._flushing = batch
+            try:
+                with STORAGE_WRITE_SECONDS.time(kind='db'):
+                    self.store.apply_batch(batch)
+            except Exception:
+                # Put the batch back in front of anything queued meanwhile
+                with self._lock:
+                    for user_id, ops in self._dirty.items():
+                        batch.setdefault(user_id, []).extend(ops)
+                    self._dirty = batch
+                    self._flushing = {}
+                raise
+            with self._lock:
+                self._flushing = {}
+            return len(batch)
+
+    def _pending_ops(self, user_id):
+        with self._lock:
+            ops = self._flushing.get(user_id, []) + self._dirty.get(user_id, [])
+        # Anything before the last delete cannot affect the result
+        for i in range(len(ops) - 1, -1, -1):
+            if ops[i][0] == 'delete':
+                return ops[i:], True
+        return ops, False
+
+    def _flushed(self, func, *args, **kwargs):
+        self.flush()
+        return func(*args, **kwargs)
+
+    def get(self, user_id):
+        user_id = int(user_id)
+        # Queued operations are plain field assignments, so replaying them over a
+        # row that a concurrent flush already committed gives the same result
+        ops, deleted = self._pending_ops(user_id)
+        if deleted:
+            return _apply_ops(None, ops)
+        return _apply_ops(self.store.get(user_id), ops)
+
+    async def aget(self, user_id):
+        user_id = int(user_id)
+        ops, deleted = self._pending_ops(user_id)
+        if deleted:
+            return _apply_ops(None, ops)
+        return _apply_ops(await run_blocking_io(self.store.get, user_id), ops)
+
+    def upsert(self, user_id, **fields):
+        self._queue(user_id, 'upsert', fields)
+
+    def upsert_many(self, records):
+        for user_id, record in records.items():
+            self._queue(user_id, 'upsert', {field: record.get(field, 0) for field in USER_FIELDS})
+
+    def update(self, user_id, **fields):
+        self._queue(user_id, 'update', fields)
+
+    def update_many(self, user_ids, **fields):
+        for user_id in user_ids:
+            self._queue(user_id, 'update', fields)
+
+    def delete(self, user_id):
+        self._queue(user_id, 'delete')
+
+    def delete_many(self, user_ids):
+        for user_id in user_ids:
+            self._queue(user_id, 'delete')
+
+    def scan_by_state(self, **state):
+        self.flush()
+        return self.store.scan_by_state(**state)
+
+    def scan_pending(self, due_before=None):
+        self.flush()
+        return self.store.scan_pending(due_before)
+
+    def all_users(self):
+        self.flush()
+        return self.store.all_users()
+
+    def count(self):
+        self.flush()
+        return self.store.count()
+
+    def page(self, after_id=0, limit=STORAGE_PAGE_SIZE, **filters):
+        self.flush()
+        return self.store.page(after_id, limit, **filters)
+
+    async def aget_meta(self, key, default=None):
+        return await run_blocking_io(self.store.get_meta, key, default)
+
+    async def aset_meta(self, key, value):
+        await run_blocking_io(self.store.set_meta, key, value)
+
+    async def aflush(self):
+        return await run_blocking_io(self.flush)
+
+    async def ascan_by_state(self, **state):
+        return await run_blocking_io(self._flushed, self.store.scan_by_state, **state)
+
+    async def ascan_pending(self, due_before=None):
+        return await run_blocking_io(self._flushed, self.store.scan_pending, due_before)
+
+    async def aall_users(self):
+        return await run_blocking_io(self._flushed, self.store.all_users)
+
+    async def acount(self):
+        return await run_blocking_io(self._flushed, self.store.count)
+
+    async def aiter_users(self, page_size=STORAGE_PAGE_SIZE, **filters):
+        """Yield every matching user a page at a time, never holding more than one page"""
+        after_id = 0
+        while True:
+            page = await run_blocking_io(self.page, after_id, page_size, **filters)
+            for record in page:
+                yield record
+            if len(page) < page_size:
+                return
+            after_id = page[-1]['user_id']
+
+    def close(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        self.flush()
+        self.store.close()
+
+    async def aclose(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        await run_blocking_io(self.close)
+
+
+_user_stores = {}  # database path -> WriteBehindUserStore
+_user_store_lock = threading.Lock()
+
+
+def get_user_store(guild_id=None):
+    """Return the user store for guild_id (GUILD_ID by default), opening it on first use.
+
+    Each guild has its own database file, so guilds never share a write
+    lock; GUILD_ID's is DATABASE_FILE and imports the legacy JSON file.
+    Opening blocks on the disk, so the cogs open their guilds' stores with
+    aget_user_store() at load time and this only hands back an open store.
+    """
+    path = guild_state_path(DATABASE_FILE, guild_id)
+    store = _user_stores.get(path)
+    if store is None:
+        store = _open_user_store(path)
+    return store
+
+
+async def aget_user_store(guild_id=None):
+    """get_user_store() that opens (and migrates) the database on the storage executor"""
+    path = guild_state_path(DATABASE_FILE, guild_id)
+    store = _user_stores.get(path)
+    if store is None:
+        store = await run_blocking_io(_open_user_store, path)
+    return store
+
+
+def _open_user_store(path):
+    with _user_store_lock:
+        store = _user_stores.get(path)
+        if store is None:
+            user_store = UserStore(path)
+            if path == DATABASE_FILE:
+                user_store.migrate_from_json()
+            store = _user_stores[path] = WriteBehindUserStore(user_store)
+    return store
+
+
+def close_user_store():
+    with _user_store_lock:
+        stores = list(_user_stores.values())
+        _user_stores.clear()
+    for store in stores:
+        store.close()
+
+
+async def aclose_user_store():
+    """Flush and close every guild's store from the event loop"""
+    with _user_store_lock:
+        stores = list(_user_stores.values())
+        _user_stores.clear()
+    for store in stores:
+        await store.aclose()
@@ -0,0 +1,55 @@
+import asyncio
+import types
+
+import reconcile
+from reconcile import RoleChange
+
+GUILD_ID = 1
+
+
+def role(role_id, name):
+    return types.SimpleNamespace(id=role_id, name=name)
+
+
+EVERYONE = role(GUILD_ID, '@everyone')
+MEMBER = role(10, 'Member')
+UNVERIFIED = role(20, 'Unverified')
+MUTED = role(30, 'Muted')
+
+
+class FakeMember:
+    def __init__(self, guild, member_id, roles):
+        self.guild = guild
+        self.id = member_id
+        self.roles = [EVERYONE] + list(roles)
+        self.edits = []
+
+    async def edit(self, roles, reason=None):
+        self.edits.append(roles)
+
+
+class FakeGuild:
+    id = GUILD_ID
+
+    def __init__(self, live):
+        self._live = live
+
+    def get_member(self, member_id):
+        return None
+
+    async def fetch_member(self, member_id):
+        return self._live[member_id]
+
+
+def test_full_edit_refetches_stale_cached_member(monkeypatch):
+    monkeypatch.setattr(reconcile, 'lazy_members', lambda: True)
+    live = {}
+    guild = FakeGuild(live)
+    # The LRU copy predates an admin granting Muted
+    stale = FakeMember(guild, 5, [MEMBER, UNVERIFIED])
+    live[5] = FakeMember(guild, 5, [MEMBER, UNVERIFIED, MUTED])
+
+    asyncio.run(RoleChange(stale, add=[role(40, 'Verified')], remove=[UNVERIFIED]).apply())
+
+    assert not stale.edits
+    assert [r.id for r in live[5].edits[0]] == [MEMBER.id, MUTED.id, 40]
@@ -0,0 +1,72 @@
+import asyncio
+import types
+
+import member_cache
+from member_cache import MemberCache
+from role_index import RoleIndex
+
+GUILD_ID = 1
+MEMBER_ROLE_ID = 10
+UNVERIFIED_ROLE_ID = 20
+
+
+class FakeMember:
+    def __init__(self, guild, member_id, role_ids):
+        self.guild = guild
+        self.id = member_id
+        self._roles = list(role_ids)
+
+    def get_role(self, role_id):
+        return role_id if role_id in self._roles else None
+
+
+class FakeGuild:
+    id = GUILD_ID
+    name = 'guild'
+
+    def __init__(self):
+        self._members = {}
+
+    @property
+    def members(self):
+        return list(self._members.values())
+
+    def get_member(self, member_id):
+        return self._members.get(member_id)
+
+    def _add_member(self, member):
+        self._members[member.id] = member
+
+    def _remove_member(self, member):
+        self._members.pop(member.id, None)
+
+    async def fetch_members(self, limit=None):
+        for member in list(self._members.values()):
+            yield member
+
+
+def test_holds_sees_role_change_of_released_member(monkeypatch):
+    monkeypatch.setattr(member_cache, 'MEMBER_CACHE_POLICY', 'onboarding')
+    settings = types.SimpleNamespace(unverified_role_id=UNVERIFIED_ROLE_ID)
+    monkeypatch.setattr(member_cache, 'get_settings', lambda guild_id=None: settings)
+
+    async def scenario():
+        guild = FakeGuild()
+        guild._add_member(FakeMember(guild, 5, [MEMBER_ROLE_ID]))
+        index = RoleIndex()
+        cache = MemberCache()
+        cache.on_member_seen(index.refresh_member)
+        await index.build(guild)
+
+        # Onboarded: dropped from the gateway cache
+        cache.release(guild.get_member(5))
+        assert guild.get_member(5) is None
+
+        # An admin removes the role; the update re-caches the member without on_member_update
+        guild._add_member(FakeMember(guild, 5, []))
+
+        member = await cache.get(guild, 5)
+        assert not index.holds(member, MEMBER_ROLE_ID)
+        assert not index.has_role(GUILD_ID, 5, MEMBER_ROLE_ID)
+
+    asyncio.run(scenario())
@@ -1,34 +1,43 @@
+import asyncio
+import functools
 import json
 import os
 import logging
 import threading
-from datetime import datetime, timezone
-import traceback
+from concurrent.futures import ThreadPoolExecutor
+from metrics import STORAGE_WRITE_SECONDS
 
 # Cross-platform file locking
 _file_locks = {}
 
+# All blocking disk work (JSON files and SQLite) runs on this executor so the
+# event loop never waits on the disk. One worker keeps writes in submit order.
+_io_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='storage-io')
+_async_file_locks = {}
+_background_writes = set()
+
 def get_file_lock(filename):
     """Get a file lock for thread safety"""
-    if filename not in _file_locks:
-        _file_locks[filename] = threading.Lock()
-    return _file_locks[filename]
+    return _file_locks.setdefault(filename, threading.Lock())
 
-def safe_json_write(filename, data):
-    """Safely write JSON data with file locking and atomic operations"""
+def get_async_file_lock(filename):
+    """Get an asyncio lock that serializes writers of a file on the event loop"""
+    lock = _async_file_locks.get(filename)
+    if lock is None:
+        lock = _async_file_locks[filename] = asyncio.Lock()
+    return lock
+
+def _atomic_write_text(filename, text):
+    """Write text to a temp file and atomically rename it over filename"""
     lock = get_file_lock(filename)
-    with lock:
+    with lock, STORAGE_WRITE_SECONDS.time(kind='json'):
+        temp_filename = f"{filename}.tmp"
         try:
-            # Use atomic write operation for better safety
-            temp_filename = f"{filename}.tmp"
             with open(temp_filename, 'w') as f:
-                json.dump(data, f, indent=2)
+                f.write(text)
             
             # Atomic rename (works on both Windows and Unix)
-            if os.path.exists(filename):
-                os.replace(temp_filename, filename)
-            else:
-                os.rename(temp_filename, filename)
+            os.replace(temp_filename, filename)
                 
         except Exception as e:
             logging.error(f"Error writing to {filename}: {e}")
@@ -40,6 +49,10 @@ def safe_json_write(filename, data):
                 pass
             raise
 
+def safe_json_write(filename, data):
+    """Safely write JSON data with file locking and atomic operations"""
+    _atomic_write_text(filename, json.dumps(data, indent=2))
+
 def safe_json_read(filename, default=None):
     """Safely read JSON data with file locking"""
     if default is None:
@@ -57,76 +70,77 @@ def safe_json_read(filename, default=None):
             return default
 
 async def report_critical_error(error_type, error_message, bot=None, interaction=None):
-    """Report critical errors to owners via logs and DM"""
+    """Report critical errors to owners via logs and DM.
+
+    Returns immediately: error_reporter deduplicates repeats into a periodic
+    digest and sends from a background task. Call it from the except block so
+    the traceback is captured.
+    """
     try:
-        # Get owner IDs from environment or main.py
-        owner_ids = []
-        try:
-            from main import OWNER_USER_IDS
-            owner_ids = list(OWNER_USER_IDS)
-        except ImportError:
-            # Fallback to environment variable
-            owner_str = os.getenv('OWNER_USER_IDS', '')
-            if owner_str:
-                owner_ids = [int(id.strip()) for id in owner_str.split(',') if id.strip().isdigit()]
-        
-        if not owner_ids:
-            logging.error("No owner IDs configured for error reporting")
-            return
-        
-        # Create error embed
-        import discord
-        error_embed = discord.Embed(
-            title=f"🚨 CRITICAL ERROR: {error_type}",
-            description=f"**Error:** {error_message}",
-            color=0xff0000,
-            timestamp=datetime.now(timezone.utc)
-        )
-        
-        # Add context information
-        if interaction:
-            error_embed.add_field(name="User", value=f"{interaction.user.mention} (`{interaction.user.id}`)", inline=True)
-            error_embed.add_field(name="Guild", value=f"{interaction.guild.name if interaction.guild else 'DM'} (`{interaction.guild.id if interaction.guild else 'N/A'}`)", inline=True)
-            error_embed.add_field(name="Channel", value=f"{interaction.channel.mention if interaction.channel else 'N/A'}", inline=True)
-        
-        # Add stack trace for debugging
-        stack_trace = traceback.format_exc()
-        if stack_trace and stack_trace != "NoneType: None\n":
-            # Truncate if too long
-            if len(stack_trace) > 1000:
-                stack_trace = stack_trace[:1000] + "..."
-            error_embed.add_field(name="Stack Trace", value=f"```{stack_trace}```", inline=False)
-        
-        error_embed.set_footer(text="AJ Trading Academy Bot - Critical Error Report")
-        
-        # Send to logs channel
-        logs_channel_id = int(os.getenv('LOGS_CHANNEL_ID', 0))
-        if logs_channel_id and bot:
-            try:
-                logs_channel = bot.get_channel(logs_channel_id)
-                if logs_channel:
-                    # Ping owners in logs
-                    owner_mentions = " ".join([f"<@{owner_id}>" for owner_id in owner_ids])
-                    await logs_channel.send(f"🚨 **CRITICAL ERROR DETECTED** {owner_mentions}", embed=error_embed)
-                    logging.error(f"Critical error reported to logs channel: {error_type} - {error_message}")
-            except Exception as e:
-                logging.error(f"Failed to send error to logs channel: {e}")
-        
-        # DM owners
-        if bot:
-            for owner_id in owner_ids:
-                try:
-                    owner = await bot.fetch_user(owner_id)
-                    if owner:
-                        await owner.send(embed=error_embed)
-                        logging.info(f"Critical error DM sent to owner {owner_id}")
-                except Exception as e:
-                    logging.error(f"Failed to DM owner {owner_id}: {e}")
-        
-        # Also log to console for immediate visibility
-        logging.critical(f"CRITICAL ERROR: {error_type} - {error_message}")
-        
+        from error_reporter import error_reporter
+        error_reporter.report(error_type, error_message, bot, interaction)
     except Exception as e:
         logging.error(f"Error in error reporting system: {e}")
         # Fallback to basic logging
         logging.critical(f"CRITICAL ERROR: {error_type} - {error_message}")
+
+async def run_blocking_io(func, *args, **kwargs):
+    """Run a blocking disk operation on the dedicated storage executor"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_io_executor, functools.partial(func, *args, **kwargs))
+
+async def async_json_read(filename, default=None):
+    """Read a JSON file without blocking the event loop"""
+    return await run_blocking_io(safe_json_read, filename, default)
+
+async def async_json_write(filename, data):
+    """Write a JSON file without blocking the event loop.
+
+    The data is serialized on the loop so the file gets a consistent snapshot
+    even if the caller keeps mutating it while the write is queued.
+    """
+    text = json.dumps(data, indent=2)
+    async with get_async_file_lock(filename):
+        await run_blocking_io(_atomic_write_text, filename, text)
+
+def write_json_in_background(filename, data):
+    """Fire-and-forget async_json_write for event handlers that must not wait on disk"""
+    task = asyncio.get_running_loop().create_task(async_json_write(filename, data))
+    _background_writes.add(task)
+    task.add_done_callback(_background_write_done)
+    return task
+
+def _background_write_done(task):
+    _background_writes.discard(task)
+    if not task.cancelled() and task.exception():
+        logging.error(f"Background write failed: {task.exception()}")
+
+def is_authorized_guild_or_owner(interaction):
+    """Check if user is authorized to use commands"""
+    from config import get_settings, is_configured_guild
+    settings = get_settings()
+    if interaction.guild and is_configured_guild(interaction.guild.id):
+        return True
+    if interaction.user.id in settings.owner_user_ids:
+        return True
+    return False
+
+async def get_or_create_welcome_message(welcome_channel, embed, view):
+    """Get message ID and edit it, or create new if needed."""
+    from config import guild_state_path
+    filename = guild_state_path('welcome_message.json', welcome_channel.guild.id)
+    data = await async_json_read(filename, {})
+    msg_id = data.get('message_id') if isinstance(data, dict) else None
+    
+    if msg_id:
+        try:
+            msg = await welcome_channel.fetch_message(msg_id)
+            await msg.edit(embed=embed, view=view)
+            return msg
+        except:
+            pass
+    
+    # Create new message only if needed
+    msg = await welcome_channel.send(embed=embed, view=view)
+    await async_json_write(filename, {'message_id': msg.id, 'channel_id': welcome_channel.id})
+    return msg
@@ -0,0 +1,161 @@
+import os
+import signal
+import subprocess
+import sys
+import time
+from multiprocessing.connection import wait
+
+from config import guild_ids
+
+WORKER_COUNT = max(1, int(os.getenv('WORKER_COUNT', 1)))  # Processes the gateway shards are split across
+WORKER_INDEX = os.getenv('WORKER_INDEX')  # Set by the supervisor for each worker it starts
+WORKER_RESTART_DELAY = float(os.getenv('WORKER_RESTART_DELAY', 5.0))
+WORKER_MAX_QUICK_FAILURES = 5  # Consecutive crashes within WORKER_MIN_UPTIME before a worker is given up on
+WORKER_MIN_UPTIME = 60.0
+WORKER_POLL_INTERVAL = 1.0  # Seconds between exit checks where processes have no exit sentinel
+
+
+def worker_index():
+    return int(WORKER_INDEX) if WORKER_INDEX is not None else 0
+
+
+def is_supervisor():
+    """True in the parent process of a multi-worker deployment, which only starts and watches workers"""
+    return WORKER_COUNT > 1 and WORKER_INDEX is None
+
+
+def shard_count():
+    """Total gateway shards: SHARD_COUNT if numeric (at least one per worker), else one per worker"""
+    raw = os.getenv('SHARD_COUNT', '').strip()
+    return max(int(raw), WORKER_COUNT) if raw.isdigit() else WORKER_COUNT
+
+
+def shard_ids(index=None):
+    """The shards a worker connects, or None when a single process runs every shard"""
+    if WORKER_COUNT == 1:
+        return None
+    index = worker_index() if index is None else index
+    return [shard for shard in range(shard_count()) if shard % WORKER_COUNT == index]
+
+
+def shard_options():
+    """Keyword arguments for the bot class: none, a shard count, or this worker's shards"""
+    if WORKER_COUNT > 1:
+        return {'shard_count': shard_count(), 'shard_ids': shard_ids()}
+    raw = os.getenv('SHARD_COUNT', '').strip()
+    return {'shard_count': int(raw)} if raw.isdigit() else {}
+
+
+def owns_guild(guild_id):
+    """Whether this worker serves guild_id; Discord puts a guild on shard (id >> 22) % shard_count"""
+    if WORKER_COUNT == 1:
+        return True
+    return (guild_id >> 22) % shard_count() in shard_ids()
+
+
+def owned_guild_ids():
+    """The configured guilds this worker serves, and so the only ones whose state it touches"""
+    return tuple(guild_id for guild_id in guild_ids() if owns_guild(guild_id))
+
+
+def supervise(argv):
+    """Run WORKER_COUNT copies of the bot, one per shard subset, restarting any that crash.
+
+    Every guild lives on exactly one shard, so each worker owns its guilds'
+    database, join log and schedule files outright. Each worker gets its own
+    log file and metrics port so they don't share a file or a socket.
+    """
+    base_port = int(os.getenv('METRICS_PORT', 9108))
+    log_root, log_ext = os.path.splitext(os.getenv('LOG_FILE', 'bot.log'))
+    workers = {}  # index -> (process, started_at, exit sentinel or None)
+    restarts = {}  # index -> monotonic time a crashed worker is started again
+    quick_failures = {}
+    stopping = False
+    # Signal handlers write here so a wait on the workers returns at once
+    wake_read, wake_write = os.pipe()
+
+    def spawn(index):
+        env = dict(os.environ, WORKER_INDEX=str(index), LOG_FILE=f"{log_root}.worker{index}{log_ext}")
+        if base_port:
+            env['METRICS_PORT'] = str(base_port + index)
+        process = subprocess.Popen([sys.executable] + argv, env=env, stdin=subprocess.DEVNULL)
+        workers[index] = (process, time.monotonic(), _exit_sentinel(process))
+        print(f"👷 Worker {index} started (pid {process.pid}, shards {shard_ids(index)})")
+
+    def stop(signum, frame):
+        nonlocal stopping
+        if not stopping:
+            # One SIGTERM per worker: a second signal would interrupt discord.py's shutdown before the
+            # write-behind flush, and a terminal Ctrl-C has already reached workers in our process group
+            for process, _, _ in workers.values():
+                if process.poll() is None and not (signum == signal.SIGINT and _got_terminal_interrupt(process)):
+                    process.send_signal(signal.SIGTERM)
+        stopping = True
+        os.write(wake_write, b'\0')
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    print(f"🧩 Running {WORKER_COUNT} workers over {shard_count()} shards")
+    for index in range(WORKER_COUNT):
+        spawn(index)
+
+    try:
+        while workers or (restarts and not stopping):
+            now = time.monotonic()
+            for index, due in list(restarts.items()):
+                if stopping:
+                    restarts.clear()
+                elif due <= now:
+                    del restarts[index]
+                    spawn(index)
+
+            sentinels = [sentinel for _, _, sentinel in workers.values() if sentinel is not None]
+            timeout = None
+            if len(sentinels) < len(workers):
+                timeout = WORKER_POLL_INTERVAL  # No exit sentinel on this platform; poll instead
+            if restarts:
+                next_restart = max(0.0, min(restarts.values()) - now)
+                timeout = next_restart if timeout is None else min(timeout, next_restart)
+            if wake_read in wait([wake_read] + sentinels, timeout):
+                os.read(wake_read, 64)
+
+            for index, (process, started_at, sentinel) in list(workers.items()):
+                code = process.poll()
+                if code is None:
+                    continue
+                del workers[index]
+                if sentinel is not None:
+                    os.close(sentinel)
+                if stopping or code == 0:
+                    print(f"👋 Worker {index} stopped")
+                    continue
+                uptime = time.monotonic() - started_at
+                quick_failures[index] = quick_failures.get(index, 0) + 1 if uptime < WORKER_MIN_UPTIME else 1
+                if quick_failures[index] > WORKER_MAX_QUICK_FAILURES:
+                    print(f"❌ Worker {index} keeps failing (exit code {code}), not restarting it")
+                    continue
+                print(f"⚠️ Worker {index} exited with code {code} after {uptime:.0f}s, restarting in {WORKER_RESTART_DELAY:.0f}s")
+                restarts[index] = time.monotonic() + WORKER_RESTART_DELAY
+    finally:
+        os.close(wake_read)
+        os.close(wake_write)
+
+
+def _exit_sentinel(process):
+    """A file descriptor that becomes readable when process exits (Linux pidfd), or None"""
+    try:
+        return os.pidfd_open(process.pid)
+    except (AttributeError, OSError):
+        return None
+
+
+def _got_terminal_interrupt(process):
+    """Whether a Ctrl-C reached process directly: it shares our process group, which owns the terminal"""
+    for fd in (0, 1, 2):
+        try:
+            if os.isatty(fd):
+                return os.getpgid(process.pid) == os.getpgrp() == os.tcgetpgrp(fd)
+        except OSError:
+            return False
+    return False